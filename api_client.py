@@ -0,0 +1,214 @@
+"""
+API クライアント - Flet アプリ（base.py）から server.py の API を呼ぶ
+
+- requests.Session の接続プールを使い回し、接続を毎回張り直さない（keep-alive）
+- すべての呼び出しに接続・読み込みのタイムアウトを付ける
+- 接続の失敗と 502 / 503 / 504 は、間隔を広げながら自動で再試行する
+  （投票・お題の作成は二重に登録されないよう、サーバーに届いた後の再試行はしない）
+- GET の応答は ETag と一緒に持っておき、変わっていなければ 304 で本文を受け取らない
+
+どのメソッドも通信を待つので、画面の処理（UI スレッド）からは直接呼ばず、
+submit() でスレッドプールに渡すこと。
+"""
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Flet 版（base.py）が 8000 番で開くので、API は README の手順どおり 8001 番で起動したものを使う
+API_URL = os.environ.get("VOTE_API_URL", "http://127.0.0.1:8001")
+
+# (接続, 読み込み) のタイムアウト秒数
+TIMEOUT = (3.05, 10)
+
+
+class ApiError(Exception):
+    """API がエラーを返したか、サーバーにつながらなかった"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class ApiClient:
+    def __init__(self, base_url: str = API_URL, timeout=TIMEOUT, retries: int = 3, pool_size: int = 8):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            # 読み込みのタイムアウトや 5xx での再試行は、結果が変わらないメソッドだけにする
+            allowed_methods=frozenset({"GET", "PUT", "DELETE"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="api")
+        # GET の応答 {URL: (ETag, 本文)}
+        self._etags: Dict[str, Tuple[str, Any]] = {}
+        self._etags_lock = threading.Lock()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """fn をスレッドプールで実行する（UI スレッドを止めないため）"""
+        return self._executor.submit(fn, *args, **kwargs)
+
+    # --- 通信 ---
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise ApiError(f"サーバーに接続できません: {e}")
+        if response.status_code >= 400:
+            try:
+                detail = response.json().get("detail", response.text)
+            except ValueError:
+                detail = response.text
+            raise ApiError(str(detail), response.status_code)
+        return response
+
+    def _url(self, path: str, params: Optional[dict] = None) -> str:
+        return requests.Request("GET", self.base_url + path, params=params).prepare().url
+
+    def _get(self, path: str, params: Optional[dict] = None) -> Tuple[Any, requests.Response]:
+        """GET して (本文の JSON, 応答) を返す。ETag が一致すれば前回の本文を使う"""
+        url = self._url(path, params)
+        with self._etags_lock:
+            cached = self._etags.get(url)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        response = self._request("GET", path, params=params, headers=headers)
+        if response.status_code == 304 and cached:
+            return cached[1], response
+        data = response.json()
+        etag = response.headers.get("ETag")
+        if etag:
+            with self._etags_lock:
+                self._etags[url] = (etag, data)
+        return data, response
+
+    # --- お題 ---
+
+    def get_active_question(self) -> dict:
+        return self._get("/api/question")[0]
+
+    def get_question(self, question_id: int) -> dict:
+        return self._get(f"/api/question/{question_id}")[0]
+
+    def get_questions(
+        self, limit: Optional[int] = None, cursor: Optional[int] = None,
+        search: Optional[str] = None, include_results: bool = False,
+    ) -> Tuple[List[dict], Optional[int]]:
+        """お題を新しい順に (一覧, 次の cursor) で返す。limit を省略すると全件"""
+        params = {"limit": limit, "cursor": cursor, "search": search or None}
+        if include_results:
+            params["include"] = "results"
+        items, response = self._get("/api/questions", {k: v for k, v in params.items() if v is not None})
+        next_cursor = response.headers.get("X-Next-Cursor")
+        return items, int(next_cursor) if next_cursor else None
+
+    def get_history(self) -> List[str]:
+        return self._get("/api/history")[0]
+
+    def create_question(self, q: str, a: str, b: str) -> dict:
+        return self._request("POST", "/api/question", json={"q": q, "a": a, "b": b}).json()
+
+    def update_question(self, question_id: int, q: str, a: str, b: str) -> dict:
+        return self._request("PUT", f"/api/question/{question_id}", json={"q": q, "a": a, "b": b}).json()
+
+    def delete_question(self, question_id: int) -> dict:
+        return self._request("DELETE", f"/api/question/{question_id}").json()
+
+    # --- 投票・集計 ---
+
+    def post_vote(
+        self, question_id: int, choice: str, user_name: Optional[str] = None, vote_id: Optional[str] = None,
+    ) -> dict:
+        body = {"question_id": question_id, "choice": choice, "user_name": user_name, "vote_id": vote_id}
+        return self._request("POST", "/api/vote", json=body).json()
+
+    def post_votes(self, votes: List[dict]) -> dict:
+        """投票をまとめて送る（votes は {question_id, choice, user_name, voted_at, vote_id} のリスト）
+
+        返り値の results は送った順の1件ずつの結果。
+        """
+        return self._request("POST", "/api/votes/batch", json={"votes": votes}).json()
+
+    def get_results(self, question_id: int) -> dict:
+        """{"votes_A", "votes_B", "total", "percentage_A", "percentage_B", ...}"""
+        return self._get("/api/results", {"question_id": question_id})[0]
+
+    def cached_results(self, question_id: int) -> Optional[dict]:
+        """最後に受け取ったお題の集計結果（通信しない）。まだ受け取っていなければ None"""
+        with self._etags_lock:
+            cached = self._etags.get(self._url("/api/results", {"question_id": question_id}))
+        return cached[1] if cached else None
+
+
+class QuestionListCache:
+    """お題一覧の手元のコピー
+
+    画面は get() で手元の一覧をすぐに使い、refresh() が裏で最新の一覧に差し替える。
+    変更（作成・編集・削除）をした画面は、サーバーの応答を待たずに手元の一覧も書き換える。
+    version は一覧が変わるたびに増えるので、画面はこれを見て書き換えが必要かを判断できる。
+    """
+
+    def __init__(self, client: ApiClient):
+        self.client = client
+        self.version = 0
+        self._items: List[dict] = []
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._refreshing: Optional[Future] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self) -> List[dict]:
+        """手元の一覧（新しい順）。まだ読み込んでいなければ空"""
+        return self._items
+
+    def find(self, question_id: int) -> Optional[dict]:
+        return next((q for q in self._items if q["id"] == question_id), None)
+
+    def refresh(self, on_done: Optional[Callable[[Optional[Exception]], None]] = None) -> Future:
+        """最新の一覧を裏で取得する。取得中に呼ばれたら、取得中のものをそのまま返す"""
+        with self._lock:
+            if self._refreshing is None or self._refreshing.done():
+                self._refreshing = self.client.submit(self._load)
+            future = self._refreshing
+        if on_done is not None:
+            future.add_done_callback(lambda f: on_done(f.exception()))
+        return future
+
+    def _load(self):
+        items, _ = self.client.get_questions()
+        if items != self._items or not self._loaded:
+            self._items = items
+            self._loaded = True
+            self.version += 1
+
+    # 手元の一覧を書き換える（リストは差し替えるので、読む側はロック不要）
+
+    def put(self, question: dict):
+        items = [q for q in self._items if q["id"] != question["id"]]
+        items.append(question)
+        items.sort(key=lambda q: q["id"], reverse=True)
+        self._items = items
+        self.version += 1
+
+    def remove(self, question_id: int):
+        self._items = [q for q in self._items if q["id"] != question_id]
+        self.version += 1
@@ -0,0 +1,165 @@
+"""
+静的ファイルと画面の配信 - build_assets.py で作った static/dist/ を使う
+
+- static/dist/ のファイル名には中身のハッシュが入っているので、Cache-Control: immutable で
+  ブラウザに1年間持たせる（中身が変わればファイル名も変わる）
+- 同じ場所に .br / .gz の圧縮済みファイルがあれば、Accept-Encoding に合わせてそれを返す
+- テンプレートから描画した画面（/ と /sw.js）はメモリに持ち、テンプレートか manifest.json が
+  変わったときだけ描画し直す。圧縮もそのときに1回だけ行う
+"""
+import gzip
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli
+except ImportError:  # brotli は任意（なければ gzip だけ使う）
+    brotli = None
+
+STATIC_DIR = Path("static")
+DIST_DIR = STATIC_DIR / "dist"
+MANIFEST_FILE = "manifest.json"
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+# 圧縮済みファイルの拡張子（優先する順）
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> List[str]:
+    """Accept-Encoding で受け付けられる圧縮形式（q=0 のものは除く）"""
+    accepted = []
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        if name.strip():
+            accepted.append(name.strip().lower())
+    return accepted
+
+
+def load_manifest(dist_dir: Path = DIST_DIR) -> Dict[str, str]:
+    """{"css/style.css": "css/style.3f2a1b9c.css"}。ビルドしていなければ空"""
+    try:
+        with open(dist_dir / MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """static/dist/ を配信する（圧縮済みファイルを選び、immutable を付ける）"""
+
+    async def check_config(self):
+        # まだビルドしていなければ（ディレクトリがなければ）404 を返すだけにする
+        if Path(self.directory).is_dir():
+            await super().check_config()
+
+    async def get_response(self, path: str, scope) -> Response:
+        response = await super().get_response(path, scope)
+        if not isinstance(response, FileResponse) or response.status_code != 200:
+            return response
+        headers = dict((k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"])
+        accepted = accepted_encodings(headers.get("accept-encoding"))
+        for encoding, suffix in ENCODINGS:
+            compressed = Path(str(response.path) + suffix)
+            if encoding in accepted and compressed.is_file():
+                response = FileResponse(
+                    compressed, media_type=response.media_type, headers={"Content-Encoding": encoding}
+                )
+                break
+        response.headers["Cache-Control"] = IMMUTABLE
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+class RenderedPage:
+    """描画済みの画面1つ分（本文と圧縮したもの）"""
+
+    def __init__(self, body: bytes, media_type: str):
+        self.media_type = media_type
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        self.bodies = {"identity": body, "gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(body)
+
+    def response(self, accept_encoding: Optional[str], if_none_match: Optional[str]) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if if_none_match and self.etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, _ in ENCODINGS:
+            if encoding in accepted and encoding in self.bodies:
+                headers["Content-Encoding"] = encoding
+                return Response(self.bodies[encoding], media_type=self.media_type, headers=headers)
+        return Response(self.bodies["identity"], media_type=self.media_type, headers=headers)
+
+
+class PageCache:
+    """テンプレートを描画した画面をメモリに持つ
+
+    テンプレートのディレクトリと manifest.json の更新時刻を check_interval 秒に1回まで調べ、
+    変わっていたら次の要求で描画し直す。
+    """
+
+    def __init__(self, templates, template_dir: Path, dist_dir: Path = DIST_DIR, check_interval: float = 1.0):
+        self.templates = templates
+        self.template_dir = Path(template_dir)
+        self.dist_dir = Path(dist_dir)
+        self.check_interval = check_interval
+        self._pages: Dict[str, RenderedPage] = {}
+        self._stamp: Optional[Tuple] = None
+        self._checked_at = 0.0
+        self.manifest: Dict[str, str] = {}
+
+    def _current_stamp(self) -> Tuple:
+        files = [self.dist_dir / MANIFEST_FILE]
+        for root, _, names in os.walk(self.template_dir):
+            files += [Path(root) / name for name in names]
+        stamp = []
+        for path in sorted(files):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            stamp.append((str(path), st.st_mtime_ns, st.st_size))
+        return tuple(stamp)
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._stamp is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        stamp = self._current_stamp()
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self._pages = {}
+            self.manifest = load_manifest(self.dist_dir)
+
+    def asset_url(self, path: str) -> str:
+        """static/ 以下のファイルの URL（ビルド済みならハッシュ付きのファイル）"""
+        hashed = self.manifest.get(path)
+        return f"/static/dist/{hashed}" if hashed else f"/static/{path}"
+
+    def assets_version(self) -> str:
+        """ビルドした静的ファイルの版（ビルドしていなければ "dev"）"""
+        if not self.manifest:
+            return "dev"
+        return hashlib.sha256(json.dumps(self.manifest, sort_keys=True).encode()).hexdigest()[:8]
+
+    def get(self, name: str, media_type: str = "text/html") -> RenderedPage:
+        self._refresh()
+        page = self._pages.get(name)
+        if page is None:
+            body = self.templates.get_template(name).render(
+                asset=self.asset_url, assets_version=self.assets_version()
+            ).encode("utf-8")
+            page = self._pages[name] = RenderedPage(body, media_type)
+        return page
@@ -1,54 +1,19 @@
 import flet as ft
-import time
-import random
+import threading
+
+from api_client import ApiClient, ApiError, QuestionListCache
+from vote_queue import VoteQueue, VoteSyncer, estimate_results
  
 # ==========================================
-# データ・通信（モック）
+# データ・通信
 # ==========================================
-class DummyNetworkService:
-    # データを保存する擬似データベース
-    mock_db = [
-        {"id": 1, "q": "一生食べるならどっち？", "a": "高級寿司", "b": "至高の焼肉"},
-        {"id": 2, "q": "旅行に行くなら？", "a": "過去へ", "b": "未来へ"},
-        {"id": 3, "q": "住むならどっち？", "a": "極寒の地", "b": "灼熱の地"},
-    ]
- 
-    @staticmethod
-    def get_question():
-        if not DummyNetworkService.mock_db:
-            return {"q": "問題がありません", "a": "-", "b": "-"}
-        return random.choice(DummyNetworkService.mock_db)
- 
-    @staticmethod
-    def post_vote(choice):
-        return {
-            "success": True,
-            "current_votes": {
-                "A": random.randint(5, 20),
-                "B": random.randint(5, 20)
-            }
-        }
-    
-    @staticmethod
-    def get_history():
-        return [item["q"] for item in DummyNetworkService.mock_db]
- 
-    @staticmethod
-    def get_my_questions():
-        return DummyNetworkService.mock_db
- 
-    @staticmethod
-    def delete_question(q_id):
-        DummyNetworkService.mock_db = [q for q in DummyNetworkService.mock_db if q["id"] != q_id]
- 
-    @staticmethod
-    def update_question(q_id, new_q, new_a, new_b):
-        for item in DummyNetworkService.mock_db:
-            if item["id"] == q_id:
-                item["q"] = new_q
-                item["a"] = new_a
-                item["b"] = new_b
-                break
+# 接続プールとお題一覧の手元のコピーは、すべての画面（セッション）で共有する
+client = ApiClient()
+question_cache = QuestionListCache(client)
+# 投票は端末に保存してから裏で送る（サーバーにつながらなくても失われない）
+vote_queue = VoteQueue()
+vote_syncer = VoteSyncer(vote_queue, client)
+vote_syncer.start()
  
 # ==========================================
 # メイン処理
@@ -60,7 +25,115 @@ def main(page: ft.Page):
     
     # 状態管理用の変数
     current_editing_id = None
+    current_question_id = None
     last_choice = "A"
+    last_vote = None  # 最後に投票した内容（vote_queue.add() の返り値）
+    on_result_synced = None  # 表示中の結果画面が、送信の終わった投票を受け取る関数
+ 
+    # --- 通信まわり ---
+    def show_error(message):
+        page.snack_bar = ft.SnackBar(ft.Text(message))
+        page.snack_bar.open = True
+        page.update()
+ 
+    def run_in_background(fn, *args, on_success=None, on_error=None, error_message="通信に失敗しました"):
+        """通信を UI スレッドの外で行い、終わったら on_success(結果) か on_error() を呼ぶ"""
+        def done(future):
+            error = future.exception()
+            if error is not None:
+                show_error(f"{error_message}: {error}" if isinstance(error, ApiError) else error_message)
+                if on_error is not None:
+                    on_error()
+            elif on_success is not None:
+                on_success(future.result())
+        client.submit(fn, *args).add_done_callback(done)
+ 
+    def set_result_listener(listener):
+        nonlocal on_result_synced
+        on_result_synced = listener
+ 
+    def on_votes_synced(accepted, rejected):
+        listener = on_result_synced
+        if listener is not None:
+            listener(accepted, rejected)
+ 
+    def refresh_questions():
+        """お題一覧を裏で取り直し、作ってある画面の中身を書き換える"""
+        def done(error):
+            if error is not None:
+                show_error("お題一覧を取得できませんでした")
+            else:
+                refresh_views()
+        question_cache.refresh(done)
+ 
+    def change_questions(change, *args):
+        """手元のお題一覧を書き換え（question_cache.put / remove）、画面に反映する"""
+        change(*args)
+        refresh_views()
+ 
+    # --- 画面のキャッシュ ---
+    # ルートごとに作った View を使い回し、画面を移るたびに作り直さない。
+    # お題一覧が変わったときも作り直さず、View.data に入れた関数で中身（変わったコントロール）だけを書き換える
+    ui_lock = threading.RLock()
+    views = {}     # route -> (key, View)
+    rendered = {}  # route -> 中身を書き換えたときのお題一覧の版
+ 
+    def get_view(route, build, key=None):
+        """route の View を返す。key が前回と違うときだけ build() で作り直す"""
+        entry = views.get(route)
+        if entry is None or entry[0] != key:
+            entry = views[route] = (key, build())
+            rendered.pop(route, None)
+        sync_view(route, entry[1])
+        return entry[1]
+ 
+    def sync_view(route, view):
+        if view.data is not None and rendered.get(route) != question_cache.version:
+            view.data()
+            rendered[route] = question_cache.version
+ 
+    def refresh_views():
+        with ui_lock:
+            for route, (_, view) in list(views.items()):
+                sync_view(route, view)
+            page.update()
+ 
+    # 一覧は LIST_PAGE 件ずつ行を作り、末尾近くまでスクロールしたら続きを足す
+    # （数千件のお題があっても、作るコントロールは表示した分だけ）
+    LIST_PAGE = 50
+ 
+    def incremental_list(get_items, make_row, item_extent):
+        """get_items() の一覧を表示する ListView と、一覧に合わせて行を差し替える関数を返す
+
+        行はお題の id ごとに使い回し、内容が変わった行と増えた行だけを作る。
+        """
+        rows = {}  # id -> (お題, 行)
+        shown = LIST_PAGE
+ 
+        def render():
+            controls = []
+            alive = {}
+            for q in get_items()[:shown]:
+                row = rows.get(q["id"])
+                if row is None or row[0] != q:
+                    row = (q, make_row(q))
+                alive[q["id"]] = row
+                controls.append(row[1])
+            rows.clear()
+            rows.update(alive)
+            list_view.controls = controls
+ 
+        def on_scroll(e):
+            nonlocal shown
+            if e.pixels < e.max_scroll_extent - item_extent * 10 or shown >= len(get_items()):
+                return
+            with ui_lock:
+                shown += LIST_PAGE
+                render()
+                list_view.update()
+ 
+        list_view = ft.ListView(expand=True, item_extent=item_extent, on_scroll=on_scroll, on_scroll_interval=100)
+        return list_view, render
  
     # --- 共通パーツ ---
     def create_app_bar(title, color):
@@ -124,93 +197,165 @@ def main(page: ft.Page):
  
     # --- 2. 回答画面 ---
     def view_question():
-        q = DummyNetworkService.get_question()
+        question_text = ft.Text(size=24, weight=ft.FontWeight.BOLD)
+        label_a = ft.Text(color=ft.colors.WHITE, weight=ft.FontWeight.BOLD)
+        label_b = ft.Text(color=ft.colors.WHITE, weight=ft.FontWeight.BOLD)
+ 
+        def render():
+            nonlocal current_question_id
+            # 手元の一覧の先頭（いちばん新しいお題）を出す。通信は待たない
+            items = question_cache.get()
+            if items:
+                q = items[0]
+            elif question_cache.loaded:
+                q = {"q": "問題がありません", "a": "-", "b": "-"}
+            else:
+                q = {"q": "読み込み中…", "a": "-", "b": "-"}
+            current_question_id = q.get("id")
+            question_text.value = f"Q. {q['q']}"
+            label_a.value = q["a"]
+            label_b.value = q["b"]
         
         def on_vote(choice):
-            nonlocal last_choice
+            nonlocal last_choice, last_vote
+            if current_question_id is None:
+                return
             last_choice = choice
+            # 投票は端末に保存して結果画面へすぐに移る（送信は vote_syncer が裏で行う）
+            last_vote = vote_queue.add(current_question_id, choice)
+            vote_syncer.wake()
             page.go("/result")
  
-        def create_circle_btn(text, color, choice):
+        def create_circle_btn(label, color, choice):
             return ft.Container(
-                content=ft.Text(text, color=ft.colors.WHITE, weight=ft.FontWeight.BOLD),
+                content=label,
                 width=150, height=150, bgcolor=color, border_radius=75,
                 alignment=ft.alignment.center,
                 on_click=lambda e: on_vote(choice),
                 shadow=ft.BoxShadow(blur_radius=10, color=ft.colors.with_opacity(0.3, color))
             )
  
-        q_text = q.get("q", q.get("question", "No Question"))
-        op_a = q.get("a", q.get("optionA", "A"))
-        op_b = q.get("b", q.get("optionB", "B"))
- 
         return ft.View(
             "/question",
             [
                 create_app_bar("回答画面", ft.colors.ORANGE_400),
                 ft.Container(height=40),
-                ft.Text(f"Q. {q_text}", size=24, weight=ft.FontWeight.BOLD),
+                question_text,
                 ft.Container(height=60),
                 ft.Row(
                     [
-                        create_circle_btn(op_a, ft.colors.RED_400, "A"),
+                        create_circle_btn(label_a, ft.colors.RED_400, "A"),
                         ft.Container(width=30),
-                        create_circle_btn(op_b, ft.colors.BLUE_400, "B"),
+                        create_circle_btn(label_b, ft.colors.BLUE_400, "B"),
                     ], alignment=ft.MainAxisAlignment.CENTER
                 )
             ],
             horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-            bgcolor=ft.colors.WHITE
+            bgcolor=ft.colors.WHITE,
+            data=render
         )
  
     # --- 3. 結果画面 ---
     def view_result():
-        result_data = DummyNetworkService.post_vote(last_choice)
-        votes_a = result_data["current_votes"]["A"]
-        votes_b = result_data["current_votes"]["B"]
-        total = votes_a + votes_b
-        w_a = (votes_a / total) * 300 if total > 0 else 0
-        w_b = (votes_b / total) * 300 if total > 0 else 0
+        widths = {"A": 0, "B": 0}
+        label_a = ft.Text("A: -票", color=ft.colors.WHITE)
+        label_b = ft.Text("B: -票", color=ft.colors.WHITE)
+        status = ft.Text("投票がありません", size=24, weight=ft.FontWeight.BOLD)
+        vote = last_vote
  
         bar_a = ft.Container(
-            content=ft.Text(f"A: {votes_a}票", color=ft.colors.WHITE),
+            content=label_a,
             width=0, height=50, bgcolor=ft.colors.RED_400, border_radius=5,
             alignment=ft.alignment.center,
             animate=ft.animation.Animation(800, ft.AnimationCurve.ELASTIC_OUT)
         )
         bar_b = ft.Container(
-            content=ft.Text(f"B: {votes_b}票", color=ft.colors.WHITE),
+            content=label_b,
             width=0, height=50, bgcolor=ft.colors.BLUE_400, border_radius=5,
             alignment=ft.alignment.center,
             animate=ft.animation.Animation(800, ft.AnimationCurve.ELASTIC_OUT)
         )
  
+        def grow_bars():
+            bar_a.width = widths["A"]
+            bar_b.width = widths["B"]
+            bar_a.update()
+            bar_b.update()
+ 
         def open_result(e):
             e.control.visible = False
             result_col.visible = True
             page.update()
-            time.sleep(0.1)
-            bar_a.width = w_a
-            bar_b.width = w_b
-            bar_a.update()
-            bar_b.update()
+            # 幅 0 の棒が表示されてから伸ばす（UI スレッドでは待たない）
+            threading.Timer(0.1, grow_bars).start()
  
         result_col = ft.Column([
             ft.Row([bar_a, ft.Container(width=10), ft.Text("VS"), ft.Container(width=10), bar_b], alignment=ft.MainAxisAlignment.CENTER),
         ], visible=False)
  
+        open_button = ft.Container(
+            content=ft.Text("結果をオープン！", color=ft.colors.WHITE),
+            width=200, height=50, bgcolor=ft.colors.ORANGE_400, border_radius=25,
+            alignment=ft.alignment.center, on_click=open_result, disabled=True
+        )
+ 
+        def show_results(result_data):
+            votes_a = result_data["votes_A"]
+            votes_b = result_data["votes_B"]
+            total = votes_a + votes_b
+            widths["A"] = (votes_a / total) * 300 if total > 0 else 0
+            widths["B"] = (votes_b / total) * 300 if total > 0 else 0
+            label_a.value = f"A: {votes_a}票"
+            label_b.value = f"B: {votes_b}票"
+            open_button.disabled = False
+            if result_col.visible:
+                bar_a.width = widths["A"]
+                bar_b.width = widths["B"]
+ 
+        def show_server_results(result_data):
+            show_results(result_data)
+            page.update()
+ 
+        def on_synced(accepted, rejected):
+            # vote_syncer のスレッドから呼ばれる
+            for rejected_vote, detail in rejected:
+                if rejected_vote["vote_id"] == vote["vote_id"]:
+                    status.value = "投票できませんでした"
+                    page.update()
+                    show_error(f"投票できませんでした: {detail}")
+                    return
+            if any(v["vote_id"] == vote["vote_id"] for v in accepted):
+                status.value = "投票完了！"
+            if any(v["question_id"] == vote["question_id"] for v in accepted):
+                run_in_background(client.get_results, vote["question_id"], on_success=show_server_results)
+            page.update()
+ 
+        if vote is not None:
+            # 送信を待たずに、手元の集計結果に送信待ちの票を足した見込みを出す
+            show_results(estimate_results(client, vote_queue, vote["question_id"]))
+            if vote_syncer.last_error is None:
+                status.value = "投票を保存しました（送信中…）"
+            else:
+                status.value = "投票を保存しました（つながったら送信します）"
+            set_result_listener(on_synced)
+            if not vote_queue.contains(vote["vote_id"]):
+                # 画面を作る前に送信が終わっていた（受け付けられたとは限らない）
+                outcome = vote_syncer.outcome(vote["vote_id"])
+                if outcome is not None:
+                    ok, detail = outcome
+                    if ok:
+                        on_synced([vote], [])
+                    else:
+                        on_synced([], [(vote, detail)])
+ 
         return ft.View(
             "/result",
             [
                 create_app_bar("集計結果", ft.colors.RED_400),
                 ft.Container(height=30),
-                ft.Text("投票完了！", size=24, weight=ft.FontWeight.BOLD),
+                status,
                 ft.Container(height=30),
-                ft.Container(
-                    content=ft.Text("結果をオープン！", color=ft.colors.WHITE),
-                    width=200, height=50, bgcolor=ft.colors.ORANGE_400, border_radius=25,
-                    alignment=ft.alignment.center, on_click=open_result
-                ),
+                open_button,
                 result_col,
                 ft.Container(height=50),
                 ft.Container(content=ft.Text("トップに戻る", color=ft.colors.BLUE), padding=10, on_click=lambda _: page.go("/"))
@@ -220,6 +365,22 @@ def main(page: ft.Page):
  
     # --- 4. 問題登録画面 ---
     def view_create():
+        tf_q = ft.TextField(label="質問文", width=300)
+        tf_a = ft.TextField(label="選択肢A", width=300)
+        tf_b = ft.TextField(label="選択肢B", width=300)
+ 
+        def create(e):
+            if not (tf_q.value and tf_a.value and tf_b.value):
+                show_error("質問文と選択肢を入力してください")
+                return
+            run_in_background(
+                client.create_question, tf_q.value, tf_a.value, tf_b.value,
+                on_success=lambda q: change_questions(question_cache.put, q), error_message="登録に失敗しました"
+            )
+            # 画面は使い回すので、次に開いたときのために入力欄を空にしておく
+            tf_q.value = tf_a.value = tf_b.value = ""
+            page.go("/")
+ 
         return ft.View(
             "/create",
             [
@@ -227,11 +388,9 @@ def main(page: ft.Page):
                 ft.Container(height=30),
                 ft.Text("新しい2択を作ろう", size=20),
                 ft.Container(height=20),
-                ft.TextField(label="質問文", width=300),
-                ft.TextField(label="選択肢A", width=300),
-                ft.TextField(label="選択肢B", width=300),
+                tf_q, tf_a, tf_b,
                 ft.Container(height=20),
-                ft.ElevatedButton("登録する", bgcolor=ft.colors.GREEN_500, color=ft.colors.WHITE, width=150, on_click=lambda _: page.go("/")),
+                ft.ElevatedButton("登録する", bgcolor=ft.colors.GREEN_500, color=ft.colors.WHITE, width=150, on_click=create),
                 ft.TextButton("キャンセル", on_click=lambda _: page.go("/"))
             ],
             horizontal_alignment=ft.CrossAxisAlignment.CENTER, bgcolor=ft.colors.WHITE
@@ -239,63 +398,66 @@ def main(page: ft.Page):
  
     # --- 5. 履歴画面 ---
     def view_history():
-        history_items = DummyNetworkService.get_history()
+        # 履歴は古い順
+        history_list, render = incremental_list(
+            lambda: question_cache.get()[::-1],
+            lambda q: ft.ListTile(leading=ft.Icon(ft.icons.HISTORY), title=ft.Text(q["q"])),
+            item_extent=56
+        )
         return ft.View(
             "/history",
             [
                 create_app_bar("過去の履歴", ft.colors.PURPLE_600),
-                ft.ListView([ft.ListTile(leading=ft.Icon(ft.icons.HISTORY), title=ft.Text(item)) for item in history_items], expand=True)
-            ], bgcolor=ft.colors.WHITE
+                history_list
+            ], bgcolor=ft.colors.WHITE, data=render
         )
  
     # --- 6. 編集リスト画面 ---
     def view_edit_list():
-        my_questions = DummyNetworkService.get_my_questions()
-        
         def delete_item(e, q_id):
-            DummyNetworkService.delete_question(q_id)
-            route_change(ft.RouteChange(page.route))
+            # 手元の一覧から先に消して行だけを取り除き、サーバーへの削除は裏で送る（失敗したら一覧を取り直す）
+            change_questions(question_cache.remove, q_id)
+            run_in_background(client.delete_question, q_id, on_error=refresh_questions, error_message="削除に失敗しました")
  
         def go_to_edit(q_id):
             nonlocal current_editing_id
             current_editing_id = q_id
             page.go("/edit_detail")
  
-        controls = []
-        for q in my_questions:
+        def make_row(q):
             current_id = q["id"]
-            controls.append(
-                ft.ListTile(
-                    title=ft.Text(q["q"], max_lines=1, overflow=ft.TextOverflow.ELLIPSIS),
-                    subtitle=ft.Text(f"A: {q['a']} / B: {q['b']}"),
-                    trailing=ft.Row(
-                        [
-                            ft.IconButton(ft.icons.EDIT, icon_color=ft.colors.BLUE, on_click=lambda e, x=current_id: go_to_edit(x)),
-                            ft.IconButton(ft.icons.DELETE, icon_color=ft.colors.RED, on_click=lambda e, x=current_id: delete_item(e, x)),
-                        ],
-                        alignment=ft.MainAxisAlignment.END,
-                        width=100
-                    )
+            return ft.ListTile(
+                title=ft.Text(q["q"], max_lines=1, overflow=ft.TextOverflow.ELLIPSIS),
+                subtitle=ft.Text(f"A: {q['a']} / B: {q['b']}"),
+                trailing=ft.Row(
+                    [
+                        ft.IconButton(ft.icons.EDIT, icon_color=ft.colors.BLUE, on_click=lambda e, x=current_id: go_to_edit(x)),
+                        ft.IconButton(ft.icons.DELETE, icon_color=ft.colors.RED, on_click=lambda e, x=current_id: delete_item(e, x)),
+                    ],
+                    alignment=ft.MainAxisAlignment.END,
+                    width=100
                 )
             )
  
+        edit_list, render = incremental_list(question_cache.get, make_row, item_extent=72)
+ 
         return ft.View(
             "/edit_list",
             [
                 create_app_bar("問題の編集・削除", ft.colors.BROWN_400),
-                ft.ListView(controls, expand=True),
+                edit_list,
                 ft.Container(
                     content=ft.Text("トップに戻る", color=ft.colors.BROWN),
                     padding=20,
                     alignment=ft.alignment.center,
                     on_click=lambda _: page.go("/")
                 )
-            ], bgcolor=ft.colors.WHITE
+            ], bgcolor=ft.colors.WHITE, data=render
         )
  
     # --- 7. 編集詳細画面 ---
     def view_edit_detail(q_id):
-        target_q = next((item for item in DummyNetworkService.mock_db if item["id"] == q_id), None)
+        target_q = question_cache.find(q_id)
         
         if not target_q:
             return ft.View("/edit_detail", [create_app_bar("エラー", ft.colors.GREY), ft.Text("データが見つかりません")])
@@ -305,7 +467,17 @@ def main(page: ft.Page):
         tf_b = ft.TextField(label="選択肢B", value=target_q["b"], width=300)
  
         def save_changes(e):
-            DummyNetworkService.update_question(q_id, tf_q.value, tf_a.value, tf_b.value)
+            change_questions(question_cache.put, {"id": q_id, "q": tf_q.value, "a": tf_a.value, "b": tf_b.value})
+            run_in_background(
+                client.update_question, q_id, tf_q.value, tf_a.value, tf_b.value,
+                on_success=lambda q: change_questions(question_cache.put, q),
+                on_error=refresh_questions, error_message="保存に失敗しました"
+            )
+            page.go("/edit_list")
+ 
+        def cancel(e):
+            # 入力途中の内容を残さないよう、次は作り直させる
+            views.pop("/edit_detail", None)
             page.go("/edit_list")
  
         return ft.View(
@@ -316,32 +488,47 @@ def main(page: ft.Page):
                 tf_q, tf_a, tf_b,
                 ft.Container(height=20),
                 ft.ElevatedButton("変更を保存", bgcolor=ft.colors.BROWN_400, color=ft.colors.WHITE, width=150, on_click=save_changes),
-                ft.TextButton("キャンセル", on_click=lambda _: page.go("/edit_list"))
+                ft.TextButton("キャンセル", on_click=cancel)
             ],
             horizontal_alignment=ft.CrossAxisAlignment.CENTER, bgcolor=ft.colors.WHITE
         )
  
     # --- ルーティング管理 ---
+    # ルートごとに重ねる View（戻るボタンで1つ前の View に戻る）
+    route_stacks = {
+        "/question": ["/question"],
+        "/create": ["/create"],
+        "/history": ["/history"],
+        "/edit_list": ["/edit_list"],
+        "/edit_detail": ["/edit_list", "/edit_detail"],
+        "/result": ["/question", "/result"],
+    }
+ 
+    def build_view(route):
+        if route == "/question":
+            return get_view(route, view_question)
+        if route == "/result":
+            # 結果画面は投票ごとに作る
+            return get_view(route, view_result, key=last_vote["vote_id"] if last_vote else None)
+        if route == "/create":
+            return get_view(route, view_create)
+        if route == "/history":
+            return get_view(route, view_history)
+        if route == "/edit_list":
+            return get_view(route, view_edit_list)
+        if route == "/edit_detail":
+            target_q = question_cache.find(current_editing_id)
+            key = (current_editing_id, tuple(target_q.items()) if target_q else None)
+            return get_view(route, lambda: view_edit_detail(current_editing_id), key=key)
+        return get_view("/", view_top)
+ 
     def route_change(route):
-        page.views.clear()
-        page.views.append(view_top())
- 
-        if page.route == "/question":
-            page.views.append(view_question())
-        elif page.route == "/create":
-            page.views.append(view_create())
-        elif page.route == "/history":
-            page.views.append(view_history())
-        elif page.route == "/edit_list":
-            page.views.append(view_edit_list())
-        elif page.route == "/edit_detail":
-            page.views.append(view_edit_list())
-            page.views.append(view_edit_detail(current_editing_id))
-        elif page.route.startswith("/result"):
-            page.views.append(view_question())
-            page.views.append(view_result())
-            
-        page.update()
+        with ui_lock:
+            name = "/result" if page.route.startswith("/result") else page.route
+            # 作ってある View はそのまま並べ直すだけなので、送られるのは増えた View と変わったコントロールだけ
+            page.views.clear()
+            page.views.extend(build_view(r) for r in ["/"] + route_stacks.get(name, []))
+            page.update()
  
     def view_pop(view):
         page.views.pop()
@@ -350,7 +537,11 @@ def main(page: ft.Page):
  
     page.on_route_change = route_change
     page.on_view_pop = view_pop
+    vote_syncer.add_listener(on_votes_synced)
+    page.on_close = lambda _: vote_syncer.remove_listener(on_votes_synced)
     page.go(page.route)
+    # 画面を出してから、お題一覧を裏で最新にする
+    refresh_questions()
  
 #  Webブラウザでポート8000で開く設定
 ft.app(target=main, view=ft.WEB_BROWSER, port=8000)
\ No newline at end of file
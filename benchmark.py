@@ -0,0 +1,267 @@
+"""
+ベンチマーク - 代表的な使い方でサーバーの処理能力と応答時間を測り、JSON で出力する
+
+使い方:
+    python benchmark.py                                  # 全シナリオをプロセス内（ASGI）で実行
+    python benchmark.py --target uvicorn --workers 4     # 実際に uvicorn を起動して測る
+    python benchmark.py --dataset 1000000 --scenario vote_storm results_polling
+    python benchmark.py --output base.json               # 結果を保存
+    python benchmark.py --baseline base.json             # 保存した結果と比べ、悪化していたら終了コード 1
+
+シナリオ:
+- vote_storm       1つのお題に --concurrency 並列で投票し続ける
+- results_polling  --clients 台のクライアントが同じお題の結果を取得し続ける
+- mixed_crud       お題の作成・編集・削除と一覧の取得を混ぜて行う
+
+--dataset 件の投票を事前に投入してから測る（既定 1000。1000000 まで想定）。
+一時ディレクトリにデータを作るため、data/ や vote_app.db には触れない。
+比較では、処理能力（req/s）が --tolerance（既定 10%）より下がったか、
+p95 / p99 の応答時間が --tolerance より延びたシナリオを悪化として報告する。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+
+SCENARIOS = ["vote_storm", "results_polling", "mixed_crud"]
+SEED_CHUNK = 10000
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_load(requests_total: int, concurrency: int, send: Callable[[int], Awaitable[httpx.Response]]) -> dict:
+    """send(i) を requests_total 回、concurrency 並列で呼び、処理能力と応答時間をまとめる"""
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests_total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await send(i)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests_total,
+        "errors": errors,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(requests_total / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p95": round(percentile(latencies, 95) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+    }
+
+
+# --- シナリオ ---
+
+async def seed(client: httpx.AsyncClient, question_ids: List[int], votes: int):
+    """一括投票 API で votes 件の投票を投入する"""
+    for start in range(0, votes, SEED_CHUNK):
+        count = min(SEED_CHUNK, votes - start)
+        batch = [{"question_id": random.choice(question_ids), "choice": random.choice("AB")} for _ in range(count)]
+        r = await client.post("/api/votes/batch", json={"votes": batch})
+        r.raise_for_status()
+
+
+async def vote_storm(client: httpx.AsyncClient, args, question_id: int) -> dict:
+    return await run_load(args.requests, args.concurrency, lambda i: client.post(
+        "/api/vote", json={"question_id": question_id, "choice": "AB"[i % 2]}
+    ))
+
+
+async def results_polling(client: httpx.AsyncClient, args, question_id: int) -> dict:
+    return await run_load(args.requests, args.clients, lambda i: client.get(
+        "/api/results", params={"question_id": question_id}
+    ))
+
+
+async def mixed_crud(client: httpx.AsyncClient, args, question_id: int) -> dict:
+    created: List[int] = []
+
+    async def send(i: int) -> httpx.Response:
+        op = i % 4
+        if op == 0 or not created:
+            r = await client.post("/api/question", json={"q": f"bench {i}", "a": "A", "b": "B"})
+            if r.status_code == 200:
+                created.append(r.json()["id"])
+            return r
+        if op == 1:
+            # 削除と競合しないよう、消さないお題を編集する
+            return await client.put(f"/api/question/{question_id}", json={"q": f"benchmark {i}"})
+        if op == 2:
+            return await client.get("/api/questions", params={"limit": 30})
+        return await client.delete(f"/api/question/{created.pop()}")
+
+    return await run_load(args.requests, args.concurrency, send)
+
+
+SCENARIO_FUNCS = {
+    "vote_storm": vote_storm,
+    "results_polling": results_polling,
+    "mixed_crud": mixed_crud,
+}
+
+
+async def run_scenarios(client: httpx.AsyncClient, args) -> Dict[str, dict]:
+    question_id = (await client.post("/api/question", json={"q": "benchmark", "a": "A", "b": "B"})).json()["id"]
+    started = time.perf_counter()
+    await seed(client, [question_id], args.dataset)
+    print(f"{args.dataset} 票を投入（{time.perf_counter() - started:.1f} 秒）", file=sys.stderr)
+
+    results = {}
+    for name in args.scenario:
+        results[name] = await SCENARIO_FUNCS[name](client, args, question_id)
+        print(f"{name}: {results[name]['throughput_rps']} req/s, p95 {results[name]['latency_ms']['p95']} ms", file=sys.stderr)
+    return results
+
+
+# --- 実行先 ---
+
+def configure_env(args, data_dir: Path) -> dict:
+    return {
+        "STORAGE_BACKEND": args.backend,
+        "DATA_DIR": str(data_dir),
+        "SQLITE_PATH": str(data_dir / "vote_app.db"),
+        "VOTE_BULK_LIMIT": str(SEED_CHUNK),
+    }
+
+
+async def run_asgi(args, data_dir: Path) -> Dict[str, dict]:
+    # server.py は読み込み時に環境変数を読むので、先に設定してから import する
+    os.environ.update(configure_env(args, data_dir))
+    import server
+
+    async with server.lifespan(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_scenarios(client, args)
+
+
+async def run_uvicorn(args, data_dir: Path) -> Dict[str, dict]:
+    from stress_votes import start_server, stop_server
+
+    os.environ.update(configure_env(args, data_dir))
+    proc = start_server(args.port, args.workers, args.backend, data_dir)
+    try:
+        limits = httpx.Limits(max_connections=max(args.concurrency, args.clients))
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as client:
+            return await run_scenarios(client, args)
+    finally:
+        stop_server(proc)
+
+
+# --- 比較 ---
+
+def compare(current: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[dict]:
+    """基準の結果と比べ、シナリオごとの差と悪化の有無を返す"""
+    rows = []
+    for name, result in current.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        checks = {
+            "throughput_rps": (result["throughput_rps"], base["throughput_rps"], True),
+            "p95_ms": (result["latency_ms"]["p95"], base["latency_ms"]["p95"], False),
+            "p99_ms": (result["latency_ms"]["p99"], base["latency_ms"]["p99"], False),
+        }
+        for metric, (now, before, higher_is_better) in checks.items():
+            change = (now - before) / before if before else 0.0
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            rows.append({
+                "scenario": name,
+                "metric": metric,
+                "baseline": before,
+                "current": now,
+                "change": round(change, 4),
+                "regressed": regressed,
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--target", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--dataset", type=int, default=1000, help="事前に投入する投票数")
+    parser.add_argument("--requests", type=int, default=2000, help="シナリオごとのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--clients", type=int, default=500, help="results_polling の同時クライアント数")
+    parser.add_argument("--workers", type=int, default=1, help="--target uvicorn のワーカー数")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", type=Path, help="結果の JSON を保存するファイル")
+    parser.add_argument("--baseline", type=Path, help="比較する基準の結果（--output で保存したもの）")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        runner = run_asgi if args.target == "asgi" else run_uvicorn
+        scenarios = asyncio.run(runner(args, Path(tmp)))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "target": args.target,
+            "backend": args.backend,
+            "workers": args.workers if args.target == "uvicorn" else 1,
+            "dataset": args.dataset,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "clients": args.clients,
+        },
+        "scenarios": scenarios,
+    }
+
+    exit_code = 0
+    if args.baseline is not None:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(scenarios, baseline["scenarios"], args.tolerance)
+        report["comparison"] = {"baseline": str(args.baseline), "tolerance": args.tolerance, "results": rows}
+        for row in rows:
+            mark = "NG" if row["regressed"] else "OK"
+            print(f"{mark} {row['scenario']} {row['metric']}: {row['baseline']} -> {row['current']} ({row['change']:+.1%})", file=sys.stderr)
+        if any(row["regressed"] for row in rows):
+            exit_code = 1
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output is not None:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    print(text)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
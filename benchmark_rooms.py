@@ -0,0 +1,170 @@
+"""
+ルームのベンチマーク - ルームの数を増やしても、投票と結果取得の応答時間が変わらないことを確かめる
+
+使い方:
+    python benchmark_rooms.py                              # 1, 10, 100, 300 ルームで測る（プロセス内・ASGI）
+    python benchmark_rooms.py --rooms 1 100 500 --backend sqlite
+    python benchmark_rooms.py --target uvicorn --output rooms.json
+
+ルームの数ごとに、
+1. ルームを開いてそれぞれにお題を1つ作る
+2. 混雑したルーム（busy）に --busy-concurrency 並列で投票し続けながら、
+   他のルームへ無作為に投票・結果取得を --requests 回（--concurrency 並列）行い、その応答時間を測る
+最も少ないルーム数に比べて p95 が --max-growth 倍を超えたら終了コード 1。
+一時ディレクトリにデータを作るため、data/ や vote_app.db には触れない。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+from benchmark import configure_env, run_load
+
+BUSY_ROOM = "busy"
+
+
+async def measure(client: httpx.AsyncClient, args, room_count: int) -> dict:
+    names = [f"bench-{room_count}-{i}" for i in range(room_count)]
+    for start in range(0, room_count, args.concurrency):
+        responses = await asyncio.gather(*(
+            client.post(f"/api/rooms/{name}/question", json={"q": name, "a": "A", "b": "B"})
+            for name in names[start:start + args.concurrency]
+        ))
+        for r in responses:
+            r.raise_for_status()
+
+    stop = asyncio.Event()
+
+    async def busy_voter():
+        while not stop.is_set():
+            await client.post(f"/api/rooms/{BUSY_ROOM}/vote", json={"choice": random.choice("AB")})
+
+    async def send(i: int) -> httpx.Response:
+        name = random.choice(names)
+        if i % 2:
+            return await client.get(f"/api/rooms/{name}/results")
+        return await client.post(f"/api/rooms/{name}/vote", json={"choice": "AB"[i % 4 // 2]})
+
+    busy = [asyncio.create_task(busy_voter()) for _ in range(args.busy_concurrency)]
+    try:
+        result = await run_load(args.requests, args.concurrency, send)
+    finally:
+        stop.set()
+        await asyncio.gather(*busy)
+    result["rooms"] = room_count
+    return result
+
+
+async def run_all(client: httpx.AsyncClient, args) -> Dict[str, dict]:
+    r = await client.post(f"/api/rooms/{BUSY_ROOM}/question", json={"q": "busy", "a": "A", "b": "B"})
+    r.raise_for_status()
+    results = {}
+    for room_count in args.rooms:
+        results[str(room_count)] = await measure(client, args, room_count)
+        latency = results[str(room_count)]["latency_ms"]
+        print(f"{room_count} ルーム: p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms", file=sys.stderr)
+    return results
+
+
+def configure_rooms_env(args, data_dir: Path) -> dict:
+    # 測る間にルームが閉じられないようにし、上限も測るルームの数に合わせる
+    return {
+        **configure_env(args, data_dir),
+        "MAX_OPEN_ROOMS": str(sum(args.rooms) + 1),
+        "ROOM_IDLE_SECONDS": "3600",
+    }
+
+
+async def run_asgi(args, data_dir: Path) -> Dict[str, dict]:
+    os.environ.update(configure_rooms_env(args, data_dir))
+    import server
+
+    async with server.lifespan(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_all(client, args)
+
+
+async def run_uvicorn(args, data_dir: Path) -> Dict[str, dict]:
+    from stress_votes import start_server, stop_server
+
+    os.environ.update(configure_rooms_env(args, data_dir))
+    proc = start_server(args.port, 1, args.backend, data_dir)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency + args.busy_concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as client:
+            return await run_all(client, args)
+    finally:
+        stop_server(proc)
+
+
+def growth(results: Dict[str, dict]) -> List[dict]:
+    """最も少ないルーム数に比べた p95 / p99 の伸び（倍）"""
+    base = results[min(results, key=int)]["latency_ms"]
+    rows = []
+    for room_count, result in results.items():
+        latency = result["latency_ms"]
+        rows.append({
+            "rooms": int(room_count),
+            "p95_growth": round(latency["p95"] / base["p95"], 2) if base["p95"] else 0.0,
+            "p99_growth": round(latency["p99"] / base["p99"], 2) if base["p99"] else 0.0,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, nargs="+", default=[1, 10, 100, 300], help="測るルームの数")
+    parser.add_argument("--target", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--requests", type=int, default=2000, help="ルームの数ごとのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--busy-concurrency", type=int, default=32, help="混雑したルームへの並列投票数")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--output", type=Path, help="結果の JSON を保存するファイル")
+    parser.add_argument("--max-growth", type=float, default=2.0, help="許容する p95 の伸び（倍）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        runner = run_asgi if args.target == "asgi" else run_uvicorn
+        results = asyncio.run(runner(args, Path(tmp)))
+
+    rows = growth(results)
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "target": args.target,
+            "backend": args.backend,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "busy_concurrency": args.busy_concurrency,
+        },
+        "rooms": results,
+        "growth": rows,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output is not None:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    print(text)
+
+    worst = max(row["p95_growth"] for row in rows)
+    if worst > args.max_growth:
+        print(f"NG: ルームを増やすと p95 が {worst} 倍になりました（許容 {args.max_growth} 倍）", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
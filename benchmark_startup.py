@@ -0,0 +1,156 @@
+"""
+起動時間のベンチマーク - スナップショットの形式ごとに、起動時の読み込みにかかる時間とメモリを測る
+
+使い方:
+    python benchmark_startup.py                      # 100万票で votes.json と votes.bin を比べる
+    python benchmark_startup.py --votes 200000 --repeat 5
+    python benchmark_startup.py --output startup.json
+
+一時ディレクトリに同じ投票を持つ 2 つのデータ（旧形式 votes.json / バイナリ形式 votes.bin）を作り、
+それぞれ新しいプロセスで JsonRepository.open() と load_state()（サーバー起動時の読み込み）を行う。
+時間は --repeat 回のうち最短のもの、メモリはプロセスの最大 RSS（読み込み前との差も出す）。
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from repository import JsonRepository
+from snapshot import write_snapshot
+from vote_columns import VoteColumns
+
+FORMATS = ["json", "bin"]
+
+
+def max_rss_mb() -> float:
+    # Linux の ru_maxrss は exec 前（データを作った親プロセス）の値を引き継ぐので、VmHWM を使う
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS はバイト、それ以外は KB
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def measure(data_dir: Path):
+    """（子プロセス）起動時の読み込みを1回行い、結果を JSON で出力する"""
+    before = max_rss_mb()
+    started = time.perf_counter()
+    repository = JsonRepository(data_dir, [])
+    repository.open()
+    questions, rollups = repository.load_state()
+    elapsed = time.perf_counter() - started
+    votes = sum(a + b for minutes in rollups.values() for a, b in minutes.values())
+    print(json.dumps({
+        "seconds": elapsed,
+        "votes": votes,
+        "rss_before_mb": round(before, 1),
+        "peak_rss_mb": round(max_rss_mb(), 1),
+    }))
+    repository.close()
+
+
+def make_dataset(root: Path, votes: int, questions: int):
+    """root/json（votes.json）と root/bin（votes.bin）に同じデータを作る"""
+    question_list = [{"id": i, "q": f"お題 {i}", "a": "A", "b": "B"} for i in range(1, questions + 1)]
+    base = datetime(2025, 1, 1)
+    columns = VoteColumns()
+    columns.extend(
+        {
+            "question_id": i % questions + 1,
+            "choice": "AB"[i * 7919 % 3 == 0],
+            "user_name": None if i % 4 else f"user{i % 1000}",
+            "voted_at": (base + timedelta(microseconds=i * 250000)).isoformat(),
+        }
+        for i in range(votes)
+    )
+    for name in FORMATS:
+        data_dir = root / name
+        data_dir.mkdir()
+        (data_dir / "questions.json").write_text(json.dumps(question_list, ensure_ascii=False), encoding="utf-8")
+        (data_dir / "question_seq.json").write_text(json.dumps({"last_id": questions}), encoding="utf-8")
+
+    # 旧形式は畳み込みで書いていたものと同じ形（1件ずつ書き出して、辞書のリストは作らない）
+    with open(root / "json" / "votes.json", "w", encoding="utf-8") as f:
+        f.write('{"seq": 0, "votes": [')
+        for i, vote in enumerate(columns):
+            f.write((", " if i else "") + json.dumps(vote, ensure_ascii=False))
+        f.write("]}")
+    write_snapshot(root / "bin" / "votes.bin", 0, columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--votes", type=int, default=1000000)
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path, help="結果の JSON を保存するファイル")
+    parser.add_argument("--measure", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        measure(args.measure)
+        return 0
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        started = time.perf_counter()
+        make_dataset(root, args.votes, args.questions)
+        print(f"{args.votes} 票のデータを作成（{time.perf_counter() - started:.1f} 秒）", file=sys.stderr)
+
+        for name in FORMATS:
+            data_dir = root / name
+            snapshot = data_dir / ("votes.bin" if name == "bin" else "votes.json")
+            runs = []
+            for _ in range(args.repeat):
+                out = subprocess.run(
+                    [sys.executable, __file__, "--measure", str(data_dir)],
+                    check=True, capture_output=True, text=True,
+                )
+                runs.append(json.loads(out.stdout))
+            best = min(runs, key=lambda run: run["seconds"])
+            if best["votes"] != args.votes:
+                print(f"NG: {name} の票数が {best['votes']} です", file=sys.stderr)
+                return 1
+            results[name] = {
+                "file_bytes": snapshot.stat().st_size,
+                "seconds": round(best["seconds"], 4),
+                "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+                "rss_growth_mb": round(max(run["peak_rss_mb"] - run["rss_before_mb"] for run in runs), 1),
+            }
+            print(f"{name}: {results[name]['seconds']} 秒, 最大 RSS {results[name]['peak_rss_mb']} MB", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "votes": args.votes,
+            "questions": args.questions,
+            "repeat": args.repeat,
+        },
+        "formats": results,
+        "speedup": round(results["json"]["seconds"] / results["bin"]["seconds"], 1) if results["bin"]["seconds"] else None,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output is not None:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+静的ファイルのビルド - static/ の CSS・JavaScript を、中身のハッシュ入りのファイル名で static/dist/ に書き出す
+
+使い方:
+    python build_assets.py              # static/ → static/dist/
+    python build_assets.py --no-brotli  # .br を作らない
+
+- style.css は static/dist/css/style.<ハッシュ 8 桁>.css になる（中身が変わればファイル名も変わる）
+- それぞれ gzip（.gz）と brotli（.br、brotli パッケージがあれば）で圧縮したものも置く
+- 元のパスとハッシュ入りのパスの対応を static/dist/manifest.json に書く。
+  サーバーはこれを見て画面のリンクを書き換え、static/dist/ を Cache-Control: immutable で返す
+  （サーバーの起動中にビルドしても、次の画面の要求から新しいファイルを使う）
+- 前回のビルドのファイルは消す（古い画面を開いたままのブラウザのため、直前の1回分だけ残す）
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+from assets import DIST_DIR, MANIFEST_FILE, STATIC_DIR, brotli, load_manifest
+
+# ビルドするファイル（static/ からの相対パス）。sw.js は URL を変えられないのでテンプレート側で扱う
+ASSETS = ["css/style.css", "js/app.js"]
+HASH_LENGTH = 8
+
+
+def hashed_name(path: str, content: bytes) -> str:
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    stem, dot, suffix = path.rpartition(".")
+    return f"{stem}.{digest}.{suffix}"
+
+
+def write_variants(target: Path, content: bytes, use_brotli: bool) -> dict:
+    """target とその .gz・.br を書き、{ファイル名: バイト数} を返す"""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    variants = {"": content, ".gz": gzip.compress(content, 9, mtime=0)}
+    if use_brotli:
+        variants[".br"] = brotli.compress(content, quality=11)
+    sizes = {}
+    for suffix, data in variants.items():
+        path = Path(str(target) + suffix)
+        path.write_bytes(data)
+        sizes[path.name] = len(data)
+    return sizes
+
+
+def remove_stale(dist_dir: Path, keep: set):
+    """keep に入っていないビルド済みのファイルを消す"""
+    for path in dist_dir.rglob("*"):
+        if not path.is_file() or path.name == MANIFEST_FILE:
+            continue
+        base = str(path.relative_to(dist_dir).as_posix())
+        for suffix in (".gz", ".br"):
+            base = base.removesuffix(suffix)
+        if base not in keep:
+            path.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--static-dir", type=Path, default=STATIC_DIR)
+    parser.add_argument("--no-brotli", action="store_true", help=".br を作らない")
+    args = parser.parse_args()
+
+    dist_dir = args.static_dir / DIST_DIR.relative_to(STATIC_DIR)
+    use_brotli = brotli is not None and not args.no_brotli
+    if brotli is None and not args.no_brotli:
+        print("brotli パッケージがないので .br は作りません（pip install brotli）", file=sys.stderr)
+
+    previous = load_manifest(dist_dir)
+    manifest = {}
+    for path in ASSETS:
+        content = (args.static_dir / path).read_bytes()
+        manifest[path] = hashed_name(path, content)
+        sizes = write_variants(dist_dir / manifest[path], content, use_brotli)
+        print(f"{path} → {manifest[path]}  " + "  ".join(f"{name}: {size}" for name, size in sizes.items()))
+
+    remove_stale(dist_dir, set(manifest.values()) | set(previous.values()))
+    # manifest.json は最後に置き換える（書き出し中に画面を描画しても、まだないファイルを指さない）
+    tmp_path = dist_dir / (MANIFEST_FILE + ".tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2) + "\n", encoding="utf-8")
+    os.replace(tmp_path, dist_dir / MANIFEST_FILE)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+スナップショットの変換 - data/votes.json（旧形式）を data/votes.bin（snapshot.py の形式）に変換する
+
+サーバーも最初の畳み込みで同じ変換を行うが、投票が多いと最初の起動で時間がかかるので、
+サーバーを止めている間にこのスクリプトで変換しておくとよい。
+
+使い方:
+    python convert_snapshot.py                  # data/ を変換する
+    python convert_snapshot.py --data-dir path  # 別のディレクトリを変換する
+    python convert_snapshot.py --force          # votes.bin があっても作り直す
+
+ジャーナル（votes.ndjson）は変換しない。votes.json が記録している取り込み済みの seq を
+そのまま引き継ぐので、ジャーナルに残っている投票は起動時に従来どおり再生される。
+変換後、votes.json は読まれなくなる（消してもよいが、念のため残しておく）。
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+from locking import InterProcessLock
+from repository import JsonRepository
+from snapshot import Snapshot, write_snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", type=Path, default=Path(__file__).parent / "data")
+    parser.add_argument("--force", action="store_true", help="votes.bin があっても作り直す")
+    args = parser.parse_args()
+
+    repository = JsonRepository(args.data_dir, [])
+    if not repository.votes_file.exists():
+        print(f"{repository.votes_file} がありません")
+        return 1
+    if repository.snapshot_file.exists() and not args.force:
+        print(f"{repository.snapshot_file} はすでにあります（作り直すなら --force）")
+        return 1
+
+    # サーバーの畳み込みと重ならないようにする
+    lock = InterProcessLock(args.data_dir / ".compact.lock")
+    with lock.exclusive():
+        started = time.perf_counter()
+        seq, votes = repository._read_json_snapshot()
+        loaded = time.perf_counter()
+        size = write_snapshot(repository.snapshot_file, seq, votes)
+        written = time.perf_counter()
+    lock.close()
+
+    # 書き出したファイルを開き直し、集計が元と一致することを確かめる
+    with Snapshot(repository.snapshot_file) as snapshot:
+        if snapshot.seq != seq or snapshot.tally() != votes.tally():
+            print("NG: 変換後の集計が一致しません")
+            return 1
+
+    titles = {}
+    if repository.questions_file.exists():
+        with open(repository.questions_file, "r", encoding="utf-8") as f:
+            titles = {q["id"]: q["q"] for q in json.load(f)}
+    for question_id, (a, b) in sorted(votes.tally().items()):
+        title = titles.get(question_id, "（削除済み）")
+        print(f"  {question_id:>5}  A {a:>8}  B {b:>8}  {title}")
+    print(
+        f"{len(votes)} 票を変換（seq {seq}）: {repository.votes_file.stat().st_size} → {size} バイト、"
+        f"読み込み {loaded - started:.2f} 秒・書き出し {written - loaded:.2f} 秒"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
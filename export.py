@@ -0,0 +1,61 @@
+"""
+書き出し - 投票・集計結果の行を NDJSON / CSV のバイト列にしながら少しずつ返す
+
+- 行（辞書）はジェネレーターから1件ずつ受け取り、CHUNK_BYTES ほどたまったら返す。
+  全件をメモリに持たないので、何百万行あっても使うメモリは変わらない
+- StreamingResponse にそのまま渡せる（同期のジェネレーターはスレッドプールで回るので、
+  ファイルや DB を読んでいる間もイベントループは投票を受け付けられる）
+"""
+import csv
+import io
+import json
+from typing import Iterable, Iterator, List
+
+# 形式ごとの Content-Type
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+# 1回に返すバイト数の目安
+CHUNK_BYTES = 64 * 1024
+
+VOTE_FIELDS = ["question_id", "choice", "user_name", "voted_at"]
+RESULT_FIELDS = [
+    "question_id", "question", "optionA", "optionB",
+    "votes_A", "votes_B", "total", "percentage_A", "percentage_B",
+]
+
+
+def iter_ndjson(rows: Iterable[dict], fields: List[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(json.dumps({field: row.get(field) for field in fields}, ensure_ascii=False))
+        buffer.write("\n")
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iter_csv(rows: Iterable[dict], fields: List[str]) -> Iterator[bytes]:
+    """1行目は見出し。値がない欄（user_name など）は空にする"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore", lineterminator="\n")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iter_export(rows: Iterable[dict], fields: List[str], format: str) -> Iterator[bytes]:
+    """rows を format（FORMATS のいずれか）で書き出す"""
+    if format == "csv":
+        return iter_csv(rows, fields)
+    return iter_ndjson(rows, fields)
@@ -0,0 +1,126 @@
+"""
+グループコミット - 短い時間に届いた投票をまとめて1回の書き込み（1回の fsync）で保存する
+
+投票が殺到したときに1票ごとに fsync すると、ディスクの同期待ちがそのまま処理能力の上限になる。
+window 秒以内に届いた投票（最大 max_batch 件）を1つのバッチにまとめてコミットし、
+バッチに含まれた各リクエストには、コミットが完了してから応答を返す。
+
+- window を大きくすると1回あたりの書き込みにまとまる票数が増え、処理能力が上がる
+- その分、1票あたりの応答時間は最大で window だけ延びる
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+
+class CommitStats:
+    """バッチの大きさとコミットにかかった時間の集計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.votes = 0
+        self.max_batch_size = 0
+        self.last_batch_size = 0
+        self.commit_seconds_total = 0.0
+        self.commit_seconds_max = 0.0
+
+    def record(self, batch_size: int, seconds: float):
+        with self._lock:
+            self.batches += 1
+            self.votes += batch_size
+            self.last_batch_size = batch_size
+            self.max_batch_size = max(self.max_batch_size, batch_size)
+            self.commit_seconds_total += seconds
+            self.commit_seconds_max = max(self.commit_seconds_max, seconds)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "votes": self.votes,
+                "avg_batch_size": round(self.votes / self.batches, 2) if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "last_batch_size": self.last_batch_size,
+                "avg_commit_ms": round(self.commit_seconds_total / self.batches * 1000, 3) if self.batches else 0.0,
+                "max_commit_ms": round(self.commit_seconds_max * 1000, 3),
+            }
+
+
+class GroupCommitter:
+    def __init__(self, commit: Callable[[List[dict]], List[Optional[dict]]], window: float = 0.002, max_batch: int = 256):
+        """commit はバッチ内の投票を一度に保存し、投票ごとの結果（保存しなかったものは None）を返す"""
+        self._commit = commit
+        self.window = window
+        self.max_batch = max_batch
+        self.stats = CommitStats()
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="vote-committer", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """受け付け済みの投票をすべてコミットしてから止める"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, votes: List[dict]) -> Future:
+        """投票を登録する。返り値の Future はコミット完了後に投票ごとの結果のリストになる"""
+        future: Future = Future()
+        self._queue.put((votes, future))
+        return future
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            pending = [item]
+            size = len(item[0])
+            deadline = time.monotonic() + self.window
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                pending.append(item)
+                size += len(item[0])
+            self._flush(pending)
+        # 停止要求より後に積まれたものも取りこぼさない
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self._flush([item])
+
+    def _flush(self, pending):
+        batch = [vote for votes, _ in pending for vote in votes]
+        started = time.perf_counter()
+        try:
+            results = self._commit(batch)
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        self.stats.record(len(batch), time.perf_counter() - started)
+        i = 0
+        for votes, future in pending:
+            future.set_result(results[i:i + len(votes)])
+            i += len(votes)
@@ -0,0 +1,216 @@
+"""
+投票ジャーナル - 投票を1行1レコードの NDJSON として追記していくログ
+
+各レコードには単調増加する通し番号 seq が付く。
+- 投票:     {"seq": 12, "question_id": 3, "choice": "A", "user_name": null, "voted_at": "..."}
+            端末が id を付けた投票には "vote_id" も入る（再送の判定用）
+- 投票削除: {"seq": 13, "purge": 3}   （お題の削除に伴い、それまでの投票を消す）
+
+ファイルの先頭行は {"base": 11} のようなヘッダで、「seq 11 までは votes.bin に取り込み済み」を表す。
+スナップショット（votes.bin）も取り込み済みの seq を記録しているため、
+スナップショットの置き換えとジャーナルの切り詰めの間で落ちても二重計上は起きない。
+
+複数のプロセスが同じジャーナルに追記する場合、追記と切り詰めは呼び出し側がプロセス間ロックの
+排他ロックを取った状態で行い、追記の前に read_new() で他のプロセスの追記を読み終えておくこと。
+そうすることで seq はプロセスをまたいで単調増加になる。
+"""
+import json
+import os
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from metrics import STORAGE_BYTES, storage_operation
+
+
+class JournalReset(Exception):
+    """読み逃したレコードがすでにスナップショットに畳み込まれていた（全体を読み直す必要がある）"""
+
+
+class VoteJournal:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.last_seq = 0
+        self._file = None
+        self._reader = None
+        self._partial = b""
+
+    def open(self, last_seq: int = 0):
+        """追記用に開く。last_seq はここまでに読み込み済みの最終 seq"""
+        self.last_seq = max(self.last_seq, last_seq)
+        if not self.path.exists():
+            self._write_new(self.last_seq, b"")
+        self._file = open(self.path, "a+b")
+        # 他のプロセスの追記を読むための読み込み位置（ここまでは読み込み済み）
+        self._reader = open(self.path, "rb")
+        self._reader.seek(0, os.SEEK_END)
+        self._partial = b""
+
+    def close(self):
+        for f in (self._file, self._reader):
+            if f is not None:
+                f.close()
+        self._file = None
+        self._reader = None
+
+    def _write_new(self, base: int, body: bytes):
+        """ヘッダと body だけを持つ新しいジャーナルに置き換える"""
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps({"base": base}).encode("utf-8") + b"\n")
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _prepare_append(self):
+        """追記の前に、置き換わったファイルを開き直し、途中で途切れた末尾の行を取り除く"""
+        if os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino:
+            self._file.close()
+            self._file = open(self.path, "a+b")
+        fd = self._file.fileno()
+        size = os.fstat(fd).st_size
+        if size > 0 and os.pread(fd, 1, size - 1) != b"\n":
+            # 書き込み途中で落ちたプロセスが残した行。次の行とつながらないよう切り落とす
+            with open(self.path, "rb") as f:
+                data = f.read()
+            os.truncate(self.path, data.rfind(b"\n") + 1)
+
+    def append(self, record: dict) -> int:
+        """レコードを1行追記し、割り当てた seq を返す"""
+        return self.append_many([record])
+
+    def append_many(self, records: List[dict]) -> int:
+        """複数のレコードを1回の書き込みと1回の fsync で追記し、最後の seq を返す"""
+        with storage_operation("save_votes") as op:
+            self._prepare_append()
+            lines = []
+            for record in records:
+                self.last_seq += 1
+                lines.append(json.dumps({"seq": self.last_seq, **record}, ensure_ascii=False))
+            data = ("\n".join(lines) + "\n").encode("utf-8")
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            op.bytes += len(data)
+        return self.last_seq
+
+    def size(self) -> int:
+        """現在のジャーナルの大きさ（バイト）"""
+        return os.stat(self.path).st_size
+
+    def has_records(self) -> bool:
+        """ヘッダ以外のレコードがあるか"""
+        with open(self.path, "rb") as f:
+            first = f.readline()
+            if not first:
+                return False
+            return b'"base"' not in first or bool(f.read(1))
+
+    def seek_end(self, last_seq: int):
+        """読み込み位置をファイルの末尾に移す。last_seq はそこまでの最終 seq"""
+        self.last_seq = last_seq
+        if self._reader is not None:
+            self._reader.close()
+        self._reader = open(self.path, "rb")
+        self._reader.seek(0, os.SEEK_END)
+        self._partial = b""
+
+    def _read_lines(self) -> List[bytes]:
+        new = self._reader.read()
+        if new:
+            # 他のプロセスの追記の読み込みは頻繁で小さいので、バイト数だけ数える
+            STORAGE_BYTES.inc("load_votes", amount=len(new))
+        data = self._partial + new
+        lines = data.split(b"\n")
+        # 書き込み途中の最後の行は次回に持ち越す
+        self._partial = lines.pop()
+        return lines
+
+    def read_new(self) -> List[dict]:
+        """前回からジャーナルに追記された、まだ読んでいないレコードを返す
+
+        他のプロセスが切り詰めてファイルが置き換わっていた場合は、古いファイルの残りを読んでから
+        新しいファイルに移る。読み逃したレコードがすでにスナップショットに畳み込まれていた場合は
+        新しいファイルを最後まで読んでから JournalReset を送出する。
+        """
+        lines = self._read_lines()
+        if os.stat(self.path).st_ino != os.fstat(self._reader.fileno()).st_ino:
+            self._reader.close()
+            self._reader = open(self.path, "rb")
+            self._partial = b""
+            lines += self._read_lines()
+        records = []
+        reset = False
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "base" in record:
+                if record["base"] > self.last_seq:
+                    self.last_seq = record["base"]
+                    reset = True
+                continue
+            if record["seq"] > self.last_seq:
+                self.last_seq = record["seq"]
+                records.append(record)
+        if reset:
+            # 新しいファイルの残りも読み終えてから送出する。last_seq はファイルにある最後の seq になるので、
+            # 呼び出し側がそのまま追記しても seq は重複しない
+            raise JournalReset()
+        return records
+
+    def last_seq_before(self, offset: int) -> int:
+        """offset より前にある最後のレコードの seq（レコードがなければヘッダの base）"""
+        chunk = 4096
+        with open(self.path, "rb") as f:
+            while True:
+                start = max(0, offset - chunk)
+                f.seek(start)
+                lines = f.read(offset - start).split(b"\n")
+                if start > 0:
+                    # 途中から読んだ先頭の行は欠けている
+                    lines = lines[1:]
+                for line in reversed(lines):
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    return record["base"] if "base" in record else record["seq"]
+                if start == 0:
+                    return 0
+                chunk *= 4
+
+    def replay(self, after_seq: int = 0, until_seq: Optional[int] = None) -> Iterator[dict]:
+        """after_seq より新しい（until_seq 以下の）レコードを1行ずつ読み出す
+
+        ファイル全体を一度に読み込むことはしない。
+        """
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as f, storage_operation("load_votes") as op:
+            for line in f:
+                op.bytes += len(line)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で落ちた末尾の行は捨てる
+                    continue
+                if "base" in record:
+                    continue
+                seq = record["seq"]
+                if until_seq is not None and seq > until_seq:
+                    break
+                if seq > after_seq:
+                    yield record
+
+    def truncate_before(self, offset: int, base: int):
+        """offset より前（seq が base までのレコード）をジャーナルから取り除く"""
+        with open(self.path, "rb") as src:
+            src.seek(offset)
+            tail = src.read()
+        self._write_new(base, tail)
+        if self._file is not None:
+            self._prepare_append()
@@ -0,0 +1,131 @@
+"""
+集計結果のライブ配信 - 投票が入ったお題の最新の集計を、購読中のクライアントへ Server-Sent Events で送る
+
+- 投票が入るたびに VoteStore から notify() が呼ばれ、そのお題に「更新あり」の印を付ける
+- 配信用のタスクが min_interval 秒ごとに印の付いたお題だけをまとめて送るので、
+  どれだけ投票が殺到しても、1つのお題あたりの送信は 1/min_interval 回/秒 まで
+- 購読者ごとのキューには最新の集計だけを残すため、遅いクライアントがいても古い集計はたまらない
+- 複数ワーカーで動かす場合は poll に VoteStore.sync を渡すと、購読者がいる間は
+  min_interval 秒ごとに他のワーカーの投票を取り込んでから送る
+"""
+import asyncio
+import json
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+HEARTBEAT_SECONDS = 15.0
+
+# サーバーの終了を購読者に知らせる印（お題の削除を表す None とは区別する）
+_SHUTDOWN = object()
+
+
+class ResultsBroadcaster:
+    def __init__(
+        self,
+        build: Callable[[int], Optional[dict]],
+        min_interval: float = 0.25,
+        poll: Optional[Callable[[], Awaitable[None]]] = None,
+    ):
+        """build はお題の集計結果（削除済みなら None）を返す関数"""
+        self._build = build
+        self.min_interval = min_interval
+        self._poll = poll
+
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._dirty: Set[int] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # 購読中の接続を終わらせる。deleted は送らないので、ブラウザの EventSource は自分で再接続する
+        for queues in self._subscribers.values():
+            for queue in queues:
+                self._offer(queue, _SHUTDOWN)
+
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in list(self._subscribers.values()))
+
+    def notify(self, question_ids: Optional[Iterable[int]] = None):
+        """集計が変わったお題を知らせる（None なら全部）。どのスレッドから呼んでもよい"""
+        if self._loop is None:
+            return
+        ids = None if question_ids is None else set(question_ids)
+        self._loop.call_soon_threadsafe(self._mark, ids)
+
+    def _mark(self, question_ids: Optional[Set[int]]):
+        if question_ids is None:
+            self._dirty |= self._subscribers.keys()
+        else:
+            self._dirty |= question_ids & self._subscribers.keys()
+        if self._dirty:
+            self._wakeup.set()
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, payload):
+        """キューには最新の1件だけを残す"""
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(payload)
+
+    async def _run(self):
+        while True:
+            if self._poll is not None and self._subscribers:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.min_interval)
+                except asyncio.TimeoutError:
+                    pass
+                await self._poll()
+                # poll 中の notify() を反映させる
+                await asyncio.sleep(0)
+            else:
+                await self._wakeup.wait()
+            self._wakeup.clear()
+            dirty, self._dirty = self._dirty, set()
+            for question_id in dirty:
+                queues = self._subscribers.get(question_id)
+                if not queues:
+                    continue
+                payload = self._build(question_id)
+                for queue in queues:
+                    self._offer(queue, payload)
+            # 送信の間隔をあけることで、この間に入った投票は次の1回にまとまる
+            await asyncio.sleep(self.min_interval)
+
+    async def stream(self, question_id: int) -> AsyncIterator[str]:
+        """1つのお題の集計を SSE 形式で送り続ける（お題が削除されるか、サーバーが終了したら終わる）"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscribers.setdefault(question_id, set()).add(queue)
+        if self._poll is not None:
+            self._wakeup.set()
+        try:
+            payload = self._build(question_id)
+            while payload is not None:
+                yield f"event: results\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                while True:
+                    try:
+                        payload = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                        break
+                    except asyncio.TimeoutError:
+                        # プロキシに切断されないよう、コメント行を送って接続を保つ
+                        yield ": ping\n\n"
+                if payload is _SHUTDOWN:
+                    return
+            yield "event: deleted\ndata: {}\n\n"
+        finally:
+            queues = self._subscribers.get(question_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[question_id]
@@ -0,0 +1,72 @@
+"""
+プロセス間ロック - uvicorn を複数ワーカーで動かしたときに data/ のファイルを守る
+
+fcntl.flock によるファイルロックと、同じプロセス内のスレッド用のロックを組み合わせる。
+（flock は同じファイル記述子を使うスレッド同士を排他しないため）
+fcntl が使えない環境（Windows）ではスレッド間の排他だけになるので、ワーカーは1つで動かすこと。
+"""
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class InterProcessLock:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._thread_lock = threading.RLock()
+        self._file = None
+        self._depth = 0
+
+    def _fd(self) -> int:
+        if self._file is None:
+            self._file = open(self.path, "a+b")
+        return self._file.fileno()
+
+    @contextmanager
+    def _locked(self, mode: int):
+        with self._thread_lock:
+            # 同じスレッドで入れ子になった場合は外側のロックをそのまま使う
+            if self._depth == 0 and fcntl is not None:
+                fcntl.flock(self._fd(), mode)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0 and fcntl is not None:
+                    fcntl.flock(self._fd(), fcntl.LOCK_UN)
+
+    def exclusive(self):
+        """書き込み用（他のプロセスの読み書きを待たせる）"""
+        return self._locked(fcntl.LOCK_EX if fcntl is not None else 0)
+
+    def shared(self):
+        """読み込み用（他のプロセスの読み込みとは同時に持てる）"""
+        return self._locked(fcntl.LOCK_SH if fcntl is not None else 0)
+
+    def try_exclusive(self) -> bool:
+        """取れなければ待たずに False を返す（release で解放する）"""
+        if not self._thread_lock.acquire(blocking=False):
+            return False
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._fd(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._thread_lock.release()
+                return False
+        return True
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd(), fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,214 @@
+"""
+メトリクス - Prometheus のテキスト形式で /metrics に出す値を集める
+
+外部ライブラリは使わず、必要な分（カウンタ・ヒストグラム・読み出し時に計算するゲージ）だけを持つ。
+記録は辞書の参照と加算だけなので、本番で常に有効にしておいてよい。
+
+- HTTP:        ルート（/api/question/{question_id} のようなパスのひな形）ごとのリクエスト数と応答時間
+- 保存先:      load_questions / load_votes / save_questions / save_votes の所要時間と読み書きしたバイト数
+- イベントループ: 予定した時刻から実際に動けるまでの遅れ
+"""
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{escaped}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # ラベルごとに [各バケットの件数（累積しない）..., 上限なしの件数], 合計
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, (list(counts), total[0])) for k, (counts, total) in self._values.items())
+        for label_values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """読み出しのたびに read() を呼んで値を得る"""
+
+    def __init__(self, name: str, help: str, read: Callable[[], float], type: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.type = type
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type}",
+            f"{self.name} {_format_value(self.read())}",
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "vote_app_http_requests_total", "HTTP リクエスト数", ("method", "route", "status"),
+))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "vote_app_http_request_duration_seconds", "応答ヘッダを返すまでの時間", ("method", "route"),
+))
+STORAGE_LATENCY = REGISTRY.register(Histogram(
+    "vote_app_storage_operation_seconds", "保存先の読み書きにかかった時間", ("operation",),
+))
+STORAGE_BYTES = REGISTRY.register(Counter(
+    "vote_app_storage_bytes_total", "保存先から読み書きしたバイト数（sqlite では数えない）", ("operation",),
+))
+LOOP_LAG = REGISTRY.register(Histogram(
+    "vote_app_event_loop_lag_seconds", "イベントループの遅れ",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+))
+
+
+class storage_operation:
+    """保存先の読み書きを計測する
+
+        with storage_operation("load_votes") as op:
+            data = f.read()
+            op.bytes += len(data)
+    """
+
+    __slots__ = ("operation", "bytes", "_started")
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.bytes = 0
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STORAGE_LATENCY.observe(time.perf_counter() - self._started, self.operation)
+        if self.bytes:
+            STORAGE_BYTES.inc(self.operation, amount=self.bytes)
+
+
+class MetricsMiddleware:
+    """ルートごとのリクエスト数と応答時間を記録する ASGI ミドルウェア
+
+    応答ヘッダを送った時点までを計るので、SSE のような長い応答も接続時間ではなく応答の速さになる。
+    ルートはパスのひな形（/api/question/{question_id}）で数え、ラベルの種類が増えすぎないようにする。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status: int):
+            nonlocal recorded
+            recorded = True
+            method = scope["method"]
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_LATENCY.observe(time.perf_counter() - started, method, route)
+            HTTP_REQUESTS.inc(method, route, str(status))
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not recorded:
+                # 応答を返す前に例外で終わった（外側で 500 になる）
+                record(500)
+
+
+async def monitor_event_loop(interval: float = 0.5):
+    """interval 秒ごとに起き、予定より遅れた分をイベントループの遅れとして記録する"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - expected))
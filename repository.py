@@ -0,0 +1,681 @@
+"""
+リポジトリ層 - お題と投票の保存先を切り替える
+
+STORAGE_BACKEND 環境変数で選択する:
+- json   （既定）data/questions.json・data/question_seq.json（最後に割り当てた id）・
+         data/votes.bin（スナップショット。旧形式は data/votes.json）・data/votes.ndjson（ジャーナル）
+- sqlite vote_app.db（init_db.py と同じスキーマ）
+
+どちらも同じメソッドを持ち、VoteStore からはこの層を通してのみ読み書きする。
+お題の削除は墓標（json: ジャーナルの purge レコード、sqlite: deleted_questions テーブル）を
+書くだけで、そのお題の投票はバックグラウンドで少しずつ消す（purge_deleted / compact）。
+uvicorn を複数ワーカーで動かした場合も、書き込みはプロセス間で排他され、
+各プロセスは changes() で他のプロセスの書き込みを取り込める。
+
+端末が付けた投票の id（vote_id）は、重複の判定用に最近の RECENT_VOTE_IDS 件を残す
+（json: ジャーナルと data/vote_ids.json、sqlite: votes テーブルの vote_id 列）。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from journal import JournalReset, VoteJournal
+from locking import InterProcessLock
+from metrics import storage_operation
+from snapshot import Snapshot, write_snapshot
+from vote_columns import VoteColumns, to_micros
+
+
+# お題ごとの分単位の集計 {question_id: {"2025-01-01T10:05": [Aの票数, Bの票数]}}
+Rollups = Dict[int, Dict[str, List[int]]]
+
+# 再送された投票を見分けるために残しておく vote_id の件数
+RECENT_VOTE_IDS = 100000
+
+
+class Changes(NamedTuple):
+    """前回の changes() 以降に、他のプロセスが行った変更"""
+    reset: bool                       # True なら load_state() で全体を読み直す
+    questions: Optional[List[dict]]   # お題に変更があれば最新の一覧
+    records: List[dict]               # 追加された投票と purge レコード
+
+
+NO_CHANGES = Changes(False, None, [])
+
+
+def vote_minute(voted_at: str) -> str:
+    """投票時刻の分（"2025-01-01T10:05"）。ISO 形式の先頭を切り出すだけで、時刻の解析はしない"""
+    return voted_at[:16]
+
+
+def in_range(voted_at: str, since: Optional[str], until: Optional[str]) -> bool:
+    """投票時刻が since 以上 until 未満か（どちらもタイムゾーンなしの ISO 形式。文字列のまま比べる）"""
+    return (since is None or voted_at >= since) and (until is None or voted_at < until)
+
+
+def _write_atomic(path: Path, data: bytes):
+    """書き込み途中で落ちてもファイルが壊れないよう、一時ファイル経由で置き換える"""
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# ==========================================
+# JSON ファイル
+# ==========================================
+class JsonRepository:
+    def __init__(self, data_dir: Path, initial_questions: List[dict]):
+        self.data_dir = Path(data_dir)
+        self.questions_file = self.data_dir / "questions.json"
+        self.sequence_file = self.data_dir / "question_seq.json"
+        self.snapshot_file = self.data_dir / "votes.bin"
+        # 旧形式のスナップショット（votes.bin がなければこちらを読む）
+        self.votes_file = self.data_dir / "votes.json"
+        # 畳み込みでスナップショットに移した投票の vote_id（最近の RECENT_VOTE_IDS 件）
+        self.vote_ids_file = self.data_dir / "vote_ids.json"
+        self.journal = VoteJournal(self.data_dir / "votes.ndjson")
+        self.initial_questions = initial_questions
+
+        self._lock = InterProcessLock(self.data_dir / ".lock")
+        self._compact_lock = InterProcessLock(self.data_dir / ".compact.lock")
+        self._questions: Dict[int, dict] = {}
+        self._questions_stat = None
+        # 書き込みの直前に取り込んだ、他のプロセスの変更（次の changes() で返す）
+        self._external: List[dict] = []
+        self._questions_changed = False
+        self._reset = False
+
+    def open(self):
+        self.data_dir.mkdir(exist_ok=True)
+        with self._lock.exclusive():
+            self._questions = {q["id"]: q for q in self._read_questions()}
+            self.journal.open()
+
+    def close(self):
+        with self._lock.exclusive():
+            self.journal.close()
+        self._lock.close()
+        self._compact_lock.close()
+
+    def load_state(self) -> Tuple[List[dict], Rollups]:
+        """(お題の一覧, 分単位の集計) をまとめて読み込み、以降の changes() をこの時点からにする"""
+        with self._lock.shared():
+            self._questions = {q["id"]: q for q in self._read_questions()}
+            seq, rollups = self._fold_rollups()
+            self.journal.seek_end(seq)
+            self._external = []
+            self._questions_changed = False
+            self._reset = False
+            return list(self._questions.values()), rollups
+
+    def _catch_up(self):
+        """書き込みの前に、他のプロセスの変更を取り込む（排他ロック中に呼ぶ）"""
+        try:
+            self._external += self.journal.read_new()
+        except JournalReset:
+            self._reset = True
+        if self._questions_file_changed():
+            self._questions = {q["id"]: q for q in self._read_questions()}
+            self._questions_changed = True
+
+    def changes(self) -> Changes:
+        with self._lock.shared():
+            self._catch_up()
+            if self._reset:
+                return Changes(True, None, [])
+            questions = list(self._questions.values()) if self._questions_changed else None
+            records, self._external = self._external, []
+            self._questions_changed = False
+            return Changes(False, questions, records)
+
+    # --- お題 ---
+
+    def _questions_file_changed(self) -> bool:
+        try:
+            st = os.stat(self.questions_file)
+        except FileNotFoundError:
+            return False
+        return (st.st_ino, st.st_mtime_ns, st.st_size) != self._questions_stat
+
+    def _read_questions(self) -> List[dict]:
+        if self.questions_file.exists():
+            try:
+                with storage_operation("load_questions") as op:
+                    with open(self.questions_file, "rb") as f:
+                        data = f.read()
+                    op.bytes += len(data)
+                    questions = json.loads(data)
+                st = os.stat(self.questions_file)
+                self._questions_stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+                return questions
+            except:
+                pass
+        self._write_questions(self.initial_questions)
+        return list(self.initial_questions)
+
+    def _write_questions(self, questions: List[dict]):
+        with storage_operation("save_questions") as op:
+            data = json.dumps(questions, ensure_ascii=False, indent=2).encode("utf-8")
+            _write_atomic(self.questions_file, data)
+            op.bytes += len(data)
+        st = os.stat(self.questions_file)
+        self._questions_stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _read_last_id(self) -> int:
+        """最後に割り当てた id（削除されたお題の id も含む）"""
+        try:
+            with open(self.sequence_file, "r", encoding="utf-8") as f:
+                return json.load(f)["last_id"]
+        except (FileNotFoundError, ValueError, KeyError):
+            # question_seq.json がない古いデータでは、残っているお題の最大の id から続ける
+            return max(self._questions, default=0)
+
+    def insert_question(self, q: str, a: str, b: str) -> dict:
+        """新しいお題を保存し、id を割り当てて返す
+
+        id は一度使ったら、お題が削除されても使い回さない（古い投票が新しいお題に紐づかないように）。
+        最後に割り当てた id を先に保存するので、途中で落ちても id が飛ぶだけで重複はしない。
+        """
+        with self._lock.exclusive():
+            self._catch_up()
+            new_id = self._read_last_id() + 1
+            _write_atomic(self.sequence_file, json.dumps({"last_id": new_id}).encode("utf-8"))
+            question = {"id": new_id, "q": q, "a": a, "b": b}
+            self._questions[new_id] = question
+            self._write_questions(list(self._questions.values()))
+        return dict(question)
+
+    def update_question(self, question: dict) -> bool:
+        """お題を上書きする（他のプロセスで削除済みなら False）"""
+        with self._lock.exclusive():
+            self._catch_up()
+            if question["id"] not in self._questions:
+                return False
+            self._questions[question["id"]] = dict(question)
+            self._write_questions(list(self._questions.values()))
+        return True
+
+    def delete_question(self, question_id: int):
+        """お題を削除し、墓標として purge レコードを追記する（投票は次の畳み込みで消える）"""
+        with self._lock.exclusive():
+            self._catch_up()
+            self._questions.pop(question_id, None)
+            self._write_questions(list(self._questions.values()))
+            self.journal.append({"purge": question_id})
+
+    # --- 投票 ---
+
+    def _read_snapshot(self) -> Tuple[int, VoteColumns]:
+        """スナップショットを読み込み、(取り込み済みのジャーナル seq, 投票) を返す"""
+        if self.snapshot_file.exists():
+            with storage_operation("load_votes") as op, Snapshot(self.snapshot_file) as snapshot:
+                op.bytes += snapshot.size()
+                return snapshot.seq, snapshot.columns()
+        return self._read_json_snapshot()
+
+    def _read_snapshot_rollups(self) -> Tuple[int, Rollups]:
+        """スナップショットの (取り込み済みのジャーナル seq, 分単位の集計)。votes.bin なら投票そのものは読まない"""
+        if self.snapshot_file.exists():
+            with storage_operation("load_votes") as op, Snapshot(self.snapshot_file) as snapshot:
+                op.bytes += snapshot.summary_size()
+                return snapshot.seq, snapshot.rollup()
+        seq, votes = self._read_json_snapshot()
+        return seq, votes.rollup()
+
+    def _read_json_snapshot(self) -> Tuple[int, VoteColumns]:
+        """旧形式のスナップショット votes.json を読み込む"""
+        votes = VoteColumns()
+        if self.votes_file.exists():
+            try:
+                with storage_operation("load_votes") as op:
+                    with open(self.votes_file, "rb") as f:
+                        raw = f.read()
+                    op.bytes += len(raw)
+                    data = json.loads(raw)
+                # 旧形式（投票の配列のみ）はジャーナル導入前のデータ
+                if isinstance(data, list):
+                    data = {"seq": 0, "votes": data}
+                votes.extend(data["votes"])
+                return data["seq"], votes
+            except:
+                pass
+        return 0, VoteColumns()
+
+    def _write_snapshot(self, votes: VoteColumns, seq: int):
+        with storage_operation("save_votes") as op:
+            op.bytes += write_snapshot(self.snapshot_file, seq, votes)
+
+    def _fold(self, until_seq: Optional[int] = None) -> Tuple[int, VoteColumns]:
+        """スナップショットにジャーナルを重ねた投票を作る"""
+        snapshot_seq, votes = self._read_snapshot()
+        seq = snapshot_seq
+        purged = set()
+        for record in self.journal.replay(after_seq=snapshot_seq, until_seq=until_seq):
+            seq = record["seq"]
+            if "purge" in record:
+                purged.add(record["purge"])
+            else:
+                votes.append(record)
+        # id は使い回さないので、削除されたお題の投票は purge の前後に関係なくまとめて落とせる
+        if purged:
+            votes = votes.without_questions(purged)
+        return seq, votes
+
+    def _fold_rollups(self) -> Tuple[int, Rollups]:
+        """スナップショットの分単位の集計にジャーナルを重ねる（_fold と違い、スナップショットの投票は1件ずつ読まない）"""
+        seq, rollups = self._read_snapshot_rollups()
+        purged = set()
+        for record in self.journal.replay(after_seq=seq):
+            seq = record["seq"]
+            if "purge" in record:
+                purged.add(record["purge"])
+            else:
+                c = rollups.setdefault(record["question_id"], {}).setdefault(vote_minute(record["voted_at"]), [0, 0])
+                c[0 if record["choice"] == "A" else 1] += 1
+        for question_id in purged:
+            rollups.pop(question_id, None)
+        return seq, rollups
+
+    def export_votes(
+        self, question_ids: Set[int], since: Optional[str] = None, until: Optional[str] = None,
+    ) -> Iterator[dict]:
+        """question_ids のお題の投票を1件ずつ返す（書き出し用。since / until は投票時刻の範囲）
+
+        呼び出した時点のスナップショットとジャーナルを開いておき、以降はロックを持たずに読む。
+        畳み込みでファイルが置き換えられても開いたファイルを読み続けるので、書き出しの間も投票は止まらない。
+        スナップショットの分をお題ごとに返してから、ジャーナルの分を追記された順に返す。
+        """
+        with self._lock.shared():
+            snapshot = Snapshot(self.snapshot_file) if self.snapshot_file.exists() else None
+            journal = open(self.journal.path, "rb") if self.journal.path.exists() else None
+            # 読み始めた後の追記は含めない（書き込み途中の行を読まないため）
+            journal_end = os.fstat(journal.fileno()).st_size if journal is not None else 0
+        return self._export_votes(snapshot, journal, journal_end, question_ids, since, until)
+
+    def _export_votes(self, snapshot, journal, journal_end, question_ids, since, until) -> Iterator[dict]:
+        try:
+            seq = 0
+            if snapshot is not None:
+                seq = snapshot.seq
+                since_micros = to_micros(since) if since is not None else None
+                until_micros = to_micros(until) if until is not None else None
+                for question_id in sorted(question_ids & snapshot.index.keys()):
+                    yield from snapshot.votes(question_id, since_micros, until_micros)
+            else:
+                # 旧形式の votes.json は全体を読むしかない（最初の畳み込みで votes.bin に変わる）
+                seq, votes = self._read_json_snapshot()
+                for vote in votes:
+                    if vote["question_id"] in question_ids and in_range(vote["voted_at"], since, until):
+                        yield vote
+            if journal is None:
+                return
+            read = 0
+            for line in journal:
+                read += len(line)
+                if read > journal_end:
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if "base" in record or "purge" in record or record["seq"] <= seq:
+                    continue
+                if record["question_id"] in question_ids and in_range(record["voted_at"], since, until):
+                    yield {k: record[k] for k in ("question_id", "choice", "user_name", "voted_at")}
+        finally:
+            if snapshot is not None:
+                snapshot.close()
+            if journal is not None:
+                journal.close()
+
+    def _read_vote_ids(self) -> List[str]:
+        if self.vote_ids_file.exists():
+            try:
+                with open(self.vote_ids_file, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except:
+                pass
+        return []
+
+    def load_vote_ids(self) -> List[str]:
+        """最近受け付けた投票の vote_id（古い順、最大 RECENT_VOTE_IDS 件）"""
+        with self._lock.shared():
+            vote_ids = self._read_vote_ids()
+            vote_ids += [r["vote_id"] for r in self.journal.replay() if r.get("vote_id")]
+        return vote_ids[-RECENT_VOTE_IDS:]
+
+    def append_votes(self, votes: List[dict]):
+        """投票をまとめて1回の書き込みと1回の fsync で追記する"""
+        if not votes:
+            return
+        with self._lock.exclusive():
+            self._catch_up()
+            self.journal.append_many(votes)
+
+    def purge_deleted(self, should_stop: Callable[[], bool]):
+        """削除されたお題の投票を消す（json では compact() の畳み込みで消えるので何もしない）"""
+
+    def compact(self):
+        """ジャーナルをスナップショットに畳み込む
+
+        ディスク上のスナップショットとジャーナルだけから新しいスナップショットを作るため、
+        書き出し中も投票の追記は止まらない。止めるのは最後のジャーナル切り詰めの間だけ。
+        別のプロセスが畳み込み中なら何もしない。
+        """
+        if not self._compact_lock.try_exclusive():
+            return
+        try:
+            with self._lock.exclusive():
+                self._catch_up()
+                # 旧形式の votes.json しかなければ、ジャーナルが空でも votes.bin に変換する
+                if not self.journal.has_records() and (self.snapshot_file.exists() or not self.votes_file.exists()):
+                    return
+                offset = self.journal.size()
+                # 切り詰めるのは offset より前なので、畳み込む範囲もファイル上の offset までのレコードで決める
+                until_seq = self.journal.last_seq_before(offset)
+            with storage_operation("compact"):
+                # vote_id はスナップショットに入らないので、先に別のファイルへ移しておく
+                # （ここで落ちてもジャーナルにも残っているので、重複して持つだけ）
+                vote_ids = self._read_vote_ids() + [
+                    r["vote_id"] for r in self.journal.replay(until_seq=until_seq) if r.get("vote_id")
+                ]
+                _write_atomic(self.vote_ids_file, json.dumps(vote_ids[-RECENT_VOTE_IDS:]).encode("utf-8"))
+                seq, votes = self._fold(until_seq=until_seq)
+                self._write_snapshot(votes, seq)
+            with self._lock.exclusive():
+                self.journal.truncate_before(offset, seq)
+        finally:
+            self._compact_lock.release()
+
+
+# ==========================================
+# SQLite
+# ==========================================
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    question TEXT NOT NULL,
+    option_a TEXT NOT NULL,
+    option_b TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS votes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    question_id INTEGER NOT NULL,
+    choice TEXT CHECK(choice IN ('A', 'B')) NOT NULL,
+    user_name TEXT,
+    voted_at TEXT NOT NULL,
+    vote_id TEXT,  -- 端末が付けた投票の id（再送の判定用。なければ NULL）
+    FOREIGN KEY (question_id) REFERENCES questions(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_votes_question_id ON votes(question_id);
+
+-- 削除済みのお題（投票を消し終えたら行を消す）
+CREATE TABLE IF NOT EXISTS deleted_questions (
+    question_id INTEGER PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# SQL 文は固定の文字列にしておき、sqlite3 の接続ごとのステートメントキャッシュで
+# コンパイル済みの文を使い回す（プリペアドステートメント）
+SQL_SELECT_QUESTIONS = "SELECT id, question, option_a, option_b FROM questions ORDER BY id"
+SQL_INSERT_QUESTION = "INSERT INTO questions (question, option_a, option_b, created_at) VALUES (?, ?, ?, ?)"
+SQL_SEED_QUESTION = "INSERT INTO questions (id, question, option_a, option_b, created_at) VALUES (?, ?, ?, ?, ?)"
+SQL_UPDATE_QUESTION = "UPDATE questions SET question = ?, option_a = ?, option_b = ? WHERE id = ?"
+SQL_DELETE_QUESTION = "DELETE FROM questions WHERE id = ?"
+# 削除済みのお題の投票を1回のトランザクションで消す件数
+PURGE_BATCH = 1000
+
+SQL_INSERT_TOMBSTONE = "INSERT OR IGNORE INTO deleted_questions (question_id) VALUES (?)"
+SQL_NEXT_TOMBSTONE = "SELECT question_id FROM deleted_questions LIMIT 1"
+SQL_DELETE_TOMBSTONE = "DELETE FROM deleted_questions WHERE question_id = ?"
+SQL_PURGE_VOTES = "DELETE FROM votes WHERE id IN (SELECT id FROM votes WHERE question_id = ? LIMIT ?)"
+SQL_SELECT_VOTES_AFTER = "SELECT id, question_id, choice, user_name, voted_at, vote_id FROM votes WHERE id > ? ORDER BY id"
+SQL_MAX_VOTE_ID = "SELECT COALESCE(MAX(id), 0) FROM votes"
+SQL_INSERT_VOTE = "INSERT INTO votes (question_id, choice, user_name, voted_at, vote_id) VALUES (?, ?, ?, ?, ?)"
+# 書き出し用（?1: question_id、?2 / ?3: 投票時刻の範囲。NULL なら絞り込まない）
+SQL_EXPORT_VOTES = """
+SELECT question_id, choice, user_name, voted_at FROM votes
+WHERE (?1 IS NULL OR question_id = ?1) AND (?2 IS NULL OR voted_at >= ?2) AND (?3 IS NULL OR voted_at < ?3)
+AND question_id NOT IN (SELECT question_id FROM deleted_questions) ORDER BY id
+"""
+# 書き出しで一度に読む行数
+EXPORT_FETCH_SIZE = 1000
+SQL_RECENT_VOTE_IDS = "SELECT vote_id FROM votes WHERE vote_id IS NOT NULL ORDER BY id DESC LIMIT ?"
+# load_state() でお題ごとの分単位の集計を作る（分は voted_at の先頭16文字。削除済みのお題は除く）
+SQL_ROLLUP_ALL = """
+SELECT question_id, substr(voted_at, 1, 16), choice, COUNT(*) FROM votes
+WHERE question_id NOT IN (SELECT question_id FROM deleted_questions) GROUP BY 1, 2, 3
+"""
+# お題を変更するたびに増やす版数（他のプロセスがお題の変更に気付くため）
+SQL_QUESTIONS_VERSION = "SELECT COALESCE((SELECT value FROM meta WHERE key = 'questions_version'), 0)"
+SQL_BUMP_QUESTIONS_VERSION = """
+INSERT INTO meta (key, value) VALUES ('questions_version', 1)
+ON CONFLICT(key) DO UPDATE SET value = value + 1
+"""
+
+
+class SqliteRepository:
+    def __init__(self, db_path: Path, initial_questions: List[dict]):
+        self.db_path = str(db_path)
+        self.initial_questions = initial_questions
+        # 接続はスレッドごとに1本（sqlite3 の接続はスレッド間で共有できないため）
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        # changes() 用: どこまで取り込んだか
+        self._state_lock = threading.Lock()
+        self._last_vote_id = 0
+        self._questions_version = 0
+        self._external: List[dict] = []
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # トランザクションは _transaction() で明示的に張る
+            conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # 投票はグループコミットでまとめて書くので、コミットごとに WAL を fsync しても負担は小さい
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def _transaction(self, immediate: bool = True):
+        """immediate=True なら開始時に書き込みロックを取る（他のプロセスの書き込みを待つ）"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def open(self):
+        with self._transaction() as conn:
+            for statement in SQLITE_SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            # vote_id 列がない以前の DB には列を足す
+            columns = {r[1] for r in conn.execute("PRAGMA table_info(votes)")}
+            if "vote_id" not in columns:
+                conn.execute("ALTER TABLE votes ADD COLUMN vote_id TEXT")
+            # 一度もお題が登録されていない新しいDBには初期データを入れる
+            seeded = conn.execute("SELECT 1 FROM sqlite_sequence WHERE name = 'questions'").fetchone()
+            if seeded is None:
+                for q in self.initial_questions:
+                    conn.execute(SQL_SEED_QUESTION, (q["id"], q["q"], q["a"], q["b"], datetime.now().isoformat()))
+                conn.execute(SQL_BUMP_QUESTIONS_VERSION)
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def load_state(self) -> Tuple[List[dict], Rollups]:
+        """(お題の一覧, 分単位の集計) をまとめて読み込み、以降の changes() をこの時点からにする"""
+        with self._transaction(immediate=False) as conn:
+            questions = self._select_questions(conn)
+            rollups = self._rollup_all(conn)
+            with self._state_lock:
+                self._last_vote_id = conn.execute(SQL_MAX_VOTE_ID).fetchone()[0]
+                self._questions_version = conn.execute(SQL_QUESTIONS_VERSION).fetchone()[0]
+                self._external = []
+        return questions, rollups
+
+    def _catch_up(self, conn: sqlite3.Connection) -> bool:
+        """他のプロセスが追加した投票を取り込み、お題が変わっていれば True を返す"""
+        with self._state_lock, storage_operation("load_votes"):
+            for r in conn.execute(SQL_SELECT_VOTES_AFTER, (self._last_vote_id,)):
+                self._last_vote_id = r[0]
+                vote = {"question_id": r[1], "choice": r[2], "user_name": r[3], "voted_at": r[4]}
+                if r[5] is not None:
+                    vote["vote_id"] = r[5]
+                self._external.append(vote)
+            version = conn.execute(SQL_QUESTIONS_VERSION).fetchone()[0]
+            changed = version != self._questions_version
+            self._questions_version = version
+            return changed
+
+    def changes(self) -> Changes:
+        with self._transaction(immediate=False) as conn:
+            questions_changed = self._catch_up(conn)
+            questions = self._select_questions(conn) if questions_changed else None
+            with self._state_lock:
+                records, self._external = self._external, []
+        return Changes(False, questions, records)
+
+    # --- お題 ---
+
+    @staticmethod
+    def _select_questions(conn: sqlite3.Connection) -> List[dict]:
+        with storage_operation("load_questions"):
+            rows = conn.execute(SQL_SELECT_QUESTIONS).fetchall()
+        return [{"id": r[0], "q": r[1], "a": r[2], "b": r[3]} for r in rows]
+
+    def insert_question(self, q: str, a: str, b: str) -> dict:
+        """新しいお題を保存し、id を割り当てて返す"""
+        with storage_operation("save_questions"), self._transaction() as conn:
+            cur = conn.execute(SQL_INSERT_QUESTION, (q, a, b, datetime.now().isoformat()))
+            conn.execute(SQL_BUMP_QUESTIONS_VERSION)
+        return {"id": cur.lastrowid, "q": q, "a": a, "b": b}
+
+    def update_question(self, question: dict) -> bool:
+        """お題を上書きする（他のプロセスで削除済みなら False）"""
+        with storage_operation("save_questions"), self._transaction() as conn:
+            cur = conn.execute(SQL_UPDATE_QUESTION, (question["q"], question["a"], question["b"], question["id"]))
+            conn.execute(SQL_BUMP_QUESTIONS_VERSION)
+        return cur.rowcount > 0
+
+    def delete_question(self, question_id: int):
+        """お題を削除して墓標を残す（投票は purge_deleted() が後から消す）"""
+        with storage_operation("save_questions"), self._transaction() as conn:
+            conn.execute(SQL_DELETE_QUESTION, (question_id,))
+            conn.execute(SQL_INSERT_TOMBSTONE, (question_id,))
+            conn.execute(SQL_BUMP_QUESTIONS_VERSION)
+
+    # --- 投票 ---
+
+    def append_votes(self, votes: List[dict]):
+        """投票をまとめて1つのトランザクション（1回の fsync）で追加する"""
+        if not votes:
+            return
+        with storage_operation("save_votes"), self._transaction() as conn:
+            # 自分の投票を他のプロセスの投票と取り違えないよう、先に他のプロセスの分を取り込む
+            self._catch_up(conn)
+            conn.executemany(SQL_INSERT_VOTE, [
+                (v["question_id"], v["choice"], v["user_name"], v["voted_at"], v.get("vote_id")) for v in votes
+            ])
+            with self._state_lock:
+                self._last_vote_id = conn.execute(SQL_MAX_VOTE_ID).fetchone()[0]
+
+    def export_votes(
+        self, question_ids: Set[int], since: Optional[str] = None, until: Optional[str] = None,
+    ) -> Iterator[dict]:
+        """question_ids のお題の投票を1件ずつ返す（書き出し用。since / until は投票時刻の範囲）
+
+        専用の接続で読み込みのトランザクションを張り、始めた時点の内容を EXPORT_FETCH_SIZE 行ずつ読む。
+        WAL モードなので、書き出しの間も投票の書き込みは止まらない
+        （ただし書き出しが終わるまで、チェックポイントで WAL を切り詰められない）。
+        """
+        if not question_ids:
+            return
+        # StreamingResponse は1件ごとに別のスレッドで next() を呼ぶことがあるので、スレッドごとの接続は使わない
+        conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        only = next(iter(question_ids)) if len(question_ids) == 1 else None
+        try:
+            conn.execute("BEGIN")
+            cursor = conn.execute(SQL_EXPORT_VOTES, (only, since, until))
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                for r in rows:
+                    if r[0] in question_ids:
+                        yield {"question_id": r[0], "choice": r[1], "user_name": r[2], "voted_at": r[3]}
+        finally:
+            conn.close()
+
+    def load_vote_ids(self) -> List[str]:
+        """最近受け付けた投票の vote_id（古い順、最大 RECENT_VOTE_IDS 件）"""
+        rows = self._conn().execute(SQL_RECENT_VOTE_IDS, (RECENT_VOTE_IDS,)).fetchall()
+        return [r[0] for r in reversed(rows)]
+
+    @staticmethod
+    def _rollup_all(conn: sqlite3.Connection) -> Rollups:
+        rollups: Rollups = {}
+        with storage_operation("load_votes"):
+            for question_id, minute, choice, count in conn.execute(SQL_ROLLUP_ALL):
+                rollups.setdefault(question_id, {}).setdefault(minute, [0, 0])[0 if choice == "A" else 1] = count
+        return rollups
+
+    def purge_deleted(self, should_stop: Callable[[], bool]):
+        """削除されたお題の投票を PURGE_BATCH 件ずつ消す
+
+        1回のトランザクションを短くして、その合間に投票の書き込みが入れるようにする。
+        """
+        conn = self._conn()
+        while not should_stop():
+            row = conn.execute(SQL_NEXT_TOMBSTONE).fetchone()
+            if row is None:
+                return
+            with storage_operation("purge_votes"), self._transaction() as conn:
+                deleted = conn.execute(SQL_PURGE_VOTES, (row[0], PURGE_BATCH)).rowcount
+                if deleted == 0:
+                    conn.execute(SQL_DELETE_TOMBSTONE, (row[0],))
+            time.sleep(0)
+
+    def compact(self):
+        """WAL をデータベース本体に書き戻す"""
+        with storage_operation("compact"):
+            self._conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def create_repository(backend: str, data_dir: Path, sqlite_path: Path, initial_questions: List[dict]):
+    if backend == "json":
+        return JsonRepository(data_dir, initial_questions)
+    if backend == "sqlite":
+        return SqliteRepository(sqlite_path, initial_questions)
+    raise ValueError(f"未対応のSTORAGE_BACKENDです: {backend}")
@@ -0,0 +1,134 @@
+"""
+ルーム - 同時に開かれている会議ごとに、お題・集計・保存先を分ける
+
+- ルームごとに VoteStore（お題・集計・グループコミット・畳み込みのスレッド）と保存先を持つ
+  （json: ROOMS_DIR/<ルーム名>/、sqlite: ROOMS_DIR/<ルーム名>.db）。
+  あるルームに投票が殺到しても、他のルームの書き込みやロックを待たせない
+- アクティブなお題もルームごと（そのルームで最後に作ったお題）
+- ルームは最初に使われたときに開き、idle_seconds 秒使われなければ閉じる（スレッドとメモリを返す）。
+  同時に開いておけるのは max_open 個まで
+"""
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from store import VoteStore
+
+# ルーム名はそのままファイル名に使うので、英数字と - _ だけにする（大文字は小文字として扱う）
+ROOM_NAME = re.compile(r"[a-z0-9_-]{1,64}")
+
+
+class RoomLimitError(Exception):
+    """開いているルームが上限に達している"""
+
+
+def normalize_room_name(name: str) -> Optional[str]:
+    """ルーム名を小文字にして返す（使えない名前なら None）"""
+    name = name.lower()
+    return name if ROOM_NAME.fullmatch(name) else None
+
+
+class Room:
+    def __init__(self, name: str):
+        self.name = name
+        self.store: Optional[VoteStore] = None
+        self.users = 0           # 使用中のリクエストの数（RoomRegistry._lock を持って増減する）
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()  # 開く・閉じるときに持つ
+
+
+class RoomRegistry:
+    """ルーム名 → 開いている VoteStore"""
+
+    def __init__(self, open_store: Callable[[str], VoteStore], max_open: int = 1000, idle_seconds: float = 600.0):
+        """open_store はルーム名から（まだ start() していない）VoteStore を作る関数"""
+        self.open_store = open_store
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self._rooms: Dict[str, Room] = {}
+        self._lock = threading.Lock()
+        self._opening = 0  # 開いている途中のルームの数（self._lock を持って増減する）
+
+    def open_count(self) -> int:
+        return sum(1 for room in list(self._rooms.values()) if room.store is not None)
+
+    def acquire(self, name: str) -> Room:
+        """ルームを使い始める（release() するまで閉じられない）。name は normalize_room_name() 済みのもの
+
+        まだ開いていなければ開く（ファイルや DB を読むので、イベントループの外で呼ぶこと）。
+        開いているルームが上限に達していれば RoomLimitError。
+        """
+        with self._lock:
+            room = self._rooms.get(name)
+            if room is None:
+                room = self._rooms[name] = Room(name)
+            room.users += 1
+        try:
+            if room.store is None:
+                with room.lock:
+                    if room.store is None:
+                        self._open(room)
+        except BaseException:
+            self.release(room)
+            raise
+        return room
+
+    def _open(self, room: Room):
+        """room.lock を持った状態で呼ぶ"""
+        # 上限の判定と枠の確保を self._lock の中でまとめて行い、別々のルームを同時に開いても上限を超えないようにする
+        with self._lock:
+            if self.open_count() + self._opening >= self.max_open:
+                raise RoomLimitError(room.name)
+            self._opening += 1
+        try:
+            store = self.open_store(room.name)
+            store.start()
+            with self._lock:
+                room.store = store
+                self._opening -= 1
+        except BaseException:
+            with self._lock:
+                self._opening -= 1
+            raise
+
+    def release(self, room: Room):
+        with self._lock:
+            room.users -= 1
+            room.last_used = time.monotonic()
+            if room.users == 0 and room.store is None:
+                # 開けなかったルームは残さない
+                self._rooms.pop(room.name, None)
+
+    def close_idle(self) -> List[str]:
+        """idle_seconds 秒使われていないルームを閉じ、閉じたルーム名を返す"""
+        deadline = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [room for room in self._rooms.values() if room.users == 0 and room.last_used < deadline]
+        closed = []
+        for room in idle:
+            # 閉じ終わるまで room.lock を持つので、その間に使われ始めたら開き直す側が待つ
+            # （同じ保存先を2つの VoteStore で同時に開かない）
+            with room.lock:
+                with self._lock:
+                    # 調べた後に使われ始めていたら閉じない
+                    if room.users > 0 or room.store is None:
+                        continue
+                    store, room.store = room.store, None
+                store.close()
+            with self._lock:
+                if room.users == 0 and room.store is None:
+                    self._rooms.pop(room.name, None)
+            closed.append(room.name)
+        return closed
+
+    def close(self):
+        """すべてのルームを閉じる（サーバーの終了時）"""
+        with self._lock:
+            rooms = list(self._rooms.values())
+            self._rooms.clear()
+        for room in rooms:
+            with room.lock:
+                if room.store is not None:
+                    room.store.close()
+                    room.store = None
@@ -1,35 +1,72 @@
 """
 FastAPIサーバー - 究極の二択！意思決定・多数決支援ツール
 """
-from fastapi import FastAPI, HTTPException, Request
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates  # 追加
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Tuple
 from datetime import datetime
-import json
+import os
+import uuid
 from pathlib import Path
 
-app = FastAPI(
-    title="究極の二択！意思決定・多数決支援ツール",
-    description="会議で意見が割れた時に使う、エンタメ性の高い投票アプリ",
-    version="1.0.0"
-)
+import metrics
+from assets import DIST_DIR, PageCache, PrecompressedStaticFiles
+from export import FORMATS as EXPORT_FORMATS, RESULT_FIELDS, VOTE_FIELDS, iter_export
+from live import ResultsBroadcaster
+from repository import create_repository
+from rooms import RoomLimitError, RoomRegistry, normalize_room_name
+from store import DUPLICATE, VoteStore, make_vote
 
-# 静的ファイルのマウント
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# データファイルのパス
+DATA_DIR = Path(os.environ.get("DATA_DIR", "data"))
+SQLITE_PATH = Path(os.environ.get("SQLITE_PATH", "vote_app.db"))
 
-# テンプレートエンジンの設定
-templates = Jinja2Templates(directory="templates")  # 追加
+# 保存先の切り替え（"json" または "sqlite"）
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")
 
-# データファイルのパス
-DATA_DIR = Path("data")
-QUESTIONS_FILE = DATA_DIR / "questions.json"
-VOTES_FILE = DATA_DIR / "votes.json"
+# ジャーナルをスナップショットに畳み込む間隔（秒 / 件）
+COMPACT_INTERVAL = float(os.environ.get("VOTE_COMPACT_INTERVAL", "60"))
+COMPACT_THRESHOLD = int(os.environ.get("VOTE_COMPACT_THRESHOLD", "10000"))
+
+# グループコミットの設定（まとめる時間幅 ミリ秒 / 1回にまとめる最大件数）
+BATCH_WINDOW_MS = float(os.environ.get("VOTE_BATCH_WINDOW_MS", "2"))
+BATCH_MAX = int(os.environ.get("VOTE_BATCH_MAX", "256"))
+
+# 一括投票で1回に受け付ける最大件数
+VOTE_BULK_LIMIT = int(os.environ.get("VOTE_BULK_LIMIT", "10000"))
+# vote_id の最大の長さ（UUID なら 36 文字）
+MAX_VOTE_ID_LENGTH = 64
+
+# 投票の推移を集計する区間の長さ（秒）
+TIMELINE_BUCKETS = {
+    "1m": 60, "5m": 300, "10m": 600, "15m": 900, "30m": 1800,
+    "1h": 3600, "6h": 21600, "12h": 43200, "1d": 86400,
+}
 
-# データディレクトリの作成
-DATA_DIR.mkdir(exist_ok=True)
+# 一覧の1ページの最大件数
+MAX_PAGE_SIZE = 200
+
+# メモリに持つ応答の最大数（超えたら最後に使ってから最も長いものを捨てる）
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "1024"))
+
+# 結果のライブ配信で、1つのお題の集計を送る最短の間隔（ミリ秒）
+RESULTS_PUSH_INTERVAL_MS = float(os.environ.get("RESULTS_PUSH_INTERVAL_MS", "250"))
+
+# ルームごとの保存先（json: ROOMS_DIR/<ルーム名>/、sqlite: ROOMS_DIR/<ルーム名>.db）
+ROOMS_DIR = Path(os.environ.get("ROOMS_DIR", DATA_DIR / "rooms"))
+# 同時に開いておけるルームの数と、使われていないルームを閉じるまでの秒数
+MAX_OPEN_ROOMS = int(os.environ.get("MAX_OPEN_ROOMS", "1000"))
+ROOM_IDLE_SECONDS = float(os.environ.get("ROOM_IDLE_SECONDS", "600"))
+
+# uvicorn のワーカー数（uvicorn の --workers の既定値と同じ環境変数）
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", "1"))
 
 # 初期データの設定
 INITIAL_QUESTIONS = [
@@ -54,201 +91,663 @@ class VoteRequest(BaseModel):
     question_id: int
     choice: str  # "A" or "B"
     user_name: Optional[str] = None
+    vote_id: Optional[str] = None  # 端末が付けた投票の id（再送しても二重に数えない）
 
-# --- データ永続化関数 ---
-
-def load_questions() -> List[dict]:
-    if QUESTIONS_FILE.exists():
-        try:
-            with open(QUESTIONS_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except:
-            pass
-    save_questions(INITIAL_QUESTIONS)
-    return INITIAL_QUESTIONS
-
-def save_questions(questions: List[dict]):
-    with open(QUESTIONS_FILE, "w", encoding="utf-8") as f:
-        json.dump(questions, f, ensure_ascii=False, indent=2)
-
-def load_votes() -> List[dict]:
-    if VOTES_FILE.exists():
-        try:
-            with open(VOTES_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except:
-            pass
-    return []
-
-def save_votes(votes: List[dict]):
-    with open(VOTES_FILE, "w", encoding="utf-8") as f:
-        json.dump(votes, f, ensure_ascii=False, indent=2)
-
-def get_next_question_id() -> int:
-    questions = load_questions()
-    if not questions:
-        return 1
-    return max(q["id"] for q in questions) + 1
+class RoomVoteRequest(BaseModel):
+    question_id: Optional[int] = None  # 省略時はルームのアクティブなお題
+    choice: str  # "A" or "B"
+    user_name: Optional[str] = None
+    vote_id: Optional[str] = None
 
-def get_active_question_id() -> Optional[int]:
-    questions = load_questions()
-    if not questions:
+class VoteBatchItem(BaseModel):
+    question_id: int
+    choice: str  # "A" or "B"
+    user_name: Optional[str] = None
+    voted_at: Optional[str] = None  # 端末で投票した時刻（ISO 8601）。省略時は受信時刻
+    vote_id: Optional[str] = None  # 端末が付けた投票の id（再送しても二重に数えない）
+
+class VoteBatchRequest(BaseModel):
+    votes: List[VoteBatchItem]
+
+# --- インメモリストア ---
+
+store = VoteStore(
+    create_repository(STORAGE_BACKEND, DATA_DIR, SQLITE_PATH, INITIAL_QUESTIONS),
+    compact_interval=COMPACT_INTERVAL,
+    compact_threshold=COMPACT_THRESHOLD,
+    batch_window=BATCH_WINDOW_MS / 1000,
+    batch_max=BATCH_MAX,
+    shared=WORKERS > 1,
+)
+
+def summarize_tally(votes_A: int, votes_B: int) -> dict:
+    total = votes_A + votes_B
+    
+    percentage_A = (votes_A / total * 100) if total > 0 else 0.0
+    percentage_B = (votes_B / total * 100) if total > 0 else 0.0
+    
+    return {
+        "votes_A": votes_A,
+        "votes_B": votes_B,
+        "total": total,
+        "percentage_A": round(percentage_A, 1),
+        "percentage_B": round(percentage_B, 1)
+    }
+
+def build_results(
+    question_id: int, tally: Optional[Tuple[int, int]] = None, vote_store: Optional[VoteStore] = None
+) -> Optional[dict]:
+    """お題の集計結果（お題がなければ None）。tally を渡すとその票数を使う。vote_store はルームのストア（省略時は全体）"""
+    vote_store = vote_store or store
+    question = vote_store.get_question(question_id)
+    if question is None:
         return None
-    return max(q["id"] for q in questions)
+    
+    votes_A, votes_B = tally if tally is not None else vote_store.tally(question_id)
+    return {
+        "question_id": question_id,
+        "question": question["q"],
+        "optionA": question["a"],
+        "optionB": question["b"],
+        **summarize_tally(votes_A, votes_B)
+    }
+
+def local_isoformat(value: str) -> str:
+    """ISO 8601 の時刻を、保存している投票と同じタイムゾーンなしのローカル時刻にする（形式が違えば ValueError）"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat()
+
+async def sync_store():
+    """複数ワーカーで動いているとき、他のワーカーの変更を取り込む"""
+    if store.shared:
+        await run_in_threadpool(store.sync)
+
+# --- ルーム ---
+# ルームごとに別の VoteStore と保存先を持つ（rooms.py）
+
+def open_room_store(room: str) -> VoteStore:
+    ROOMS_DIR.mkdir(parents=True, exist_ok=True)
+    return VoteStore(
+        create_repository(STORAGE_BACKEND, ROOMS_DIR / room, ROOMS_DIR / f"{room}.db", []),
+        compact_interval=COMPACT_INTERVAL,
+        compact_threshold=COMPACT_THRESHOLD,
+        batch_window=BATCH_WINDOW_MS / 1000,
+        batch_max=BATCH_MAX,
+        shared=WORKERS > 1,
+    )
+
+rooms = RoomRegistry(open_room_store, max_open=MAX_OPEN_ROOMS, idle_seconds=ROOM_IDLE_SECONDS)
+
+async def close_idle_rooms():
+    while True:
+        await asyncio.sleep(min(ROOM_IDLE_SECONDS, 60))
+        await run_in_threadpool(rooms.close_idle)
+
+# 投票が入ったお題の集計を、購読中のクライアントへまとめて送る
+broadcaster = ResultsBroadcaster(
+    build_results,
+    min_interval=RESULTS_PUSH_INTERVAL_MS / 1000,
+    poll=sync_store if store.shared else None,
+)
+store.add_listener(broadcaster.notify)
+
+# /metrics で読み出し時に計算する値
+metrics.REGISTRY.register(metrics.Gauge("vote_app_questions", "お題の数", store.question_count))
+metrics.REGISTRY.register(metrics.Gauge("vote_app_votes", "全お題の票数の合計", store.vote_count))
+metrics.REGISTRY.register(metrics.Gauge(
+    "vote_app_group_commit_batches_total", "グループコミットの回数", lambda: store.committer.stats.batches, type="counter"
+))
+metrics.REGISTRY.register(metrics.Gauge(
+    "vote_app_group_commit_votes_total", "グループコミットで保存した投票数", lambda: store.committer.stats.votes, type="counter"
+))
+metrics.REGISTRY.register(metrics.Gauge("vote_app_live_subscribers", "結果のライブ配信の購読数", broadcaster.subscriber_count))
+metrics.REGISTRY.register(metrics.Gauge("vote_app_open_rooms", "開いているルームの数", rooms.open_count))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    store.start()
+    await broadcaster.start()
+    loop_monitor = asyncio.create_task(metrics.monitor_event_loop())
+    room_sweeper = asyncio.create_task(close_idle_rooms())
+    try:
+        yield
+    finally:
+        loop_monitor.cancel()
+        room_sweeper.cancel()
+        await broadcaster.close()
+        await run_in_threadpool(rooms.close)
+        # 終了時に保存先を畳み込んでから閉じる
+        store.close()
+
+app = FastAPI(
+    title="究極の二択！意思決定・多数決支援ツール",
+    description="会議で意見が割れた時に使う、エンタメ性の高い投票アプリ",
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+# ルートごとのリクエスト数と応答時間を記録する
+app.add_middleware(metrics.MetricsMiddleware)
+
+# 静的ファイルのマウント（build_assets.py で作ったハッシュ付きのファイルは圧縮済み・immutable で返す）
+app.mount("/static/dist", PrecompressedStaticFiles(directory=DIST_DIR, check_dir=False), name="dist")
+app.mount("/static", StaticFiles(directory="static"), name="static")
+
+# テンプレートエンジンの設定
+templates = Jinja2Templates(directory="templates")  # 追加
+# 描画した画面はメモリに持ち、テンプレートか static/dist/manifest.json が変わったときだけ描画し直す
+page_cache = PageCache(templates, Path("templates"))
+
+def get_active_question_id() -> Optional[int]:
+    return store.active_question_id()
+
+# --- 読み込み系の応答のキャッシュ ---
+# 応答をデータの版ごとに JSON のバイト列としてメモリに持ち、ETag を付けて返す。
+# If-None-Match が一致すれば 304 を返す。版の番号は再起動で 0 に戻るので、
+# 起動ごと（ワーカーごと）に変わる BOOT_ID を ETag に含めて、古い ETag と一致しないようにする
+
+BOOT_ID = uuid.uuid4().hex[:8]
+
+_response_cache: "OrderedDict[str, Tuple[str, bytes, Dict[str, str]]]" = OrderedDict()
+_response_cache_version = 0
+
+class Page(NamedTuple):
+    """一覧の1ページ（次のページの cursor は X-Next-Cursor ヘッダで返す）"""
+    items: list
+    next_cursor: Optional[int]
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+def cached_json(request: Request, key: Optional[str], version: str, build: Callable[[], object]) -> Response:
+    """version が同じ間は build() を呼ばずにキャッシュ済みの応答を返す（key が None なら ETag の判定だけ）"""
+    global _response_cache_version
+    if _response_cache_version != store.questions_version:
+        # お題が変わったら全部捨てる（削除されたお題の分が残らないように）
+        _response_cache.clear()
+        _response_cache_version = store.questions_version
+    
+    etag = f'"{BOOT_ID}-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    entry = _response_cache.get(key) if key is not None else None
+    if entry is not None:
+        _response_cache.move_to_end(key)
+    if entry is None or entry[0] != etag:
+        content = build()
+        extra = {}
+        if isinstance(content, Page):
+            if content.next_cursor is not None:
+                extra["X-Next-Cursor"] = str(content.next_cursor)
+            content = content.items
+        entry = (etag, JSONResponse(content).body, extra)
+        if key is not None:
+            _response_cache[key] = entry
+            if len(_response_cache) > RESPONSE_CACHE_SIZE:
+                _response_cache.popitem(last=False)
+    return Response(entry[1], media_type="application/json", headers={**headers, **entry[2]})
+
+def questions_etag_version() -> str:
+    return f"q{store.questions_version}"
+
+def results_etag_version(question_id: int) -> str:
+    return f"q{store.questions_version}-v{store.vote_version(question_id)}"
 
 # --- APIエンドポイント ---
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """
-    分割されたテンプレートを合体させてメイン画面を返す
+    分割されたテンプレートを合体させてメイン画面を返す（描画済みのものを返す）
+    """
+    page = page_cache.get("index.html")
+    return page.response(request.headers.get("accept-encoding"), request.headers.get("if-none-match"))
+
+@app.get("/sw.js")
+async def service_worker(request: Request):
+    """
+    サービスワーカー（サイト全体を扱えるよう / 直下で返す）
+    更新がすぐに届くよう、ブラウザには毎回確認させる
     """
-    return templates.TemplateResponse("index.html", {"request": request})
+    page = page_cache.get("sw.js", media_type="text/javascript")
+    return page.response(request.headers.get("accept-encoding"), request.headers.get("if-none-match"))
 
 @app.get("/api/question")
-async def get_current_question():
+async def get_current_question(request: Request):
+    await sync_store()
     question_id = get_active_question_id()
     if question_id is None:
         raise HTTPException(status_code=404, detail="お題が登録されていません")
     
-    questions = load_questions()
-    question = next((q for q in questions if q["id"] == question_id), None)
+    question = store.get_question(question_id)
     if question is None:
         raise HTTPException(status_code=404, detail="お題が見つかりません")
     
-    return question
+    return cached_json(request, "question:active", questions_etag_version(), lambda: question)
 
 @app.get("/api/question/{question_id}")
-async def get_question(question_id: int):
-    questions = load_questions()
-    question = next((q for q in questions if q["id"] == question_id), None)
+async def get_question(request: Request, question_id: int):
+    await sync_store()
+    question = store.get_question(question_id)
     if question is None:
         raise HTTPException(status_code=404, detail="お題が見つかりません")
-    return question
+    return cached_json(request, f"question:{question_id}", questions_etag_version(), lambda: question)
+
+def page_cache_key(name: str, limit: Optional[int], cursor: Optional[int], search: Optional[str]) -> Optional[str]:
+    # 検索語と cursor はクライアントがいくらでも値を変えられるので、本文をキャッシュするのは先頭のページだけ
+    if search or cursor is not None:
+        return None
+    return f"{name}:{limit}"
 
 @app.get("/api/questions")
-async def get_all_questions():
-    questions = load_questions()
-    questions.sort(key=lambda x: x["id"], reverse=True)
-    return questions
+async def get_all_questions(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[int] = None,
+    search: Optional[str] = None,
+    include: Optional[str] = None
+):
+    """
+    お題を新しい順に返す。limit を指定すると limit 件ずつ返し、続きがあれば
+    X-Next-Cursor ヘッダの値を次のリクエストの cursor に渡す。search で質問文・選択肢を絞り込む
+    include=results を付けると、各お題に集計（results）を付けて返す
+    """
+    if include not in (None, "results"):
+        raise HTTPException(status_code=400, detail="includeにはresultsのみ指定できます")
+    
+    await sync_store()
+    if include is None:
+        return cached_json(
+            request, page_cache_key("questions", limit, cursor, search), questions_etag_version(),
+            lambda: Page(*store.page_questions(limit, cursor, search))
+        )
+    
+    def build():
+        items, next_cursor = store.page_questions(limit, cursor, search)
+        tallies = store.tally_many(item["id"] for item in items)
+        return Page([{**item, "results": summarize_tally(*tallies[item["id"]])} for item in items], next_cursor)
+    
+    # どのお題に投票が入っても変わる版にする（ページに載るお題はまだ分からないため）
+    version = f"{questions_etag_version()}-v{store.votes_version}"
+    return cached_json(request, page_cache_key("questions+results", limit, cursor, search), version, build)
 
 @app.post("/api/question")
 async def create_question(question_data: QuestionCreate):
-    questions = load_questions()
-    new_id = get_next_question_id()
-    
-    new_question = {
-        "id": new_id,
-        "q": question_data.q,
-        "a": question_data.a,
-        "b": question_data.b
-    }
-    
-    questions.append(new_question)
-    save_questions(questions)
-    
-    return new_question
+    # 保存はファイルや DB への書き込みを伴うので、イベントループを止めないようスレッドで行う
+    return await run_in_threadpool(store.create_question, question_data.q, question_data.a, question_data.b)
 
 @app.put("/api/question/{question_id}")
 async def update_question(question_id: int, question_update: QuestionUpdate):
-    questions = load_questions()
-    question = next((q for q in questions if q["id"] == question_id), None)
-    
+    question = await run_in_threadpool(
+        store.update_question,
+        question_id,
+        q=question_update.q,
+        a=question_update.a,
+        b=question_update.b
+    )
     if question is None:
         raise HTTPException(status_code=404, detail="お題が見つかりません")
-    
-    if question_update.q is not None:
-        question["q"] = question_update.q
-    if question_update.a is not None:
-        question["a"] = question_update.a
-    if question_update.b is not None:
-        question["b"] = question_update.b
-    
-    save_questions(questions)
     return question
 
 @app.delete("/api/question/{question_id}")
 async def delete_question(question_id: int):
-    questions = load_questions()
-    question = next((q for q in questions if q["id"] == question_id), None)
-    
-    if question is None:
+    if not await run_in_threadpool(store.delete_question, question_id):
         raise HTTPException(status_code=404, detail="お題が見つかりません")
     
-    questions = [q for q in questions if q["id"] != question_id]
-    save_questions(questions)
-    
-    votes = load_votes()
-    votes = [v for v in votes if v["question_id"] != question_id]
-    save_votes(votes)
-    
     return {"success": True, "message": "お題を削除しました"}
 
+def valid_vote_id(vote_id: Optional[str]) -> bool:
+    return vote_id is None or 0 < len(vote_id) <= MAX_VOTE_ID_LENGTH
+
 @app.post("/api/vote")
 async def post_vote(vote: VoteRequest):
-    questions = load_questions()
-    question = next((q for q in questions if q["id"] == vote.question_id), None)
+    question = store.get_question(vote.question_id)
+    if question is None and store.shared:
+        # 他のワーカーで作られたばかりのお題かもしれない
+        await sync_store()
+        question = store.get_question(vote.question_id)
     if question is None:
         raise HTTPException(status_code=404, detail="お題が見つかりません")
     
     if vote.choice not in ["A", "B"]:
         raise HTTPException(status_code=400, detail="choiceは'A'または'B'である必要があります")
+    if not valid_vote_id(vote.vote_id):
+        raise HTTPException(status_code=400, detail=f"vote_idは1〜{MAX_VOTE_ID_LENGTH}文字である必要があります")
     
-    votes = load_votes()
-    new_vote = {
-        "question_id": vote.question_id,
-        "choice": vote.choice,
-        "user_name": vote.user_name,
-        "voted_at": datetime.now().isoformat()
-    }
-    votes.append(new_vote)
-    save_votes(votes)
+    # グループコミットが完了するまで待ってから応答する
+    (committed,) = await asyncio.wrap_future(
+        store.add_votes([make_vote(vote.question_id, vote.choice, vote.user_name, vote_id=vote.vote_id)])
+    )
+    if committed is None:
+        raise HTTPException(status_code=404, detail="お題が見つかりません")
+    if committed is DUPLICATE:
+        return {"success": True, "message": "受け付け済みの投票です", "duplicate": True}
     
     return {"success": True, "message": "投票を受け付けました"}
 
+@app.post("/api/votes/batch")
+async def post_votes_batch(batch: VoteBatchRequest):
+    """
+    まとめて投票を受け付ける（会場の端末やオフラインで貯めた投票の送信用）
+    お題の確認は1回だけ行い、受け付けた投票は1回の書き込みで保存する。
+    1件ずつの結果を送られた順に返し、不正な投票があっても他の投票は受け付ける。
+    vote_id が受け付け済みの投票と同じなら、保存せずに成功（duplicate: true）として返す。
+    """
+    if len(batch.votes) > VOTE_BULK_LIMIT:
+        raise HTTPException(status_code=413, detail=f"一度に送れる投票は{VOTE_BULK_LIMIT}件までです")
+    
+    await sync_store()
+    results: List[dict] = []
+    votes = []
+    positions = []
+    for index, item in enumerate(batch.votes):
+        if store.get_question(item.question_id) is None:
+            results.append({"index": index, "success": False, "detail": "お題が見つかりません"})
+            continue
+        if item.choice not in ["A", "B"]:
+            results.append({"index": index, "success": False, "detail": "choiceは'A'または'B'である必要があります"})
+            continue
+        if not valid_vote_id(item.vote_id):
+            results.append({"index": index, "success": False, "detail": f"vote_idは1〜{MAX_VOTE_ID_LENGTH}文字である必要があります"})
+            continue
+        voted_at = None
+        if item.voted_at is not None:
+            try:
+                voted_at = local_isoformat(item.voted_at)
+            except ValueError:
+                results.append({"index": index, "success": False, "detail": "voted_atはISO 8601形式である必要があります"})
+                continue
+        results.append({"index": index, "success": True})
+        votes.append(make_vote(item.question_id, item.choice, item.user_name, voted_at, item.vote_id))
+        positions.append(index)
+    
+    if votes:
+        committed = await asyncio.wrap_future(store.add_votes(votes))
+        for index, vote in zip(positions, committed):
+            if vote is None:
+                # 送信中にお題が削除された
+                results[index] = {"index": index, "success": False, "detail": "お題が見つかりません"}
+            elif vote is DUPLICATE:
+                results[index] = {"index": index, "success": True, "duplicate": True}
+    
+    accepted = sum(1 for r in results if r["success"])
+    return {
+        "success": accepted == len(results),
+        "accepted": accepted,
+        "rejected": len(results) - accepted,
+        "duplicates": sum(1 for r in results if r.get("duplicate")),
+        "results": results
+    }
+
 @app.get("/api/results")
-async def get_results(question_id: Optional[int] = None):
+async def get_results(request: Request, question_id: Optional[int] = None):
+    await sync_store()
     if question_id is None:
         question_id = get_active_question_id()
         if question_id is None:
             raise HTTPException(status_code=404, detail="お題が登録されていません")
     
-    questions = load_questions()
-    question = next((q for q in questions if q["id"] == question_id), None)
-    if question is None:
+    if store.get_question(question_id) is None:
         raise HTTPException(status_code=404, detail="お題が見つかりません")
+    # 版の番号を先に読むので、キャッシュする内容はその版と同じかより新しい
+    version = results_etag_version(question_id)
+    return cached_json(request, f"results:{question_id}", version, lambda: build_results(question_id))
+
+@app.get("/api/results/batch")
+async def get_results_batch(request: Request, ids: str):
+    """
+    複数のお題の集計結果をまとめて返す（ids=1,2,3 のようにカンマ区切りで最大 MAX_PAGE_SIZE 件）
+    お題ごとに /api/results を呼ぶ代わりに使う。存在しないお題の id は missing に入る
+    """
+    try:
+        question_ids = list(dict.fromkeys(int(part) for part in ids.split(",") if part.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="idsはカンマ区切りの整数である必要があります")
+    if not question_ids:
+        raise HTTPException(status_code=400, detail="idsを指定してください")
+    if len(question_ids) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"idsは{MAX_PAGE_SIZE}件までです")
     
-    votes = load_votes()
-    question_votes = [v for v in votes if v["question_id"] == question_id]
+    await sync_store()
+    # お題ごとの版はどれも増える一方なので、合計が同じなら集計も変わっていない
+    version = f"{questions_etag_version()}-v{sum(store.vote_version(question_id) for question_id in question_ids)}"
     
-    votes_A = sum(1 for v in question_votes if v["choice"] == "A")
-    votes_B = sum(1 for v in question_votes if v["choice"] == "B")
-    total = votes_A + votes_B
+    def build():
+        tallies = store.tally_many(question_ids)
+        results = []
+        missing = []
+        for question_id in question_ids:
+            result = build_results(question_id, tallies[question_id])
+            if result is None:
+                missing.append(question_id)
+            else:
+                results.append(result)
+        return {"results": results, "missing": missing}
     
-    percentage_A = (votes_A / total * 100) if total > 0 else 0.0
-    percentage_B = (votes_B / total * 100) if total > 0 else 0.0
-    
-    return {
-        "question_id": question_id,
-        "question": question["q"],
-        "optionA": question["a"],
-        "optionB": question["b"],
-        "votes_A": votes_A,
-        "votes_B": votes_B,
-        "total": total,
-        "percentage_A": round(percentage_A, 1),
-        "percentage_B": round(percentage_B, 1)
-    }
+    # id の組み合わせは無数にあるので、本文はキャッシュしない
+    return cached_json(request, None, version, build)
 
 @app.get("/api/question/{question_id}/results")
-async def get_question_results(question_id: int):
-    return await get_results(question_id=question_id)
+async def get_question_results(request: Request, question_id: int):
+    return await get_results(request, question_id=question_id)
+
+def build_timeline(question_id: int, bucket: str) -> dict:
+    buckets = []
+    total_A = total_B = 0
+    for start, votes_A, votes_B in store.timeline(question_id, TIMELINE_BUCKETS[bucket]):
+        total_A += votes_A
+        total_B += votes_B
+        total = total_A + total_B
+        buckets.append({
+            "start": start.isoformat(),
+            "votes_A": votes_A,
+            "votes_B": votes_B,
+            "total_A": total_A,
+            "total_B": total_B,
+            "percentage_A": round(total_A / total * 100, 1) if total > 0 else 0.0,
+            "percentage_B": round(total_B / total * 100, 1) if total > 0 else 0.0
+        })
+    return {"question_id": question_id, "bucket": bucket, "buckets": buckets}
+
+@app.get("/api/question/{question_id}/timeline")
+async def get_question_timeline(request: Request, question_id: int, bucket: str = "1m"):
+    """
+    投票の推移を bucket ごとに返す（区間内の票数と、その区間までの累計・割合）
+    投票のたびに更新している分単位の集計をまとめ直すだけなので、全投票を読み直すことはない。
+    """
+    if bucket not in TIMELINE_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucketは{', '.join(TIMELINE_BUCKETS)}のいずれかである必要があります")
+    
+    await sync_store()
+    if store.get_question(question_id) is None:
+        raise HTTPException(status_code=404, detail="お題が見つかりません")
+    
+    version = f"{results_etag_version(question_id)}-{bucket}"
+    return cached_json(request, f"timeline:{question_id}:{bucket}", version, lambda: build_timeline(question_id, bucket))
+
+@app.get("/api/question/{question_id}/results/stream")
+async def stream_question_results(question_id: int):
+    """
+    集計結果を Server-Sent Events で送り続ける（ポーリングの代わり）
+    接続直後に現在の集計を1回送り、以降は投票が入るたびに最新の集計を送る。
+    お題が削除されたら deleted イベントを送って終わる。
+    """
+    await sync_store()
+    if store.get_question(question_id) is None:
+        raise HTTPException(status_code=404, detail="お題が見つかりません")
+    return StreamingResponse(
+        broadcaster.stream(question_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def export_range(format: str, since: Optional[str], until: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """書き出しの形式と期間を確かめ、期間をローカル時刻の ISO 8601 にして返す"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"formatは{', '.join(EXPORT_FORMATS)}のいずれかである必要があります")
+    try:
+        since = local_isoformat(since) if since else None
+        until = local_isoformat(until) if until else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since・untilはISO 8601形式である必要があります")
+    if since is not None and until is not None and since >= until:
+        raise HTTPException(status_code=400, detail="sinceはuntilより前である必要があります")
+    return since, until
+
+def export_response(chunks, name: str, format: str) -> StreamingResponse:
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{format}"', "Cache-Control": "no-store"},
+    )
+
+@app.get("/api/export/votes")
+async def export_votes(
+    format: str = "ndjson",
+    question_id: Optional[int] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+):
+    """
+    投票を1件1行で書き出す（format=ndjson または csv）。
+    question_id でお題を、since（以上）・until（未満）で投票時刻を絞り込める。
+    少しずつ読みながら送るので、何百万件あってもメモリは増えず、書き出し中も投票を受け付ける。
+    書き出しの開始より後に入った投票は含まない。
+    """
+    since, until = export_range(format, since, until)
+    await sync_store()
+    if question_id is not None and store.get_question(question_id) is None:
+        raise HTTPException(status_code=404, detail="お題が見つかりません")
+    # ファイル・DB を開くところまではここで済ませる（開けなければ 500 を返せるように）
+    rows = await run_in_threadpool(store.export_votes, question_id, since, until)
+    return export_response(iter_export(rows, VOTE_FIELDS, format), "votes", format)
+
+@app.get("/api/export/results")
+async def export_results(
+    format: str = "ndjson",
+    question_id: Optional[int] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+):
+    """
+    お題ごとの集計結果を1件1行で書き出す（古いお題から順に）。
+    since・until を指定すると、その期間の投票だけを数える（分単位の集計から数えるので、秒以下は切り捨て）。
+    """
+    since, until = export_range(format, since, until)
+    await sync_store()
+    if question_id is not None and store.get_question(question_id) is None:
+        raise HTTPException(status_code=404, detail="お題が見つかりません")
+    question_ids = [question_id] if question_id is not None else [q["id"] for q in reversed(store.list_questions())]
+    
+    def rows():
+        for qid in question_ids:
+            result = build_results(qid, store.tally_between(qid, since, until))
+            # 書き出し中に削除されたお題は飛ばす
+            if result is not None:
+                yield result
+    
+    return export_response(iter_export(rows(), RESULT_FIELDS, format), "results", format)
 
 @app.get("/api/history")
-async def get_history():
-    questions = load_questions()
-    return [item["q"] for item in questions]
+async def get_history(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[int] = None,
+    search: Optional[str] = None
+):
+    """過去のお題の質問文を古い順に返す（limit / cursor / search は /api/questions と同じ）"""
+    await sync_store()
+    
+    def build():
+        items, next_cursor = store.page_questions(limit, cursor, search, descending=False)
+        return Page([item["q"] for item in items], next_cursor)
+    
+    return cached_json(request, page_cache_key("history", limit, cursor, search), questions_etag_version(), build)
+
+# --- ルームごとのお題・投票・集計 ---
+
+async def room_store(room: str) -> AsyncIterator[VoteStore]:
+    """パスの {room} のストア（リクエストの間は閉じられない）"""
+    name = normalize_room_name(room)
+    if name is None:
+        raise HTTPException(status_code=400, detail="ルーム名は英数字・-・_の1〜64文字である必要があります")
+    try:
+        entry = await run_in_threadpool(rooms.acquire, name)
+    except RoomLimitError:
+        raise HTTPException(status_code=503, detail="開いているルームが多すぎます。しばらくしてから試してください")
+    try:
+        if entry.store.shared:
+            await run_in_threadpool(entry.store.sync)
+        yield entry.store
+    finally:
+        rooms.release(entry)
+
+@app.get("/api/rooms/{room}/question")
+async def get_room_question(vote_store: VoteStore = Depends(room_store)):
+    """ルームのアクティブなお題（そのルームで最後に作ったお題）"""
+    question_id = vote_store.active_question_id()
+    question = vote_store.get_question(question_id) if question_id is not None else None
+    if question is None:
+        raise HTTPException(status_code=404, detail="お題が登録されていません")
+    return question
+
+@app.post("/api/rooms/{room}/question")
+async def create_room_question(question_data: QuestionCreate, vote_store: VoteStore = Depends(room_store)):
+    return await run_in_threadpool(vote_store.create_question, question_data.q, question_data.a, question_data.b)
+
+@app.post("/api/rooms/{room}/vote")
+async def post_room_vote(vote: RoomVoteRequest, vote_store: VoteStore = Depends(room_store)):
+    """ルームのお題に投票する（question_id を省略するとルームのアクティブなお題）"""
+    question_id = vote.question_id if vote.question_id is not None else vote_store.active_question_id()
+    if question_id is None or vote_store.get_question(question_id) is None:
+        raise HTTPException(status_code=404, detail="お題が見つかりません")
+    if vote.choice not in ["A", "B"]:
+        raise HTTPException(status_code=400, detail="choiceは'A'または'B'である必要があります")
+    if not valid_vote_id(vote.vote_id):
+        raise HTTPException(status_code=400, detail=f"vote_idは1〜{MAX_VOTE_ID_LENGTH}文字である必要があります")
+    
+    (committed,) = await asyncio.wrap_future(
+        vote_store.add_votes([make_vote(question_id, vote.choice, vote.user_name, vote_id=vote.vote_id)])
+    )
+    if committed is None:
+        raise HTTPException(status_code=404, detail="お題が見つかりません")
+    if committed is DUPLICATE:
+        return {"success": True, "message": "受け付け済みの投票です", "duplicate": True}
+    
+    return {"success": True, "message": "投票を受け付けました"}
+
+@app.get("/api/rooms/{room}/results")
+async def get_room_results(question_id: Optional[int] = None, vote_store: VoteStore = Depends(room_store)):
+    if question_id is None:
+        question_id = vote_store.active_question_id()
+        if question_id is None:
+            raise HTTPException(status_code=404, detail="お題が登録されていません")
+    
+    results = build_results(question_id, vote_store=vote_store)
+    if results is None:
+        raise HTTPException(status_code=404, detail="お題が見つかりません")
+    return results
+
+@app.get("/api/stats")
+async def get_stats():
+    """グループコミットのバッチの大きさとコミット時間（チューニング用）"""
+    return {"group_commit": store.committer.stats.as_dict()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus のテキスト形式のメトリクス（ワーカーごとの値）"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run("server:app", host="0.0.0.0", port=8000, workers=WORKERS)
\ No newline at end of file
@@ -0,0 +1,235 @@
+"""
+投票のスナップショット（バイナリ形式） - data/votes.bin
+
+votes.json（投票の辞書の配列）は起動のたびに全体を json.load する必要があり、
+投票が増えるほど起動が遅く、メモリも多く使う。
+この形式は固定長のレコードと、お題ごとの索引を持ち、mmap で開いて必要な部分だけを読む。
+起動時に読むのはヘッダ・索引・分単位の集計だけで、投票1件ごとの Python オブジェクトは作らない。
+
+すべてリトルエンディアン。先頭から次の順に並ぶ。
+
+    ヘッダ      HEADER   マジック "TDVS"・版数・取り込み済みのジャーナル seq・各部の件数
+    索引        INDEX    お題ごとに (question_id, Aの票数, Bの票数, 最初の投票, 最初の分集計, 分集計の件数)
+    分集計      ROLLUP   (1970-01-01 からの分数, Aの票数, Bの票数)。お題ごと・時刻順
+    投票        RECORD   (投票時刻のマイクロ秒, 名前の番号, 選択 0=A 1=B)。お題ごと・投票順
+    名前        JSON     名前の配列（番号 1 が先頭。0 は名前なし）
+
+形式を変えるときは VERSION を上げる。読めない版数のファイルは SnapshotError になる。
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from vote_columns import VoteColumns, from_micros, minute_label
+
+MAGIC = b"TDVS"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHqqqqq")  # マジック, 版数, 予約, seq, お題数, 分集計数, 投票数, 名前の長さ
+INDEX = struct.Struct("<qqqqqq")       # question_id, A, B, 最初の投票, 最初の分集計, 分集計の件数
+ROLLUP = struct.Struct("<qII")         # 分, A, B
+RECORD = struct.Struct("<qiB3x")       # 投票時刻（マイクロ秒）, 名前の番号, 選択
+
+# votes() で一度に読むレコード数
+CHUNK_RECORDS = 4096
+
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+class SnapshotError(Exception):
+    """スナップショットが壊れているか、読めない版数"""
+
+
+class IndexEntry(NamedTuple):
+    question_id: int
+    votes_a: int
+    votes_b: int
+    first_record: int
+    first_rollup: int
+    rollup_count: int
+
+
+def _to_little(values: array) -> bytes:
+    if not _LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if not _LITTLE_ENDIAN:
+        values.byteswap()
+    return values
+
+
+def write_snapshot(path: Path, seq: int, votes: VoteColumns) -> int:
+    """votes を path に書き出す（一時ファイル経由で置き換える）。書いたバイト数を返す"""
+    count = len(votes)
+    # お題ごとにまとめる（安定ソートなので、お題の中では投票順のまま）
+    order = sorted(range(count), key=votes.question_ids.__getitem__)
+    counts = Counter(votes.question_ids)
+    minute_counts = sorted(votes.minute_counts().items())
+
+    index = bytearray()
+    rollups = bytearray()
+    first_record = 0
+    position = 0
+    for question_id in sorted(counts):
+        first_rollup = position
+        a = b = 0
+        while position < len(minute_counts) and minute_counts[position][0][0] == question_id:
+            (_, minute), (minute_a, minute_b) = minute_counts[position]
+            rollups += ROLLUP.pack(minute, minute_a, minute_b)
+            a += minute_a
+            b += minute_b
+            position += 1
+        index += INDEX.pack(question_id, a, b, first_record, first_rollup, position - first_rollup)
+        first_record += counts[question_id]
+
+    # 固定長レコードの各項目を、ストライド付きのスライスでまとめて埋める
+    records = bytearray(count * RECORD.size)
+    view = memoryview(records)
+    view.cast("q")[0::2] = memoryview(_to_little(array("q", map(votes.voted_at.__getitem__, order)))).cast("q")
+    view.cast("i")[2::4] = memoryview(_to_little(array("i", map(votes.user_ids.__getitem__, order)))).cast("i")
+    choices = votes.choices()
+    view[12::RECORD.size] = bytes(map(choices.__getitem__, order))
+    view.release()
+
+    names = json.dumps(votes.names()[1:], ensure_ascii=False).encode("utf-8")
+    header = HEADER.pack(MAGIC, VERSION, 0, seq, len(counts), len(minute_counts), count, len(names))
+
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        for part in (header, index, rollups, records, names):
+            f.write(part)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(header) + len(index) + len(rollups) + len(records) + len(names)
+
+
+class Snapshot:
+    """mmap で開いたスナップショット
+
+        with Snapshot(path) as snapshot:
+            snapshot.tally()     # 索引だけから集計を返す
+            snapshot.columns()   # 投票を VoteColumns として読む（畳み込み用）
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f"{self.path} が空です")
+        try:
+            self._read_header()
+        except Exception:
+            self._mmap.close()
+            raise
+
+    def _read_header(self):
+        size = len(self._mmap)
+        if size < HEADER.size:
+            raise SnapshotError(f"{self.path} はスナップショットではありません")
+        magic, version, _, seq, question_count, rollup_count, vote_count, names_length = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise SnapshotError(f"{self.path} はスナップショットではありません")
+        if version != VERSION:
+            raise SnapshotError(f"{self.path} の版数 {version} には対応していません（対応: {VERSION}）")
+        self.seq = seq
+        self.vote_count = vote_count
+        self._rollups_offset = HEADER.size + question_count * INDEX.size
+        self._records_offset = self._rollups_offset + rollup_count * ROLLUP.size
+        self._names_offset = self._records_offset + vote_count * RECORD.size
+        if self._names_offset + names_length != size:
+            raise SnapshotError(f"{self.path} が途中で切れています")
+        self.index: Dict[int, IndexEntry] = {
+            entry[0]: IndexEntry(*entry)
+            for entry in INDEX.iter_unpack(self._mmap[HEADER.size:self._rollups_offset])
+        }
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def size(self) -> int:
+        return len(self._mmap)
+
+    def summary_size(self) -> int:
+        """ヘッダ・索引・分集計の大きさ（tally() / rollup() で読む範囲）"""
+        return self._records_offset
+
+    def tally(self) -> Dict[int, Tuple[int, int]]:
+        """{question_id: (Aの票数, Bの票数)}（索引だけを読む）"""
+        return {question_id: (entry.votes_a, entry.votes_b) for question_id, entry in self.index.items()}
+
+    def rollup(self) -> Dict[int, Dict[str, List[int]]]:
+        """{question_id: {"2025-01-01T10:05": [Aの票数, Bの票数]}}（分集計の部分だけを読む）"""
+        labels: Dict[int, str] = {}
+        rollups: Dict[int, Dict[str, List[int]]] = {}
+        for question_id, entry in self.index.items():
+            start = self._rollups_offset + entry.first_rollup * ROLLUP.size
+            minutes = rollups[question_id] = {}
+            for minute, a, b in ROLLUP.iter_unpack(self._mmap[start:start + entry.rollup_count * ROLLUP.size]):
+                label = labels.get(minute)
+                if label is None:
+                    label = labels[minute] = minute_label(minute)
+                minutes[label] = [a, b]
+        return rollups
+
+    def names(self) -> List[Optional[str]]:
+        return [None] + json.loads(self._mmap[self._names_offset:])
+
+    def columns(self) -> VoteColumns:
+        """全投票を VoteColumns として読む。レコードの各項目はストライド付きのスライスでまとめて取り出す"""
+        question_ids = array("i")
+        for question_id, entry in sorted(self.index.items(), key=lambda item: item[1].first_record):
+            question_ids.extend(array("i", [question_id]) * (entry.votes_a + entry.votes_b))
+        with memoryview(self._mmap) as view:
+            records = view[self._records_offset:self._names_offset]
+            voted_at = _from_little("q", records.cast("q")[0::2].tobytes())
+            user_ids = _from_little("i", records.cast("i")[2::4].tobytes())
+            choices = records[12::RECORD.size].tobytes()
+            records.release()
+        return VoteColumns.from_arrays(question_ids, voted_at, user_ids, choices, self.names())
+
+    def votes(
+        self, question_id: Optional[int] = None, since: Optional[int] = None, until: Optional[int] = None,
+    ) -> Iterator[dict]:
+        """投票を1件ずつ返す
+
+        question_id を指定すると、そのお題の分だけを読む。since / until（1970-01-01 からのマイクロ秒）を
+        指定すると、投票時刻が since 以上 until 未満のものだけを返す。
+        レコードは CHUNK_RECORDS 件ずつ読むので、お題の票数が多くても使うメモリは変わらない。
+        """
+        names = self.names()
+        entries = self.index.values() if question_id is None else [self.index[question_id]] if question_id in self.index else []
+        for entry in sorted(entries, key=lambda e: e.first_record):
+            start = self._records_offset + entry.first_record * RECORD.size
+            end = start + (entry.votes_a + entry.votes_b) * RECORD.size
+            for chunk in range(start, end, CHUNK_RECORDS * RECORD.size):
+                records = self._mmap[chunk:min(end, chunk + CHUNK_RECORDS * RECORD.size)]
+                for micros, user_id, choice in RECORD.iter_unpack(records):
+                    if (since is not None and micros < since) or (until is not None and micros >= until):
+                        continue
+                    yield {
+                        "question_id": entry.question_id,
+                        "choice": "B" if choice else "A",
+                        "user_name": names[user_id],
+                        "voted_at": from_micros(micros),
+                    }
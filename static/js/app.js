@@ -4,6 +4,7 @@ const API_BASE = '/api';
 // グローバル変数
 let currentQuestionId = null;
 let currentEditingId = null;
+let resultStream = null;
 
 // ページ表示管理
 function showPage(pageId) {
@@ -12,6 +13,11 @@ function showPage(pageId) {
     });
     document.getElementById(pageId).classList.add('active');
     
+    // 結果画面を離れたらライブ配信の購読をやめる
+    if (pageId !== 'result-page') {
+        closeResultStream();
+    }
+    
     // 各ページの初期化
     if (pageId === 'select-question-page') {
         loadSelectionList(); // 問題選択リストを読み込む
@@ -24,8 +30,122 @@ function showPage(pageId) {
     }
 }
 
-// API呼び出し関数
-async function apiCall(endpoint, method = 'GET', data = null) {
+// --- GET の応答のキャッシュ ---
+// 同じ URL への同時のリクエストは1つにまとめる（in-flight の重複排除）。
+// 受け取った応答は CACHE_FRESH_MS の間は通信せずに使い、それより古ければ古い応答を先に返して
+// 裏で取り直し、変わっていれば onUpdate で知らせる（stale-while-revalidate）。
+// 投票や問題の変更をしたら、影響するキャッシュを invalidateCache で捨てる
+const CACHE_FRESH_MS = 5000;
+const CACHE_MAX_ENTRIES = 500;
+const responseCache = new Map();     // endpoint -> { value, body, fetchedAt }
+const inflightRequests = new Map();  // endpoint -> Promise
+let cacheGeneration = 0;             // invalidateCache のたびに増やす（捨てる前に出したリクエストの応答は入れない）
+
+function readJson(response) {
+    return response.json();
+}
+
+// 一覧の1ページ（次のページの cursor は X-Next-Cursor ヘッダで返ってくる）
+async function readPage(response) {
+    return {
+        items: await response.json(),
+        nextCursor: response.headers.get('X-Next-Cursor')
+    };
+}
+
+function putCache(endpoint, value, fetchedAt = Date.now()) {
+    responseCache.delete(endpoint);
+    responseCache.set(endpoint, { value, body: JSON.stringify(value), fetchedAt });
+    // 古いものから捨てる（Map は入れた順に並ぶ）
+    while (responseCache.size > CACHE_MAX_ENTRIES) {
+        responseCache.delete(responseCache.keys().next().value);
+    }
+}
+
+function isFresh(entry) {
+    return entry && Date.now() - entry.fetchedAt < CACHE_FRESH_MS;
+}
+
+// 問題一覧のページに入っている問題と票数を、詳細と集計結果のキャッシュにも入れる
+// （一覧に表示された問題は、タップしてから通信を待たずに開ける）
+function seedQuestionCache(items, fetchedAt) {
+    items.forEach(q => {
+        putCache(`/question/${q.id}`, { id: q.id, q: q.q, a: q.a, b: q.b }, fetchedAt);
+        if (q.results) {
+            putCache(`/results?question_id=${q.id}`, {
+                question_id: q.id, question: q.q, optionA: q.a, optionB: q.b, ...q.results
+            }, fetchedAt);
+        }
+    });
+}
+
+function fetchShared(endpoint, read) {
+    if (inflightRequests.has(endpoint)) {
+        return inflightRequests.get(endpoint);
+    }
+    const generation = cacheGeneration;
+    const request = (async () => {
+        const response = await fetch(`${API_BASE}${endpoint}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const value = await read(response);
+        if (generation === cacheGeneration) {
+            const fetchedAt = Date.now();
+            putCache(endpoint, value, fetchedAt);
+            if (endpoint.startsWith('/questions')) {
+                seedQuestionCache(value.items, fetchedAt);
+            }
+        }
+        return value;
+    })();
+    inflightRequests.set(endpoint, request);
+    request.finally(() => {
+        if (inflightRequests.get(endpoint) === request) inflightRequests.delete(endpoint);
+    }).catch(() => {});
+    return request;
+}
+
+async function cachedGet(endpoint, { read = readJson, onUpdate = null } = {}) {
+    const cached = responseCache.get(endpoint);
+    if (!cached) {
+        return fetchShared(endpoint, read);
+    }
+    if (!isFresh(cached)) {
+        fetchShared(endpoint, read)
+            .then(value => {
+                if (onUpdate && JSON.stringify(value) !== cached.body) onUpdate(value);
+            })
+            .catch(error => console.error('再取得エラー:', error));
+    }
+    return cached.value;
+}
+
+// 表示する前に取っておく（キャッシュが新しければ何もしない）
+function prefetch(endpoint) {
+    if (!isFresh(responseCache.get(endpoint))) {
+        fetchShared(endpoint, readJson).catch(() => {});
+    }
+}
+
+function prefetchQuestion(questionId) {
+    prefetch(`/question/${questionId}`);
+    prefetch(`/results?question_id=${questionId}`);
+}
+
+// prefixes で始まるキャッシュを捨てる（省略するとすべて）
+function invalidateCache(prefixes = null) {
+    cacheGeneration++;
+    for (const endpoint of [...responseCache.keys(), ...inflightRequests.keys()]) {
+        if (!prefixes || prefixes.some(prefix => endpoint.startsWith(prefix))) {
+            responseCache.delete(endpoint);
+            inflightRequests.delete(endpoint);
+        }
+    }
+}
+
+// API呼び出し関数（GET 以外は、成功したら invalidate のキャッシュを捨てる。省略するとすべて）
+async function apiCall(endpoint, method = 'GET', data = null, { invalidate = null } = {}) {
     const options = {
         method: method,
         headers: {
@@ -38,10 +158,14 @@ async function apiCall(endpoint, method = 'GET', data = null) {
     }
     
     try {
+        if (method === 'GET') {
+            return await cachedGet(endpoint);
+        }
         const response = await fetch(`${API_BASE}${endpoint}`, options);
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
+        invalidateCache(invalidate);
         return await response.json();
     } catch (error) {
         console.error('API呼び出しエラー:', error);
@@ -50,33 +174,124 @@ async function apiCall(endpoint, method = 'GET', data = null) {
     }
 }
 
-// --- 【新規・変更】回答するための問題一覧を読み込む ---
-async function loadSelectionList() {
+// 一覧を1ページずつ取得する
+async function apiPage(endpoint, onUpdate = null) {
     try {
-        const questions = await apiCall('/questions');
-        const listElement = document.getElementById('selection-list');
-        listElement.innerHTML = '';
+        return await cachedGet(endpoint, { read: readPage, onUpdate });
+    } catch (error) {
+        console.error('API呼び出しエラー:', error);
+        throw error;
+    }
+}
+
+// 一覧をスクロールに合わせて PAGE_SIZE 件ずつ読み込む
+const PAGE_SIZE = 30;
+const pagedLists = {};
+
+function loadPagedList(listId, endpoint, renderItem, options = {}) {
+    const { search = '', params = {}, emptyHtml = '', errorMessage = '' } = options;
+    const listElement = document.getElementById(listId);
+    // 読み込み中の前回の一覧は捨てる
+    if (pagedLists[listId]) {
+        pagedLists[listId].observer.disconnect();
+    }
+    listElement.innerHTML = '';
+    
+    // 一覧の末尾が見えたら続きを読み込む
+    const sentinel = document.createElement('li');
+    sentinel.className = 'list-sentinel';
+    listElement.appendChild(sentinel);
+    
+    const state = { cursor: null, loading: false, done: false, observer: null };
+    pagedLists[listId] = state;
+    
+    async function loadMore() {
+        if (state.loading || state.done) return;
+        state.loading = true;
         
-        if (questions.length === 0) {
-            listElement.innerHTML = '<li class="guide-text">問題がまだ登録されていません</li>';
-            return;
-        }
+        const query = new URLSearchParams({ ...params, limit: PAGE_SIZE });
+        if (state.cursor !== null) query.set('cursor', state.cursor);
+        if (search) query.set('search', search);
+        
+        // 最初のページがキャッシュの古い内容だったら、取り直した内容で一覧を作り直す
+        const isFirstPage = state.cursor === null;
+        const onUpdate = () => {
+            if (isFirstPage && pagedLists[listId] === state) {
+                loadPagedList(listId, endpoint, renderItem, options);
+            }
+        };
         
-        questions.forEach(q => {
-            const li = document.createElement('li');
-            li.className = 'selection-item';
-            li.innerHTML = `<span class="selection-item-text">${q.q}</span>`;
+        try {
+            const page = await apiPage(`${endpoint}?${query}`, onUpdate);
+            if (pagedLists[listId] !== state) return;
             
-            // クリックした時にIDを保存して回答画面へ
-            li.onclick = () => {
-                currentQuestionId = q.id;
-                showPage('question-page');
-            };
-            listElement.appendChild(li);
-        });
-    } catch (error) {
-        alert('問題リストの読み込みに失敗しました');
+            page.items.forEach(item => listElement.insertBefore(renderItem(item), sentinel));
+            state.cursor = page.nextCursor;
+            if (state.cursor === null) {
+                state.done = true;
+                state.observer.disconnect();
+                sentinel.remove();
+                if (listElement.children.length === 0) {
+                    listElement.innerHTML = emptyHtml;
+                }
+            } else {
+                // まだ末尾が見えている場合に備えて、監視し直して判定させる
+                state.observer.unobserve(sentinel);
+                state.observer.observe(sentinel);
+            }
+        } catch (error) {
+            state.done = true;
+            alert(errorMessage);
+        } finally {
+            state.loading = false;
+        }
     }
+    
+    state.observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadMore();
+        }
+    });
+    state.observer.observe(sentinel);
+}
+
+// 検索欄の入力が落ち着いてから一覧を読み込み直す
+let searchTimer = null;
+
+function onListSearch(reload) {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(reload, 300);
+}
+
+// --- 【新規・変更】回答するための問題一覧を読み込む ---
+function loadSelectionList() {
+    loadPagedList('selection-list', '/questions', q => {
+        const li = document.createElement('li');
+        li.className = 'selection-item';
+        li.innerHTML = `<span class="selection-item-text">${q.q}</span>`;
+        
+        const count = document.createElement('span');
+        count.className = 'selection-item-count';
+        count.textContent = `${q.results.total}票`;
+        li.appendChild(count);
+        
+        // 触れそうになったら詳細と集計結果を先に取っておく
+        li.addEventListener('pointerenter', () => prefetchQuestion(q.id));
+        li.addEventListener('touchstart', () => prefetchQuestion(q.id), { passive: true });
+        
+        // クリックした時にIDを保存して回答画面へ
+        li.onclick = () => {
+            currentQuestionId = q.id;
+            showPage('question-page');
+        };
+        return li;
+    }, {
+        search: document.getElementById('selection-search').value.trim(),
+        // 票数も一覧と一緒に受け取る（お題ごとに /results を呼ばない）
+        params: { include: 'results' },
+        emptyHtml: '<li class="guide-text">問題がまだ登録されていません</li>',
+        errorMessage: '問題リストの読み込みに失敗しました'
+    });
 }
 
 // --- 【新規・変更】選択された問題の詳細を回答画面に表示する ---
@@ -86,12 +301,19 @@ async function loadQuestionDetail() {
         return;
     }
 
-    try {
-        // 特定のIDの問題データを取得
-        const question = await apiCall(`/question/${currentQuestionId}`);
+    const questionId = currentQuestionId;
+    const render = question => {
+        if (currentQuestionId !== questionId) return;
         document.getElementById('question-text').textContent = `Q. ${question.q}`;
         document.getElementById('option-a-text').textContent = question.a;
         document.getElementById('option-b-text').textContent = question.b;
+    };
+    
+    try {
+        // 一覧から開いた問題はキャッシュにあるので、通信を待たずに表示する
+        render(await cachedGet(`/question/${questionId}`, { onUpdate: render }));
+        // 投票後の結果画面のために、集計結果も取っておく
+        prefetch(`/results?question_id=${questionId}`);
     } catch (error) {
         document.getElementById('question-text').textContent = 'Q. お題の読み込みに失敗しました';
     }
@@ -105,10 +327,11 @@ async function vote(choice) {
     }
     
     try {
+        // 票数が変わるのは集計結果と一覧だけ（問題の詳細のキャッシュは残す）
         await apiCall('/vote', 'POST', {
             question_id: currentQuestionId,
             choice: choice
-        });
+        }, { invalidate: ['/results', '/questions'] });
         
         // 結果ページに移動
         showPage('result-page');
@@ -129,11 +352,39 @@ async function loadResults() {
         
         // 結果データを保存
         window.resultData = results;
+        
+        // 以降の投票はサーバーから送られてくる
+        openResultStream(currentQuestionId);
     } catch (error) {
         alert('結果の読み込みに失敗しました');
     }
 }
 
+// 結果のライブ配信を購読する（ポーリングの代わり）
+function openResultStream(questionId) {
+    closeResultStream();
+    if (!window.EventSource) return;
+    
+    resultStream = new EventSource(`${API_BASE}/question/${questionId}/results/stream`);
+    resultStream.addEventListener('results', (event) => {
+        window.resultData = JSON.parse(event.data);
+        // オープン済みなら表示も更新する
+        if (!document.getElementById('result-content').classList.contains('hidden')) {
+            renderResults(window.resultData);
+        }
+    });
+    resultStream.addEventListener('deleted', () => {
+        closeResultStream();
+    });
+}
+
+function closeResultStream() {
+    if (resultStream) {
+        resultStream.close();
+        resultStream = null;
+    }
+}
+
 // 結果をオープン
 function openResult() {
     const results = window.resultData;
@@ -146,6 +397,11 @@ function openResult() {
     const resultContent = document.getElementById('result-content');
     resultContent.classList.remove('hidden');
     
+    renderResults(results);
+}
+
+// 結果のバーを描画
+function renderResults(results) {
     const barA = document.getElementById('bar-a');
     const barB = document.getElementById('bar-b');
     const barAText = document.getElementById('bar-a-text');
@@ -158,8 +414,8 @@ function openResult() {
     // アニメーションでバーを表示
     setTimeout(() => {
         const maxWidth = 300;
-        const widthA = (results.votes_A / results.total) * maxWidth;
-        const widthB = (results.votes_B / results.total) * maxWidth;
+        const widthA = results.total ? (results.votes_A / results.total) * maxWidth : 0;
+        const widthB = results.total ? (results.votes_B / results.total) * maxWidth : 0;
         
         barA.style.width = `${widthA}px`;
         barB.style.width = `${widthB}px`;
@@ -194,87 +450,70 @@ async function createQuestion() {
 }
 
 // 履歴を読み込む
-async function loadHistory() {
-    try {
-        const history = await apiCall('/history');
-        const historyList = document.getElementById('history-list');
-        historyList.innerHTML = '';
-        
-        if (history.length === 0) {
-            historyList.innerHTML = '<li>履歴がありません</li>';
-            return;
-        }
-        
-        history.forEach(item => {
-            const li = document.createElement('li');
-            li.textContent = item;
-            historyList.appendChild(li);
-        });
-    } catch (error) {
-        alert('履歴の読み込みに失敗しました');
-    }
+function loadHistory() {
+    loadPagedList('history-list', '/history', item => {
+        const li = document.createElement('li');
+        li.textContent = item;
+        return li;
+    }, {
+        emptyHtml: '<li>履歴がありません</li>',
+        errorMessage: '履歴の読み込みに失敗しました'
+    });
 }
 
 // 編集リストを読み込む
-async function loadEditList() {
-    try {
-        const questions = await apiCall('/questions');
-        const editList = document.getElementById('edit-list');
-        editList.innerHTML = '';
+function loadEditList() {
+    loadPagedList('edit-list', '/questions', q => {
+        const li = document.createElement('li');
+        li.className = 'edit-item-container';
         
-        if (questions.length === 0) {
-            editList.innerHTML = '<li>問題がありません</li>';
-            return;
-        }
+        const itemDiv = document.createElement('div');
+        itemDiv.className = 'edit-item';
         
-        questions.forEach(q => {
-            const li = document.createElement('li');
-            li.className = 'edit-item-container';
-            
-            const itemDiv = document.createElement('div');
-            itemDiv.className = 'edit-item';
-            
-            const title = document.createElement('div');
-            title.className = 'edit-item-title';
-            title.textContent = q.q;
-            
-            const subtitle = document.createElement('div');
-            subtitle.className = 'edit-item-subtitle';
-            subtitle.textContent = `A: ${q.a} / B: ${q.b}`;
-            
-            itemDiv.appendChild(title);
-            itemDiv.appendChild(subtitle);
-            
-            const actions = document.createElement('div');
-            actions.className = 'edit-actions';
-            
-            const editBtn = document.createElement('button');
-            editBtn.className = 'edit-btn';
-            editBtn.innerHTML = '✏️';
-            editBtn.onclick = () => editQuestion(q.id);
-            
-            const deleteBtn = document.createElement('button');
-            deleteBtn.className = 'delete-btn';
-            deleteBtn.innerHTML = '🗑️';
-            deleteBtn.onclick = () => deleteQuestion(q.id);
-            
-            actions.appendChild(editBtn);
-            actions.appendChild(deleteBtn);
-            
-            li.appendChild(itemDiv);
-            li.appendChild(actions);
-            editList.appendChild(li);
-        });
-    } catch (error) {
-        alert('編集リストの読み込みに失敗しました');
-    }
+        const title = document.createElement('div');
+        title.className = 'edit-item-title';
+        title.textContent = q.q;
+        
+        const subtitle = document.createElement('div');
+        subtitle.className = 'edit-item-subtitle';
+        subtitle.textContent = `A: ${q.a}（${q.results.votes_A}票） / B: ${q.b}（${q.results.votes_B}票）`;
+        
+        itemDiv.appendChild(title);
+        itemDiv.appendChild(subtitle);
+        
+        const actions = document.createElement('div');
+        actions.className = 'edit-actions';
+        
+        const editBtn = document.createElement('button');
+        editBtn.className = 'edit-btn';
+        editBtn.innerHTML = '✏️';
+        editBtn.onclick = () => editQuestion(q.id);
+        editBtn.addEventListener('pointerenter', () => prefetch(`/question/${q.id}`));
+        
+        const deleteBtn = document.createElement('button');
+        deleteBtn.className = 'delete-btn';
+        deleteBtn.innerHTML = '🗑️';
+        deleteBtn.onclick = () => deleteQuestion(q.id);
+        
+        actions.appendChild(editBtn);
+        actions.appendChild(deleteBtn);
+        
+        li.appendChild(itemDiv);
+        li.appendChild(actions);
+        return li;
+    }, {
+        search: document.getElementById('edit-search').value.trim(),
+        params: { include: 'results' },
+        emptyHtml: '<li>問題がありません</li>',
+        errorMessage: '編集リストの読み込みに失敗しました'
+    });
 }
 
 // 問題を編集
 function editQuestion(questionId) {
     currentEditingId = questionId;
     
-    // 問題データを取得
+    // 問題データを取得（一覧に出ていた問題はキャッシュにある）
     apiCall(`/question/${questionId}`)
         .then(question => {
             document.getElementById('edit-question').value = question.q;
@@ -332,4 +571,11 @@ async function deleteQuestion(questionId) {
 document.addEventListener('DOMContentLoaded', () => {
     // トップページを表示
     showPage('top-page');
+    
+    // 2回目以降の訪問では、画面と static/ をサービスワーカーのキャッシュから読み込む
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register('/sw.js').catch(error => {
+            console.error('サービスワーカーの登録エラー:', error);
+        });
+    }
 });
\ No newline at end of file
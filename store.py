@@ -0,0 +1,433 @@
+"""
+インメモリ投票ストア - お題をプロセス内に常駐させ、保存はリポジトリ層に任せる
+
+永続化の方針（クラッシュ時の挙動）:
+- お題の作成・編集・削除はその場でリポジトリに保存する（ライトスルー）
+- 投票はグループコミット（group_commit.py）でまとめてリポジトリに書き込み、
+  fsync が終わってから応答を返す。応答済みの投票は OS ごと停止しても失われない
+  - json:   ジャーナル（votes.ndjson）にバッチ分の行を1回で追記する
+  - sqlite: バッチ分を1つのトランザクションで追加する（WAL モード）
+- 集計結果は {question_id: [Aの票数, Bの票数]} としてメモリ上に持ち、投票のたびに更新する。
+  起動時に一度だけリポジトリから作り直すので、結果の取得は投票の総数に関係なく O(1)
+- 同じく、お題ごとの分単位の集計 {question_id: {"2025-01-01T10:05": [A, B]}} も投票のたびに更新し、
+  推移（timeline）はこれをまとめ直すだけで返す
+- compact_interval 秒ごと、または compact_threshold 件の投票を受け付けた時点で、
+  バックグラウンドスレッドがリポジトリの畳み込み（json: ジャーナル → votes.bin、
+  sqlite: WAL のチェックポイント）を行う。起動直後（起動は待たない）と終了時にも必ず畳み込む
+- お題の削除はリポジトリに墓標を書くだけで返し、削除したお題の集計はその場でメモリから消す。
+  ディスク上の投票は同じバックグラウンドスレッドが少しずつ消す（repository.purge_deleted）
+
+複数ワーカーで動かす場合（shared=True）:
+- 書き込みはリポジトリがプロセス間で排他する（json: data/.lock のファイルロック、sqlite: DB のロック）
+- 読み込みの前に sync() を呼ぶと、他のワーカーが書き込んだお題と投票をメモリ上の集計に取り込む
+
+お題が変わるたびに questions_version を、お題ごとの集計が変わるたびに vote_version() を1つ進める。
+（応答のキャッシュや ETag の判定に使う。プロセス内だけの番号なので、再起動すると 0 に戻る）
+
+端末が vote_id を付けた投票は、同じ vote_id を最近（RECENT_VOTE_IDS 件以内に）受け付けていれば
+保存も集計もしない。通信が切れて再送された投票を二重に数えないため（他のワーカーが受け付けた分も、
+取り込み済みなら判定に含まれる）。
+
+集計が変わるたびに add_listener() で登録した関数を、変わったお題の id の集合（全体を読み直した
+ときは None）を渡して呼ぶ。コミット用スレッドなどから呼ぶので、登録する関数はすぐに戻ること。
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from group_commit import GroupCommitter
+from repository import RECENT_VOTE_IDS, vote_minute
+
+EPOCH = datetime(1970, 1, 1)
+
+# add_votes() の結果: 同じ vote_id の投票を受け付け済みだった
+DUPLICATE = "duplicate"
+
+
+def make_vote(
+    question_id: int, choice: str, user_name: Optional[str] = None,
+    voted_at: Optional[str] = None, vote_id: Optional[str] = None,
+) -> dict:
+    """voted_at を省略すると現在時刻（端末で記録した投票を後から送る場合はその時刻を渡す）"""
+    vote = {
+        "question_id": question_id,
+        "choice": choice,
+        "user_name": user_name,
+        "voted_at": voted_at or datetime.now().isoformat()
+    }
+    if vote_id is not None:
+        vote["vote_id"] = vote_id
+    return vote
+
+
+class VoteStore:
+    def __init__(
+        self,
+        repository,
+        compact_interval: float = 60.0,
+        compact_threshold: int = 10000,
+        batch_window: float = 0.002,
+        batch_max: int = 256,
+        shared: bool = False,
+    ):
+        self.repository = repository
+        self.shared = shared
+        self.compact_interval = compact_interval
+        self.compact_threshold = compact_threshold
+        self.committer = GroupCommitter(self._commit_votes, window=batch_window, max_batch=batch_max)
+
+        self._lock = threading.Lock()
+        self._questions: Dict[int, dict] = {}
+        # お題の id を昇順に並べたもの。変更時は作り直して差し替えるので、読む側はロック不要
+        self._ids: List[int] = []
+        self._tallies: Dict[int, List[int]] = {}
+        self._rollups: Dict[int, Dict[str, List[int]]] = {}
+        self._appended = 0  # 前回の畳み込み以降に受け付けた投票数
+        # 最近受け付けた投票の vote_id（古い順。dict を挿入順の集合として使う）
+        self._vote_ids: Dict[str, None] = {}
+        self._listeners: List[Callable[[Optional[Set[int]]], None]] = []
+        self.questions_version = 0
+        self._vote_versions: Dict[int, int] = {}
+        self.votes_version = 0  # どれかのお題の集計が変わるたびに増える
+
+        self._wake = threading.Event()
+        self._stopping = False
+        self._compactor: Optional[threading.Thread] = None
+
+    # --- ライフサイクル ---
+
+    def start(self):
+        """リポジトリから状態を復元し、畳み込み用スレッドを起動する"""
+        self.repository.open()
+        with self._lock:
+            self._load_state()
+            self._appended = 0
+        self.committer.start()
+        self._stopping = False
+        self._compactor = threading.Thread(target=self._compact_loop, name="vote-compactor", daemon=True)
+        self._compactor.start()
+
+    def close(self):
+        """受け付け済みの投票をコミットし、畳み込み用スレッドを止めて最後にもう一度畳み込む"""
+        self.committer.close()
+        self._stopping = True
+        self._wake.set()
+        if self._compactor is not None:
+            self._compactor.join()
+            self._compactor = None
+        self.repository.compact()
+        self.repository.close()
+
+    def _compact_loop(self):
+        # 起動直後に一度畳み込んでおくと、次回の起動が速くなり、末尾の壊れた行も消える。
+        # 畳み込み中も投票の追記は止まらないので、起動はこれを待たない
+        self.repository.compact()
+        deadline = time.monotonic() + self.compact_interval
+        while not self._stopping:
+            self.repository.purge_deleted(lambda: self._stopping)
+            # お題の削除で起こされても次の畳み込みが先に延びないよう、前回の畳み込みからの残り時間だけ待つ
+            self._wake.wait(max(0.0, deadline - time.monotonic()))
+            self._wake.clear()
+            if self._stopping:
+                break
+            with self._lock:
+                if time.monotonic() < deadline and self._appended < self.compact_threshold:
+                    # お題の削除で起こされただけなら、投票の削除だけを行う
+                    continue
+                self._appended = 0
+            self.repository.compact()
+            deadline = time.monotonic() + self.compact_interval
+
+    # --- 変更の通知 ---
+
+    def add_listener(self, listener: Callable[[Optional[Set[int]]], None]):
+        self._listeners.append(listener)
+
+    def _notify(self, question_ids: Optional[Set[int]]):
+        if question_ids is None:
+            self.questions_version += 1
+        else:
+            for question_id in question_ids:
+                self._vote_versions[question_id] = self._vote_versions.get(question_id, 0) + 1
+            self.votes_version += 1
+        for listener in self._listeners:
+            listener(question_ids)
+
+    # --- 他のワーカーとの同期 ---
+
+    def _load_state(self):
+        questions, rollups = self.repository.load_state()
+        self._questions = {q["id"]: q for q in questions}
+        self._ids = sorted(self._questions)
+        self._rollups = rollups
+        self._tallies = {
+            question_id: [sum(c[0] for c in minutes.values()), sum(c[1] for c in minutes.values())]
+            for question_id, minutes in rollups.items()
+        }
+        self._vote_ids = dict.fromkeys(self.repository.load_vote_ids())
+
+    def _remember_vote_id(self, vote: dict):
+        """self._lock を持った状態で呼ぶ"""
+        vote_id = vote.get("vote_id")
+        if vote_id is None:
+            return
+        self._vote_ids[vote_id] = None
+        if len(self._vote_ids) > RECENT_VOTE_IDS:
+            del self._vote_ids[next(iter(self._vote_ids))]
+
+    def _count_vote(self, vote: dict):
+        """集計と分単位の集計に1票を足す（self._lock を持った状態で呼ぶ）"""
+        index = 0 if vote["choice"] == "A" else 1
+        self._tallies.setdefault(vote["question_id"], [0, 0])[index] += 1
+        minutes = self._rollups.setdefault(vote["question_id"], {})
+        minutes.setdefault(vote_minute(vote["voted_at"]), [0, 0])[index] += 1
+
+    def _forget_votes(self, question_id: int):
+        self._tallies.pop(question_id, None)
+        self._rollups.pop(question_id, None)
+
+    def _apply_changes(self):
+        """他のワーカーの変更をメモリ上の状態に反映する（self._lock を持った状態で呼ぶ）"""
+        if not self.shared:
+            return
+        changes = self.repository.changes()
+        if changes.reset:
+            self._load_state()
+            self._notify(None)
+            return
+        changed = set()
+        if changes.questions is not None:
+            previous = self._questions
+            self._questions = {q["id"]: q for q in changes.questions}
+            self._ids = sorted(self._questions)
+            edited = {
+                question_id for question_id in previous.keys() | self._questions.keys()
+                if previous.get(question_id) != self._questions.get(question_id)
+            }
+            if edited:
+                self.questions_version += 1
+                changed.update(edited)
+            for question_id in list(self._tallies):
+                if question_id not in self._questions:
+                    self._forget_votes(question_id)
+        for record in changes.records:
+            if "purge" in record:
+                self._forget_votes(record["purge"])
+                changed.add(record["purge"])
+            else:
+                self._remember_vote_id(record)
+                if record["question_id"] in self._questions:
+                    self._count_vote(record)
+                    changed.add(record["question_id"])
+        if changed:
+            self._notify(changed)
+
+    def sync(self):
+        """他のワーカーの変更を取り込む（ファイルや DB を読むため、イベントループの外で呼ぶ）"""
+        with self._lock:
+            self._apply_changes()
+
+    # --- お題 ---
+
+    def get_question(self, question_id: int) -> Optional[dict]:
+        return self._questions.get(question_id)
+
+    def list_questions(self) -> List[dict]:
+        """新しい順（id の降順）"""
+        return self.page_questions()[0]
+
+    def page_questions(
+        self,
+        limit: Optional[int] = None,
+        cursor: Optional[int] = None,
+        search: Optional[str] = None,
+        descending: bool = True,
+    ) -> Tuple[List[dict], Optional[int]]:
+        """お題を id の順に limit 件ずつ返す（キーセット方式のページ分割）
+
+        cursor には前のページの最後の id を渡す。search を渡すと、質問文・選択肢のどれかに
+        その文字列を含むお題だけを返す（大文字・小文字は区別しない）。
+        返り値は (お題のリスト, 次のページの cursor。これが最後のページなら None)
+        """
+        ids = self._ids
+        questions = self._questions
+        if descending:
+            end = bisect_left(ids, cursor) if cursor is not None else len(ids)
+            candidates = (ids[i] for i in range(end - 1, -1, -1))
+        else:
+            start = bisect_right(ids, cursor) if cursor is not None else 0
+            candidates = (ids[i] for i in range(start, len(ids)))
+        needle = search.casefold() if search else None
+        items: List[dict] = []
+        for question_id in candidates:
+            question = questions.get(question_id)
+            if question is None:
+                continue
+            if needle and not any(needle in question[key].casefold() for key in ("q", "a", "b")):
+                continue
+            if limit is not None and len(items) == limit:
+                return items, items[-1]["id"]
+            items.append(question)
+        return items, None
+
+    def active_question_id(self) -> Optional[int]:
+        """最新のお題（id が最大のもの）。id の昇順リストの末尾なので O(1)"""
+        ids = self._ids
+        return ids[-1] if ids else None
+
+    def create_question(self, q: str, a: str, b: str) -> dict:
+        with self._lock:
+            self._apply_changes()
+            question = self.repository.insert_question(q, a, b)
+            self._questions[question["id"]] = question
+            ids = list(self._ids)
+            insort(ids, question["id"])
+            self._ids = ids
+            self.questions_version += 1
+        return question
+
+    def update_question(self, question_id: int, **fields) -> Optional[dict]:
+        with self._lock:
+            self._apply_changes()
+            question = self._questions.get(question_id)
+            if question is None:
+                return None
+            updated = dict(question)
+            for key, value in fields.items():
+                if value is not None:
+                    updated[key] = value
+            if not self.repository.update_question(updated):
+                return None
+            self._questions[question_id] = updated
+            self.questions_version += 1
+            self._notify({question_id})
+        return updated
+
+    def delete_question(self, question_id: int) -> bool:
+        with self._lock:
+            self._apply_changes()
+            if question_id not in self._questions:
+                return False
+            self.repository.delete_question(question_id)
+            del self._questions[question_id]
+            # 投票の削除はバックグラウンドに任せる
+            self._wake.set()
+            self._ids = [i for i in self._ids if i != question_id]
+            self._forget_votes(question_id)
+            self.questions_version += 1
+            self._notify({question_id})
+        return True
+
+    # --- 投票 ---
+
+    def add_votes(self, votes: List[dict]) -> Future:
+        """投票をグループコミットに登録する
+
+        返り値の Future はコミット完了後、投票ごとの結果のリストになる。
+        コミットまでの間にお題が削除された投票は保存されず、結果は None になる。
+        同じ vote_id の投票を受け付け済み（同じバッチ内の重複も含む）なら保存されず、結果は DUPLICATE になる。
+        """
+        return self.committer.submit(votes)
+
+    def _commit_votes(self, batch: List[dict]) -> List[Union[dict, str, None]]:
+        """グループコミット用スレッドから呼ばれ、バッチを一度に保存して集計に反映する"""
+        with self._lock:
+            self._apply_changes()
+            results: List[Union[dict, str, None]] = []
+            batch_ids = set()
+            for v in batch:
+                vote_id = v.get("vote_id")
+                if vote_id is not None and (vote_id in self._vote_ids or vote_id in batch_ids):
+                    results.append(DUPLICATE)
+                elif v["question_id"] not in self._questions:
+                    results.append(None)
+                else:
+                    results.append(v)
+                    if vote_id is not None:
+                        batch_ids.add(vote_id)
+            accepted = [v for v in results if isinstance(v, dict)]
+            # 保存に失敗した投票は再送で受け付けられるよう、vote_id は保存が終わってから覚える
+            self.repository.append_votes(accepted)
+            for v in accepted:
+                self._count_vote(v)
+                self._remember_vote_id(v)
+            self._appended += len(accepted)
+            if self._appended >= self.compact_threshold:
+                self._wake.set()
+            if accepted:
+                self._notify({v["question_id"] for v in accepted})
+        return results
+
+    def question_count(self) -> int:
+        return len(self._questions)
+
+    def vote_count(self) -> int:
+        """全お題の票数の合計"""
+        return sum(a + b for a, b in list(self._tallies.values()))
+
+    def vote_version(self, question_id: int) -> int:
+        """お題の集計が変わるたびに増える番号"""
+        return self._vote_versions.get(question_id, 0)
+
+    def tally(self, question_id: int) -> Tuple[int, int]:
+        """(Aの票数, Bの票数) を返す"""
+        counts = self._tallies.get(question_id)
+        if counts is None:
+            return 0, 0
+        return counts[0], counts[1]
+
+    def tally_many(self, question_ids: Iterable[int]) -> Dict[int, Tuple[int, int]]:
+        """{question_id: (Aの票数, Bの票数)}。投票のたびに更新している集計を引くだけで、投票は読み直さない"""
+        tallies = self._tallies
+        return {question_id: tuple(tallies.get(question_id, (0, 0))) for question_id in question_ids}
+
+    def tally_between(self, question_id: int, since: Optional[str] = None, until: Optional[str] = None) -> Tuple[int, int]:
+        """投票時刻が since 以上 until 未満の (Aの票数, Bの票数)
+
+        分単位の集計から数えるので、範囲は分単位（秒以下は切り捨てて比べる）。
+        """
+        if since is None and until is None:
+            return self.tally(question_id)
+        since_minute = vote_minute(since) if since is not None else None
+        until_minute = vote_minute(until) if until is not None else None
+        votes_A = votes_B = 0
+        for minute, (a, b) in list(self._rollups.get(question_id, {}).items()):
+            if (since_minute is None or minute >= since_minute) and (until_minute is None or minute < until_minute):
+                votes_A += a
+                votes_B += b
+        return votes_A, votes_B
+
+    def export_votes(
+        self, question_id: Optional[int] = None, since: Optional[str] = None, until: Optional[str] = None,
+    ) -> Iterator[dict]:
+        """投票を1件ずつ返す（書き出し用）。削除済みのお題の投票は含めない
+
+        リポジトリのファイルや DB を直接読むので、イベントループの外で回すこと。
+        ロックは最初に開くときだけ取り、読んでいる間も投票は受け付けられる。
+        """
+        question_ids = set(self._questions) if question_id is None else {question_id} & self._questions.keys()
+        return self.repository.export_votes(question_ids, since, until)
+
+    def timeline(self, question_id: int, bucket_seconds: int) -> List[Tuple[datetime, int, int]]:
+        """bucket_seconds 秒ごとの (区間の開始時刻, Aの票数, Bの票数) を時刻順に返す
+
+        分単位の集計をまとめ直すだけなので、投票の総数ではなく投票があった分の数に比例する。
+        区間は 1970-01-01 00:00 を起点に区切る（bucket_seconds は 60 の倍数）。
+        """
+        minutes = self._rollups.get(question_id)
+        if not minutes:
+            return []
+        buckets: Dict[datetime, List[int]] = {}
+        for minute, (votes_A, votes_B) in list(minutes.items()):
+            try:
+                at = datetime.fromisoformat(minute)
+            except ValueError:
+                continue
+            offset = int((at - EPOCH).total_seconds()) // bucket_seconds * bucket_seconds
+            counts = buckets.setdefault(EPOCH + timedelta(seconds=offset), [0, 0])
+            counts[0] += votes_A
+            counts[1] += votes_B
+        return [(start, counts[0], counts[1]) for start, counts in sorted(buckets.items())]
@@ -0,0 +1,153 @@
+"""
+投票のストレステスト - 複数ワーカーの uvicorn に同時に投票し、最終的な票数が1票もずれないことを確かめる
+
+使い方:
+    python stress_votes.py --workers 4 --votes 5000 --concurrency 64
+    python stress_votes.py --backend sqlite
+
+一時ディレクトリにデータを作ってサーバーを起動するため、data/ や vote_app.db には触れない。
+1. お題を並行して作成し、id が重複しないことを確認する
+2. 全ワーカーに向けて並行に投票する（畳み込みの間隔を短くして、投票の最中に何度も畳み込ませる）
+3. 各お題の結果を何度も取得し（毎回どのワーカーが応答しても）期待値と一致することを確認する
+4. サーバーを止めて1ワーカーで起動し直し、保存された票数も一致することを確認する
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+BASE_DIR = Path(__file__).resolve().parent
+
+
+def start_server(
+    port: int, workers: int, backend: str, data_dir: Path,
+    compact_interval: float = 0.3, compact_threshold: int = 50,
+) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "WEB_CONCURRENCY": str(workers),
+        "STORAGE_BACKEND": backend,
+        "DATA_DIR": str(data_dir),
+        "SQLITE_PATH": str(data_dir / "vote_app.db"),
+        # 投票の最中にも各ワーカーが何度も畳み込むようにして、切り詰めと他のワーカーの読み込みを競合させる
+        "VOTE_COMPACT_INTERVAL": str(compact_interval),
+        "VOTE_COMPACT_THRESHOLD": str(compact_threshold),
+    })
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=BASE_DIR, env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/api/questions", timeout=1).ok:
+                # 全ワーカーの起動を待つ
+                time.sleep(1.0)
+                return proc
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("サーバーが起動しませんでした")
+
+
+def stop_server(proc: subprocess.Popen):
+    proc.terminate()
+    proc.wait(timeout=30)
+
+
+def check_results(base_url: str, expected: Counter, question_ids, repeat: int) -> bool:
+    ok = True
+    for question_id in question_ids:
+        for _ in range(repeat):
+            r = requests.get(f"{base_url}/api/results", params={"question_id": question_id}).json()
+            got = (r["votes_A"], r["votes_B"])
+            want = (expected[(question_id, "A")], expected[(question_id, "B")])
+            if got != want:
+                print(f"  NG お題 {question_id}: 期待値 {want} / 実際 {got}")
+                ok = False
+                break
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--votes", type=int, default=5000)
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--compact-interval", type=float, default=0.3, help="畳み込みの間隔（秒）")
+    parser.add_argument("--compact-threshold", type=int, default=50, help="畳み込むまでの投票数")
+    args = parser.parse_args()
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(tmp)
+        proc = start_server(
+            args.port, args.workers, args.backend, data_dir, args.compact_interval, args.compact_threshold
+        )
+        try:
+            # 1. お題を並行して作成
+            with ThreadPoolExecutor(args.concurrency) as pool:
+                created = list(pool.map(
+                    lambda i: requests.post(f"{base_url}/api/question", json={"q": f"stress {i}", "a": "A", "b": "B"}).json(),
+                    range(args.questions),
+                ))
+            question_ids = [q["id"] for q in created]
+            if len(set(question_ids)) != len(question_ids):
+                print(f"NG: お題の id が重複しました {question_ids}")
+                return 1
+            print(f"お題を作成: {question_ids}")
+
+            # 2. 並行に投票
+            plan = [(random.choice(question_ids), random.choice("AB")) for _ in range(args.votes)]
+            local = threading.local()
+
+            def vote(item):
+                session = getattr(local, "session", None)
+                if session is None:
+                    session = local.session = requests.Session()
+                r = session.post(f"{base_url}/api/vote", json={"question_id": item[0], "choice": item[1]})
+                return r.status_code
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(args.concurrency) as pool:
+                statuses = Counter(pool.map(vote, plan))
+            elapsed = time.perf_counter() - started
+            print(f"{args.votes} 票を {elapsed:.2f} 秒で送信（{args.votes / elapsed:.0f} 票/秒）: {dict(statuses)}")
+            if statuses != Counter({200: args.votes}):
+                print("NG: 失敗した投票があります")
+                return 1
+
+            expected = Counter(plan)
+            # 3. どのワーカーが応答しても正しいこと
+            if not check_results(base_url, expected, question_ids, repeat=args.workers * 2):
+                return 1
+            print("OK: 全ワーカーの集計が一致")
+        finally:
+            stop_server(proc)
+
+        # 4. 保存された内容から起動し直しても一致すること
+        proc = start_server(args.port, 1, args.backend, data_dir, args.compact_interval, args.compact_threshold)
+        try:
+            if not check_results(base_url, expected, question_ids, repeat=1):
+                return 1
+            print("OK: 再起動後の集計が一致")
+        finally:
+            stop_server(proc)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
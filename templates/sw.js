@@ -0,0 +1,58 @@
+// サービスワーカー - 画面（/）と static/ をキャッシュし、2回目以降の訪問は通信を待たずに表示する
+// （サーバーがテンプレートとして描画し、/sw.js で返す）
+//
+// - インストール時に SHELL_URLS を取っておく
+// - static/dist/ のハッシュ付きのファイルは中身が変わらないので、キャッシュがあればそれだけを返す
+// - 画面とそれ以外の static/ はキャッシュがあればそれを返し、裏で取り直してキャッシュを更新する
+//   （更新した内容は次の訪問から使われる）
+// - /api/ は扱わない（app.js のキャッシュに任せる）
+// CACHE_NAME には静的ファイルの版が入るので、build_assets.py でビルドし直すと新しいキャッシュに
+// 切り替わる（古いキャッシュは activate で消える）。中身の形を変えたら v の番号を上げる
+const CACHE_NAME = 'the-decision-v1-{{ assets_version }}';
+const SHELL_URLS = ['/', '{{ asset("css/style.css") }}', '{{ asset("js/app.js") }}'];
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(CACHE_NAME)
+            .then(cache => cache.addAll(SHELL_URLS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(names.filter(name => name !== CACHE_NAME).map(name => caches.delete(name))))
+            .then(() => self.clients.claim())
+    );
+});
+
+function isCacheable(url) {
+    return url.origin === self.location.origin && (url.pathname === '/' || url.pathname.startsWith('/static/'));
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (request.method !== 'GET' || !isCacheable(url)) return;
+
+    event.respondWith(
+        caches.open(CACHE_NAME).then(async cache => {
+            // 画面はクエリ文字列が違っても同じものを返す
+            const key = url.pathname === '/' ? '/' : request;
+            const cached = await cache.match(key);
+            if (cached && url.pathname.startsWith('/static/dist/')) {
+                return cached;
+            }
+            const refresh = fetch(request).then(response => {
+                if (response.ok) cache.put(key, response.clone());
+                return response;
+            });
+            if (cached) {
+                event.waitUntil(refresh.catch(() => {}));
+                return cached;
+            }
+            return refresh;
+        })
+    );
+});
@@ -0,0 +1,225 @@
+"""
+列指向の投票データ - 投票を辞書のリストではなく、項目ごとの配列として持つ
+
+投票1件を辞書で持つと、キー4つ・"A"/"B" の文字列・26文字の時刻文字列で数百バイトになる。
+ここでは項目ごとに詰めた配列に分けて持つ。
+
+    question_ids  array('i')  4 バイト
+    choices       ビット列    1/8 バイト（1 なら B）
+    voted_at      array('q')  8 バイト（1970-01-01 からのマイクロ秒。タイムゾーンなしのローカル時刻）
+    user_ids      array('i')  4 バイト（名前は一度だけ登録し、その番号を持つ。0 は名前なし）
+
+1票あたり 16.1 バイト、配列の予備領域を含めて約 17 バイト（名前そのものの分は、異なる名前の数にだけ比例する）。
+集計と絞り込みは zip / Counter / itertools.compress と、ビット列の一括変換で行い、
+1票ごとに Python の処理を挟まないようにしている。
+
+    python vote_columns.py 1000000   # 1票あたりのメモリを測り、上限を超えていたら終了コード 1
+"""
+import sys
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import compress
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+MICROS_PER_MINUTE = 60_000_000
+
+# 1票あたりのメモリの上限（名前の文字列を除く。配列の予備領域を含めた目安）
+MAX_BYTES_PER_VOTE = 20
+
+# 0/1 のバイト列とビット列を変換するための表
+_BITS_TO_ASCII = bytes.maketrans(b"\x00\x01", b"01")
+_ASCII_TO_BITS = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def to_micros(voted_at: str) -> int:
+    at = datetime.fromisoformat(voted_at)
+    if at.tzinfo is not None:
+        at = at.astimezone().replace(tzinfo=None)
+    return (at - EPOCH) // ONE_MICROSECOND
+
+
+def from_micros(micros: int) -> str:
+    return (EPOCH + timedelta(microseconds=micros)).isoformat()
+
+
+def minute_label(minute: int) -> str:
+    """1970-01-01 からの分数を "2025-01-01T10:05" の形にする（repository.vote_minute と同じ形）"""
+    return (EPOCH + timedelta(minutes=minute)).isoformat()[:16]
+
+
+def _unpack_bits(bitmap: bytes, count: int) -> bytes:
+    """ビット列を、1票1バイト（0 か 1）のバイト列に広げる"""
+    if count == 0:
+        return b""
+    text = format(int.from_bytes(bitmap, "little"), f"0{count}b")[::-1][:count]
+    return text.encode("ascii").translate(_ASCII_TO_BITS)
+
+
+def _pack_bits(flags: bytes) -> bytearray:
+    """1票1バイト（0 か 1）のバイト列をビット列に詰める"""
+    if not flags:
+        return bytearray()
+    value = int(flags.translate(_BITS_TO_ASCII)[::-1], 2)
+    return bytearray(value.to_bytes((len(flags) + 7) // 8, "little"))
+
+
+class VoteColumns:
+    def __init__(self):
+        self.question_ids = array("i")
+        self.voted_at = array("q")
+        self.user_ids = array("i")
+        self._choices = bytearray()
+        self._names: List[Optional[str]] = [None]
+        self._name_ids: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.question_ids)
+
+    def _intern(self, user_name: Optional[str]) -> int:
+        if user_name is None:
+            return 0
+        name_id = self._name_ids.get(user_name)
+        if name_id is None:
+            name_id = self._name_ids[user_name] = len(self._names)
+            self._names.append(user_name)
+        return name_id
+
+    def append(self, vote: dict):
+        n = len(self.question_ids)
+        if n % 8 == 0:
+            self._choices.append(0)
+        if vote["choice"] == "B":
+            self._choices[n >> 3] |= 1 << (n & 7)
+        self.question_ids.append(vote["question_id"])
+        self.voted_at.append(to_micros(vote["voted_at"]))
+        self.user_ids.append(self._intern(vote.get("user_name")))
+
+    def extend(self, votes: Iterable[dict]):
+        for vote in votes:
+            self.append(vote)
+
+    def choices(self) -> bytes:
+        """1票1バイトの選択（0 なら A、1 なら B）"""
+        return _unpack_bits(self._choices, len(self))
+
+    # --- 集計・絞り込み ---
+
+    def tally(self) -> Dict[int, Tuple[int, int]]:
+        """{question_id: (Aの票数, Bの票数)}"""
+        tallies: Dict[int, List[int]] = {}
+        for (question_id, choice), count in Counter(zip(self.question_ids, self.choices())).items():
+            tallies.setdefault(question_id, [0, 0])[choice] = count
+        return {question_id: (c[0], c[1]) for question_id, c in tallies.items()}
+
+    def minute_counts(self) -> Dict[Tuple[int, int], List[int]]:
+        """{(question_id, 1970-01-01 からの分数): [Aの票数, Bの票数]}"""
+        minutes = map(MICROS_PER_MINUTE.__rfloordiv__, self.voted_at)
+        counts: Dict[Tuple[int, int], List[int]] = {}
+        for (question_id, minute, choice), count in Counter(zip(self.question_ids, minutes, self.choices())).items():
+            counts.setdefault((question_id, minute), [0, 0])[choice] = count
+        return counts
+
+    def rollup(self) -> Dict[int, Dict[str, List[int]]]:
+        """{question_id: {"2025-01-01T10:05": [Aの票数, Bの票数]}}（分単位の集計）"""
+        labels: Dict[int, str] = {}
+        rollups: Dict[int, Dict[str, List[int]]] = {}
+        for (question_id, minute), counts in self.minute_counts().items():
+            label = labels.get(minute)
+            if label is None:
+                label = labels[minute] = minute_label(minute)
+            rollups.setdefault(question_id, {})[label] = counts
+        return rollups
+
+    @classmethod
+    def from_arrays(
+        cls, question_ids: array, voted_at: array, user_ids: array, choices: bytes, names: List[Optional[str]]
+    ) -> "VoteColumns":
+        """列をそのまま持つ VoteColumns を作る（choices は1票1バイト、names[0] は None）"""
+        result = cls()
+        result.question_ids = question_ids
+        result.voted_at = voted_at
+        result.user_ids = user_ids
+        result._choices = _pack_bits(choices)
+        result._names = names
+        result._name_ids = {name: i for i, name in enumerate(names) if i}
+        return result
+
+    def names(self) -> List[Optional[str]]:
+        """user_ids が指す名前の一覧（0 番は None）"""
+        return self._names
+
+    def without_questions(self, question_ids: Set[int]) -> "VoteColumns":
+        """question_ids のお題への投票を除いた新しい VoteColumns を返す"""
+        keep = bytes(question_id not in question_ids for question_id in self.question_ids)
+        result = VoteColumns()
+        result.question_ids = array("i", compress(self.question_ids, keep))
+        result.voted_at = array("q", compress(self.voted_at, keep))
+        result.user_ids = array("i", compress(self.user_ids, keep))
+        result._choices = _pack_bits(bytes(compress(self.choices(), keep)))
+        result._names = self._names
+        result._name_ids = self._name_ids
+        return result
+
+    def __iter__(self) -> Iterator[dict]:
+        names = self._names
+        for question_id, choice, micros, user_id in zip(self.question_ids, self.choices(), self.voted_at, self.user_ids):
+            yield {
+                "question_id": question_id,
+                "choice": "B" if choice else "A",
+                "user_name": names[user_id],
+                "voted_at": from_micros(micros),
+            }
+
+    def nbytes(self) -> int:
+        """配列が確保しているメモリ（名前の文字列を除く）"""
+        return sum(sys.getsizeof(column) for column in (self.question_ids, self.voted_at, self.user_ids, self._choices))
+
+
+def main():
+    """count 件の投票を作り、1票あたりのメモリを辞書のリストと比べる"""
+    import tracemalloc
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    names = [None] + [f"user{i}" for i in range(100)]
+    base = datetime(2025, 1, 1)
+
+    def make(i: int) -> dict:
+        return {
+            "question_id": i % 50 + 1,
+            "choice": "AB"[i * 7919 % 3 == 0],
+            "user_name": names[i * 31 % len(names)],
+            "voted_at": (base + timedelta(microseconds=i * 1234567)).isoformat(),
+        }
+
+    tracemalloc.start()
+    columns = VoteColumns()
+    columns.extend(make(i) for i in range(count))
+    columnar = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    dicts = [make(i) for i in range(count)]
+    listed = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    per_vote = columnar / count
+    print(f"{count} 票: 列指向 {per_vote:.1f} バイト/票、辞書のリスト {listed / count:.1f} バイト/票")
+    # 辞書のリストと同じ結果になること
+    expected = Counter((v["question_id"], v["choice"]) for v in dicts)
+    assert columns.tally() == {
+        question_id: (expected[(question_id, "A")], expected[(question_id, "B")])
+        for question_id in {v["question_id"] for v in dicts}
+    }
+    assert list(columns.without_questions({1})) == [v for v in dicts if v["question_id"] != 1]
+    if per_vote > MAX_BYTES_PER_VOTE:
+        print(f"NG: 上限 {MAX_BYTES_PER_VOTE} バイト/票を超えています")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
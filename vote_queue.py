@@ -0,0 +1,239 @@
+"""
+投票の送信待ちキュー - Flet アプリ（base.py）の投票を端末に保存し、裏でまとめてサーバーに送る
+
+- 投票はまず端末の SQLite（QUEUE_PATH）に保存する。サーバーが遅くても止まっていても、
+  アプリを閉じても投票は失われず、画面は送信を待たずに結果（見込み）を出せる
+- VoteSyncer のスレッドが、送信待ちの投票を古い順に最大 SYNC_BATCH 件ずつ
+  POST /api/votes/batch で送る。送れなければ間隔を倍にしながら（最大 MAX_BACKOFF 秒）送り直す。
+  ただし送り直しても通らない 4xx（408 / 429 以外）で断られたバッチは捨てる
+- 投票ごとに端末で vote_id（UUID）を付ける。サーバーに届いたのに応答だけが失われて送り直しても、
+  サーバーは同じ vote_id の投票を二重に数えない
+"""
+import os
+import random
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from api_client import ApiClient, ApiError
+
+# 保存先。Flet でパッケージしたアプリでは FLET_APP_STORAGE_DATA がアプリのデータ置き場になる
+DATA_DIR = Path(os.environ.get("FLET_APP_STORAGE_DATA") or Path.home() / ".the-decision")
+QUEUE_PATH = Path(os.environ.get("VOTE_QUEUE_PATH") or DATA_DIR / "vote_queue.db")
+
+# 1回の送信でまとめる件数
+SYNC_BATCH = 100
+# 送信に失敗したときの待ち時間（秒）。失敗が続くたびに倍にする
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+# 送り直せば通るかもしれない 4xx（これ以外の 4xx は送り直しても同じなので、そのバッチを捨てる）
+RETRYABLE_STATUS = (408, 429)
+# 送信の結果を覚えておく投票の数（画面を作る前に送信が終わっていた投票の結果を出すため）
+RECENT_OUTCOMES = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_votes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    vote_id TEXT NOT NULL UNIQUE,
+    question_id INTEGER NOT NULL,
+    choice TEXT NOT NULL,
+    user_name TEXT,
+    voted_at TEXT NOT NULL
+)
+"""
+
+SQL_INSERT = "INSERT INTO pending_votes (vote_id, question_id, choice, user_name, voted_at) VALUES (?, ?, ?, ?, ?)"
+SQL_PEEK = "SELECT vote_id, question_id, choice, user_name, voted_at FROM pending_votes ORDER BY seq LIMIT ?"
+SQL_DELETE = "DELETE FROM pending_votes WHERE vote_id = ?"
+SQL_CONTAINS = "SELECT 1 FROM pending_votes WHERE vote_id = ?"
+SQL_COUNT = "SELECT COUNT(*) FROM pending_votes"
+SQL_COUNT_BY_CHOICE = "SELECT choice, COUNT(*) FROM pending_votes WHERE question_id = ? GROUP BY choice"
+
+
+class VoteQueue:
+    """端末に保存した送信待ちの投票（どのスレッドからも使える）"""
+
+    def __init__(self, path: Path = QUEUE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # 1文ごとにコミットする（add() が戻った時点でディスクに書き込み済み）
+        self._conn = sqlite3.connect(str(self.path), timeout=30.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add(self, question_id: int, choice: str, user_name: Optional[str] = None) -> dict:
+        """投票を保存し、vote_id を付けた投票を返す"""
+        vote = {
+            "vote_id": uuid.uuid4().hex,
+            "question_id": question_id,
+            "choice": choice,
+            "user_name": user_name,
+            "voted_at": datetime.now().isoformat(),
+        }
+        with self._lock:
+            self._conn.execute(SQL_INSERT, (vote["vote_id"], question_id, choice, user_name, vote["voted_at"]))
+        return vote
+
+    def peek(self, limit: int) -> List[dict]:
+        """送信待ちの投票を古い順に limit 件まで返す（キューからは消さない）"""
+        with self._lock:
+            rows = self._conn.execute(SQL_PEEK, (limit,)).fetchall()
+        return [
+            {"vote_id": r[0], "question_id": r[1], "choice": r[2], "user_name": r[3], "voted_at": r[4]}
+            for r in rows
+        ]
+
+    def remove(self, vote_ids: List[str]):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(SQL_DELETE, [(vote_id,) for vote_id in vote_ids])
+            self._conn.execute("COMMIT")
+
+    def contains(self, vote_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute(SQL_CONTAINS, (vote_id,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(SQL_COUNT).fetchone()[0]
+
+    def pending_tally(self, question_id: int) -> Tuple[int, int]:
+        """お題の送信待ちの (Aの票数, Bの票数)"""
+        with self._lock:
+            counts = dict(self._conn.execute(SQL_COUNT_BY_CHOICE, (question_id,)).fetchall())
+        return counts.get("A", 0), counts.get("B", 0)
+
+
+def estimate_results(client: ApiClient, queue: VoteQueue, question_id: int) -> Dict[str, int]:
+    """最後に受け取った集計結果に送信待ちの投票を足した見込み（通信しない）"""
+    results = client.cached_results(question_id) or {}
+    pending_a, pending_b = queue.pending_tally(question_id)
+    return {
+        "votes_A": results.get("votes_A", 0) + pending_a,
+        "votes_B": results.get("votes_B", 0) + pending_b,
+        "pending": pending_a + pending_b,
+    }
+
+
+# 送信が終わった投票を受け取る関数: (受け付けられた投票, [(断られた投票, 理由)])
+SyncListener = Callable[[List[dict], List[Tuple[dict, str]]], None]
+
+
+class VoteSyncer:
+    """送信待ちの投票を裏のスレッドでサーバーに送る"""
+
+    def __init__(self, queue: VoteQueue, client: ApiClient, batch: int = SYNC_BATCH):
+        self.queue = queue
+        self.client = client
+        self.batch = batch
+        self.last_error: Optional[ApiError] = None  # 直前の送信の失敗（成功したら None）
+        self._listeners: List[SyncListener] = []
+        # 最近送った投票の結果 {vote_id: 断られた理由（受け付けられたら None）}（古い順）
+        self._outcomes: Dict[str, Optional[str]] = {}
+        self._outcomes_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="vote-syncer", daemon=True)
+        self._thread.start()
+        # 前回送りきれなかった投票があれば送る
+        self.wake()
+
+    def close(self):
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wake(self):
+        """新しい投票を保存したら呼ぶ（送り直しの待ち時間中でもすぐに送ってみる）"""
+        self._wake.set()
+
+    def outcome(self, vote_id: str) -> Optional[Tuple[bool, str]]:
+        """送信済みの投票の (受け付けられたか, 断られた理由)。まだ送っていないか、古くて覚えていなければ None"""
+        with self._outcomes_lock:
+            if vote_id not in self._outcomes:
+                return None
+            detail = self._outcomes[vote_id]
+        return (detail is None, detail or "")
+
+    def add_listener(self, listener: SyncListener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: SyncListener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _run(self):
+        delay = 0.0
+        while True:
+            # 失敗が続いている間は、同時に送り直さないよう待ち時間をばらつかせる
+            self._wake.wait(delay * random.uniform(0.5, 1.0) if delay else None)
+            self._wake.clear()
+            if self._stopping:
+                return
+            try:
+                sent = self.sync_once()
+            except ApiError as e:
+                # つながらない・5xx・408 / 429 のときだけ送り直す（それ以外は sync_once がバッチを捨てている）
+                self.last_error = e
+                delay = min(delay * 2, MAX_BACKOFF) if delay else MIN_BACKOFF
+                continue
+            self.last_error = None
+            delay = 0.0
+            if sent == self.batch:
+                # まだ残っているかもしれない
+                self._wake.set()
+
+    def sync_once(self) -> int:
+        """送信待ちの投票を1回分送り、送った件数を返す
+
+        送り直せば通るかもしれない失敗（つながらない・5xx・408 / 429）は ApiError を送出し、キューはそのまま。
+        それ以外の 4xx は送り直しても通らないので、後ろの投票が詰まらないようバッチごと断られたものとして捨てる。
+        """
+        votes = self.queue.peek(self.batch)
+        if not votes:
+            return 0
+        accepted: List[dict] = []
+        rejected: List[Tuple[dict, str]] = []
+        try:
+            response = self.client.post_votes(votes)
+        except ApiError as e:
+            if e.status is None or e.status >= 500 or e.status in RETRYABLE_STATUS:
+                raise
+            rejected = [(vote, str(e)) for vote in votes]
+        else:
+            for vote, result in zip(votes, response["results"]):
+                # 受け付け済み（duplicate）も成功。断られた投票（お題の削除など）は送り直しても通らないので捨てる
+                if result["success"]:
+                    accepted.append(vote)
+                else:
+                    rejected.append((vote, result.get("detail", "")))
+        # キューから消す前に結果を残す（キューにない投票は、必ず結果を引ける）
+        self._remember(accepted, rejected)
+        self.queue.remove([vote["vote_id"] for vote in votes])
+        for listener in list(self._listeners):
+            listener(accepted, rejected)
+        return len(votes)
+
+    def _remember(self, accepted: List[dict], rejected: List[Tuple[dict, str]]):
+        with self._outcomes_lock:
+            for vote in accepted:
+                self._outcomes[vote["vote_id"]] = None
+            for vote, detail in rejected:
+                self._outcomes[vote["vote_id"]] = detail
+            while len(self._outcomes) > RECENT_OUTCOMES:
+                del self._outcomes[next(iter(self._outcomes))]